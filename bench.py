@@ -0,0 +1,644 @@
+# Benchmarks for the handlers and the query engines.
+# Run all of them with "python bench.py" or only some with "python bench.py sqlite_connections ..."
+# The paths below are the same used in test.py, change them depending on where the data are.
+
+import os
+import asyncio
+import csv
+import gzip
+import io
+import json
+import random
+import sys
+import threading
+import tempfile
+import time
+import tracemalloc
+from os import sep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from SPARQLWrapper import SPARQLWrapper, JSON
+from impl import JournalUploadHandler, CategoryUploadHandler, CategoryQueryHandler, JournalQueryHandler
+from impl import BasicQueryEngine, FullQueryEngine, Journal
+from impl import AsyncJournalQueryHandler, AsyncCategoryQueryHandler, AsyncFullQueryEngine
+
+journal = "data" + sep + "doaj.csv"
+category = "data" + sep + "scimago.json"
+
+
+def synthetic_scimago(journal_path, path, journals=8000):
+    """
+    writes a scimago json file for the first journals of the doaj csv file, with categories, quartiles and
+    areas chosen at random but always the same ones, so the benchmarks can run without the real export
+    """
+    generator = random.Random(1)
+    categories = [f"Category {i}" for i in range(300)]
+    areas = [f"Area {i}" for i in range(27)]
+    with open(journal_path, encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))[1:journals + 1]
+    items = []
+    for row in rows:
+        identifiers = [i for i in (row[1], row[2]) if i]
+        if not identifiers:
+            continue
+        items.append({"identifiers": identifiers,
+                      "categories": [{"id": c, "quartile": generator.choice(["Q1", "Q2", "Q3", "Q4"])}
+                                     for c in generator.sample(categories, generator.randint(1, 8))],
+                      "areas": generator.sample(areas, generator.randint(1, 4))})
+    # a category without quartile, like some of the real ones
+    items.append({"identifiers": ["0000-0001"], "categories": [{"id": "NoQ"}], "areas": ["Area 0"]})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(items, f)
+
+
+if not os.path.exists(category):
+    # the scimago export is not in the repository, the benchmarks use a synthetic one
+    category = os.path.join(tempfile.gettempdir(), "bench_scimago.json")
+    if not os.path.exists(category):
+        synthetic_scimago(journal, category)
+
+
+def timed(function, repeat=1):
+    """
+    returns the average seconds spent by function over repeat calls
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_sqlite_connections(requests=500):
+    # the same query sent at a steady rate, with the pooled connection of the handler
+    # and with a new connection for every query like before
+    with tempfile.TemporaryDirectory() as folder:
+        relational = os.path.join(folder, "bench.db")
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(relational)
+        u.pushDataToDb(category)
+
+        q = CategoryQueryHandler()
+        q.setDbPathOrUrl(relational)
+        pooled = timed(lambda: q.getCategoriesAssignedToAreas({"Medicine"}), requests)
+
+        def new_connection():
+            q.close()
+            q.getCategoriesAssignedToAreas({"Medicine"})
+        fresh = timed(new_connection, requests)
+        q.close()
+
+    print(f"sqlite_connections: new connection {fresh * 1000:.3f} ms/query, "
+          f"pooled connection {pooled * 1000:.3f} ms/query")
+
+
+def bench_category_upsert():
+    # the whole file replaced, and 1% of its items merged into the existing tables
+    with tempfile.TemporaryDirectory() as folder:
+        relational = os.path.join(folder, "bench.db")
+        delta = os.path.join(folder, "delta.json")
+        with open(category, encoding="utf-8") as f:
+            items = json.load(f)
+        with open(delta, "w", encoding="utf-8") as f:
+            json.dump([dict(item, areas=item.get("areas", [])[:1]) for item in items[::100]], f)
+
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(relational)
+        replace = timed(lambda: u.pushDataToDb(category))
+        u.setUpsert(True)
+        upsert = timed(lambda: u.pushDataToDb(delta))
+    print(f"category_upsert: replace {len(items)} items {replace * 1000:.0f} ms, "
+          f"upsert {len(items[::100])} items {upsert * 1000:.0f} ms")
+
+
+def bench_category_upload_memory():
+    # peak memory of the upload, compared with only loading the whole file with json.load
+    with tempfile.TemporaryDirectory() as folder:
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(os.path.join(folder, "bench.db"))
+        tracemalloc.start()
+        seconds = timed(lambda: u.pushDataToDb(category))
+        streaming = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        with open(category, encoding="utf-8") as f:
+            json.load(f)
+        loaded = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f"category_upload_memory: upload {seconds * 1000:.0f} ms with a peak of {streaming / 1024 / 1024:.1f} MiB, "
+          f"json.load alone {loaded / 1024 / 1024:.1f} MiB")
+
+
+class SparqlServer(object):
+    """
+    a SPARQL endpoint answering the queries with the local graph of dbPathOrUrl, used to compare
+    the HTTP path with the in-process one on the same data
+    """
+
+    def __init__(self, dbPathOrUrl, latency=0):
+        handler = JournalQueryHandler()
+        handler.setDbPathOrUrl(dbPathOrUrl)
+        answers = {} # query -> body of the answer, used when latency is set to time only the network
+        self.connections = 0 # connections opened by the clients
+        self.sent = 0 # bytes of the answers, and before compressing them
+        self.uncompressed = 0
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True # the headers and the body are written separately
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def answer(self, query):
+                if latency:
+                    if query not in answers:
+                        answers[query] = json.dumps(handler._query_local_graph(query)).encode("utf-8")
+                    time.sleep(latency)
+                    body = answers[query]
+                else:
+                    body = json.dumps(handler._query_local_graph(query)).encode("utf-8")
+                self.send_response(200)
+                server.uncompressed += len(body)
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, 1)
+                    self.send_header("Content-Encoding", "gzip")
+                server.sent += len(body)
+                self.send_header("Content-Type", "application/sparql-results+json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.answer(parse_qs(urlparse(self.path).query)["query"][0])
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.answer(parse_qs(self.rfile.read(length).decode("utf-8"))["query"][0])
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+        self.url = "http://127.0.0.1:%d/sparql" % self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_local_graph(repeat=5):
+    u = JournalUploadHandler()
+    u.setDbPathOrUrl("memory://bench")
+    u.pushDataToDb(journal)
+
+    local = JournalQueryHandler()
+    local.setDbPathOrUrl("memory://bench")
+    local.cache = None
+    issns = [i for ids in journal_dataframe(journal)["identifiers"][:50] for i in ids[:1]]
+    with SparqlServer("memory://bench") as server:
+        remote = JournalQueryHandler()
+        remote.setDbPathOrUrl(server.url)
+        remote.cache = None
+        for name, query in (("getById", lambda h: h.getById("2414-990X")),
+                            ("getByIds (50 ISSNs)", lambda h: h.getByIds(issns))):
+            query(local) # the first query also parses the SPARQL grammar
+            local_time = timed(lambda: query(local), repeat)
+            http_time = timed(lambda: query(remote), repeat)
+            print(f"local_graph: {name} over HTTP {http_time * 1000:.1f} ms, in process {local_time * 1000:.1f} ms")
+
+
+def bench_sparql_session(requests=200):
+    # the same queries with a new SPARQLWrapper for each one like before, and with the session of the handler
+    u = JournalUploadHandler()
+    u.setDbPathOrUrl("memory://bench_session")
+    u.pushDataToDb(journal)
+    issns = [ids[0] for ids in journal_dataframe(journal)["identifiers"][:requests]]
+    with SparqlServer("memory://bench_session", latency=0.001) as server:
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl(server.url)
+        q.cache = None
+        for issn in issns:
+            q.getById(issn) # the endpoint computes its answers
+
+        def new_connection(issn):
+            sparql = SPARQLWrapper(server.url)
+            sparql.setReturnFormat(JSON)
+            sparql.setQuery(q._by_id_query(issn))
+            return q._decode_results(sparql.queryAndConvert())
+
+        for name, query in (("new SPARQLWrapper", new_connection), ("session", q.getById)):
+            server.connections = server.sent = 0
+            seconds = timed(lambda: [query(issn) for issn in issns]) / len(issns)
+            print(f"sparql_session: {name} {seconds * 1000:.2f} ms/query, {server.connections} connections opened, "
+                  f"{server.sent / len(issns):.0f} bytes/answer")
+        q.close()
+
+
+def previous_decode_results(result):
+    # the previous version of JournalQueryHandler._decode_results
+    journals_data = {}
+    for row in result["results"]["bindings"]:
+        journal_uri = row.get("journal", {}).get("value")
+        if not journal_uri:
+            continue
+        if journal_uri not in journals_data:
+            journals_data[journal_uri] = {}
+            for var in result["head"]["vars"]:
+                journals_data[journal_uri][var] = row.get(var, {}).get("value", "") if var not in ["identifiers", "languages"] else []
+        for var in result["head"]["vars"]:
+            value = row.get(var, {}).get("value")
+            if var == "identifiers" and value not in journals_data[journal_uri]["identifiers"]:
+                journals_data[journal_uri]["identifiers"].append(value)
+            elif var == "languages" and value not in journals_data[journal_uri]["languages"]:
+                journals_data[journal_uri]["languages"].append(value)
+            elif var not in ["journal", "identifiers", "languages"]:
+                journals_data[journal_uri][var] = value
+    return pd.DataFrame(list(journals_data.values())).replace(np.nan, "")
+
+
+def recorded_response(bindings=200000):
+    """
+    the response of the endpoint to getAllJournals, with the journals repeated under other IRIs
+    until it has the given number of bindings
+    """
+    q = JournalQueryHandler()
+    q.setDbPathOrUrl("memory://bench_decode")
+    if q.getAllJournals().empty:
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl("memory://bench_decode")
+        u.pushDataToDb(journal)
+    result = q._query_local_graph(q._all_journals_query())
+    rows = []
+    copy = 0
+    while len(rows) < bindings:
+        for row in result["results"]["bindings"][:bindings - len(rows)]:
+            rows.append(dict(row, journal={"value": row["journal"]["value"] + "-" + str(copy)}))
+        copy += 1
+    return {"head": result["head"], "results": {"bindings": rows}}
+
+
+def bench_decode_results(repeat=3):
+    result = recorded_response()
+    variables = result["head"]["vars"]
+    body = json.dumps(result).encode("utf-8")
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator="\r\n")
+    writer.writerow(variables)
+    for row in result["results"]["bindings"]:
+        writer.writerow([row[var]["value"] if var in row else "" for var in variables])
+    text = text.getvalue()
+
+    q = JournalQueryHandler()
+    previous = timed(lambda: previous_decode_results(json.loads(body.decode("utf-8"))), repeat)
+    current = timed(lambda: q._decode_results(body), repeat)
+    q.setResultFormat("csv")
+    from_csv = timed(lambda: q._decode_results(text), repeat)
+    print(f"decode_results: {len(result['results']['bindings'])} bindings, previous decoder {previous * 1000:.0f} ms, "
+          f"one pass {current * 1000:.0f} ms ({len(body) / 1024 / 1024:.1f} MiB of JSON), "
+          f"from CSV {from_csv * 1000:.0f} ms ({len(text) / 1024 / 1024:.1f} MiB)")
+
+
+def bench_journal_payload():
+    # getAllJournals over HTTP with a row for each identifier and language, and with a row for each journal
+    u = JournalUploadHandler()
+    u.setDbPathOrUrl("memory://bench_payload")
+    u.pushDataToDb(journal)
+    with SparqlServer("memory://bench_payload") as server:
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl(server.url)
+        q.cache = None
+        for aggregate in (False, True):
+            q.aggregate = aggregate
+            server.sent = server.uncompressed = 0
+            seconds = timed(q.getAllJournals)
+            print(f"journal_payload: {'GROUP_CONCAT' if aggregate else 'one row per identifier and language'} "
+                  f"{server.uncompressed / 1024 / 1024:.1f} MiB ({server.sent / 1024 / 1024:.1f} MiB with gzip), "
+                  f"{len(q.getAllJournals())} journals in {seconds * 1000:.0f} ms")
+        q.close()
+
+
+def bench_journal_pages(size=1000):
+    # the first page against the whole catalogue, and the peak memory of an export that goes through all of it
+    u = JournalUploadHandler()
+    u.setDbPathOrUrl("memory://bench_pages")
+    u.pushDataToDb(journal)
+    q = JournalQueryHandler()
+    q.setDbPathOrUrl("memory://bench_pages")
+    q.cache = None
+    engine = BasicQueryEngine()
+    engine.handlerTimeout = None # rdflib is much slower while tracemalloc is on
+    engine.addJournalHandler(q)
+
+    def peak(function):
+        tracemalloc.start()
+        function()
+        used = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return used
+
+    def export():
+        for _ in engine.iterJournals(pageSize=size):
+            pass
+
+    first_page = timed(lambda: engine.getJournalsPage(size))
+    everything = timed(engine.getAllJournals)
+    streamed = timed(export)
+    print(f"journal_pages: first {size} journals {first_page * 1000:.0f} ms, getAllJournals {everything * 1000:.0f} ms "
+          f"(peak {peak(engine.getAllJournals) / 1024 / 1024:.0f} MiB), iterJournals over all of them "
+          f"{streamed * 1000:.0f} ms (peak {peak(export) / 1024 / 1024:.0f} MiB)")
+
+
+def bench_async_engine(calls=10, latency=0.2):
+    # the same cross queries from the synchronous engine one after the other, and from the asynchronous
+    # engine all at the same time in one event loop, both asking over HTTP an endpoint answering in
+    # latency seconds (the answers are computed once before, so only the waits are measured)
+    u = JournalUploadHandler()
+    u.setDbPathOrUrl("memory://bench_async")
+    u.pushDataToDb(journal)
+    with tempfile.TemporaryDirectory() as folder, SparqlServer("memory://bench_async", latency) as server:
+        relational = os.path.join(folder, "bench.db")
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(relational)
+        u.pushDataToDb(category)
+        areas = [{area} for area in CategoryQueryHandler(relational).getAllAreas()["area"][:4]]
+
+        engine = FullQueryEngine()
+        async_engine = AsyncFullQueryEngine()
+        for e, jq, cq in ((engine, JournalQueryHandler(), CategoryQueryHandler()),
+                          (async_engine, AsyncJournalQueryHandler(), AsyncCategoryQueryHandler())):
+            jq.setDbPathOrUrl(server.url)
+            jq.cache = None
+            cq.setDbPathOrUrl(relational)
+            cq.cache = None
+            e.addJournalHandler(jq)
+            e.addCategoryHandler(cq)
+
+        def sync_calls(calls):
+            for number in range(calls):
+                engine.getJournalsInAreasWithLicense(areas[number % len(areas)], {"CC BY"})
+
+        async def async_calls():
+            async with async_engine:
+                await asyncio.gather(*(async_engine.getJournalsInAreasWithLicense(areas[number % len(areas)], {"CC BY"})
+                                       for number in range(calls)))
+
+        sync_calls(len(areas)) # the endpoint computes its answers
+        sync_time = timed(lambda: sync_calls(calls))
+        async_time = timed(lambda: asyncio.run(async_calls()))
+    print(f"async_engine: {calls} getJournalsInAreasWithLicense with {latency * 1000:.0f} ms of latency, "
+          f"synchronous {sync_time * 1000:.0f} ms, asynchronous {async_time * 1000:.0f} ms")
+
+
+def bench_planner(areas=4):
+    # a rare license in broad areas, starting from the relational database like before (the identifiers of
+    # all the journals in the areas are looked up in the graph) and from the graph as the planner does
+    u = JournalUploadHandler()
+    u.setDbPathOrUrl("memory://bench_planner")
+    u.pushDataToDb(journal)
+    with tempfile.TemporaryDirectory() as folder:
+        relational = os.path.join(folder, "bench.db")
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(relational)
+        u.pushDataToDb(category)
+        jq = JournalQueryHandler()
+        jq.setDbPathOrUrl("memory://bench_planner")
+        jq.cache = None
+        cq = CategoryQueryHandler()
+        cq.setDbPathOrUrl(relational)
+        cq.cache = None
+        engine = FullQueryEngine()
+        engine.handlerTimeout = None
+        engine.addJournalHandler(jq)
+        engine.addCategoryHandler(cq)
+        area = set(cq.getAllAreas()["area"][:areas])
+        license = {"Public domain"}
+
+        print(engine.explain("getJournalsInAreasWithLicense", area, license).to_string(index=False))
+        planned = timed(lambda: engine.getJournalsInAreasWithLicense(area, license))
+        engine.planner = False
+        sqlite_first = timed(lambda: engine.getJournalsInAreasWithLicense(area, license))
+        cq.close()
+    print(f"planner: getJournalsInAreasWithLicense in {areas} areas with a rare license, "
+          f"relational database first {sqlite_first * 1000:.0f} ms, graph first {planned * 1000:.0f} ms")
+
+
+def cartesian_identifiers_query(area, category_id, category_quartile):
+    # the previous FullQueryEngine._areas_and_categories_query, with a pair of placeholders for each combination
+    combinations = [(cat, quart, ar) for cat in category_id for quart in category_quartile for ar in area]
+    placeholders = ', '.join(['(?, ?, ?)'] * len(combinations))
+    query = f"""
+        SELECT i.identifier AS identifiers
+        FROM identifier i
+        JOIN journal_category jc ON jc.journal_id = i.journal_id
+        JOIN category c ON c.category_pk = jc.category_pk
+        JOIN journal_area ja ON ja.journal_id = i.journal_id
+        JOIN area a ON a.area_pk = ja.area_pk
+        WHERE (c.category_id, c.category_quartile, a.area) IN ({placeholders});
+    """
+    return query, [value for combination in combinations for value in combination]
+
+
+def bench_cross_filters(repeat=5):
+    # the identifiers of getDiamondJournalsInAreasAndCategoriesWithQuartile with all the areas, categories
+    # and quartiles, as all their combinations like before and as three independent predicates
+    with tempfile.TemporaryDirectory() as folder:
+        relational = os.path.join(folder, "bench.db")
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(relational)
+        u.pushDataToDb(category)
+        cq = CategoryQueryHandler(relational)
+        categories = cq.getAllCategories()
+        area = cq.getAllAreas()["area"].tolist()
+        category_id = categories["category_id"].unique().tolist()
+        category_quartile = categories["category_quartile"].unique().tolist()
+
+        cartesian = cartesian_identifiers_query(area, category_id, category_quartile)
+        independent = FullQueryEngine()._identifiers_query(area, category_id, category_quartile)
+        no_filter = FullQueryEngine()._identifiers_query(set(), set(), set())
+        for name, (query, params) in (("combinations", cartesian), ("independent sets", independent), ("empty sets", no_filter)):
+            seconds = timed(lambda: cq._execute_query(query, params), repeat)
+            rows = len(cq._execute_query(query, params))
+            print(f"cross_filters: {name}, {len(params)} parameters, {len(query) + sum(len(str(p)) for p in params)} "
+                  f"characters, {rows} rows, {seconds * 1000:.1f} ms")
+        cq.close()
+
+
+def previous_identifier_links(handler, identifiers):
+    # the previous getCategoryQuartile_mapped and gethasArea_mapped: a placeholder for each identifier, a
+    # query for the categories and one for the areas, both walked with iterrows
+    placeholders = ', '.join(['?'] * len(identifiers))
+    categories = handler._execute_query(f"""
+        SELECT i.identifier AS identifiers, c.category_id, c.category_quartile
+        FROM identifier i
+        JOIN journal_category jc ON jc.journal_id = i.journal_id
+        JOIN category c ON c.category_pk = jc.category_pk
+        WHERE i.identifier IN ({placeholders})
+    """, identifiers)
+    areas = handler._execute_query(f"""
+        SELECT i.identifier AS identifiers, a.area
+        FROM identifier i
+        JOIN journal_area ja ON ja.journal_id = i.journal_id
+        JOIN area a ON a.area_pk = ja.area_pk
+        WHERE i.identifier IN ({placeholders})
+    """, identifiers)
+    identifier_to_categories = {}
+    for index, row in categories.iterrows():
+        values = identifier_to_categories.setdefault(row['identifiers'], [])
+        if row['category_id'] not in values:
+            values.append(row['category_id'])
+    identifier_to_areas = {}
+    for index, row in areas.iterrows():
+        values = identifier_to_areas.setdefault(row['identifiers'], [])
+        if row['area'] not in values:
+            values.append(row['area'])
+    return identifier_to_areas, identifier_to_categories
+
+
+def bench_identifier_links(repeat=3):
+    # the categories and the areas of all the identifiers of the relational database, as createJournalObject
+    # asks them for getAllJournals
+    with tempfile.TemporaryDirectory() as folder:
+        relational = os.path.join(folder, "bench.db")
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(relational)
+        u.pushDataToDb(category)
+        cq = CategoryQueryHandler(relational)
+        identifiers = cq._execute_query("SELECT identifier FROM identifier")["identifier"].tolist()
+        engine = FullQueryEngine()
+        engine.addCategoryHandler(cq)
+
+        previous = timed(lambda: previous_identifier_links(cq, identifiers), repeat)
+        combined = timed(lambda: engine._identifier_links(identifiers), repeat)
+        assert previous_identifier_links(cq, identifiers) == engine._identifier_links(identifiers)
+        # the previous queries cannot have more placeholders than the SQLite variable limit
+        many = identifiers + [f"{n:08d}" for n in range(40000)]
+        failed = previous_identifier_links(cq, many) == ({}, {})
+        many_time = timed(lambda: engine._identifier_links(many), repeat)
+        cq.close()
+    print(f"identifier_links: {len(identifiers)} identifiers, two queries and iterrows {previous * 1000:.0f} ms, "
+          f"one query and grouped {combined * 1000:.0f} ms; {len(many)} identifiers {many_time * 1000:.0f} ms"
+          f"{' (the previous queries fail)' if failed else ''}")
+
+
+def bench_snapshot_cold_start():
+    # a new engine answering its first query, from the graph and from the memory-mapped snapshot
+    with tempfile.TemporaryDirectory() as folder:
+        snapshot = os.path.join(folder, "journals.arrow")
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl("memory://bench_snapshot")
+        u.setSnapshotPath(snapshot)
+        u.pushDataToDb(journal)
+
+        def from_graph():
+            handler = JournalQueryHandler()
+            handler.setDbPathOrUrl("memory://bench_snapshot")
+            handler.cache = None
+            engine = BasicQueryEngine()
+            engine.addJournalHandler(handler)
+            return engine.getJournalsWithTitle("review")
+
+        def from_snapshot():
+            engine = BasicQueryEngine()
+            engine.loadSnapshot(snapshot)
+            return engine.getJournalsWithTitle("review")
+
+        load = timed(lambda: BasicQueryEngine().loadSnapshot(snapshot), 5)
+        graph_time = timed(from_graph)
+        snapshot_time = timed(from_snapshot, 5)
+    print(f"snapshot_cold_start: first query from the graph {graph_time * 1000:.0f} ms, "
+          f"from the snapshot {snapshot_time * 1000:.1f} ms (loading {load * 1000:.1f} ms)")
+
+
+def bench_delta_upload():
+    # the nightly refresh: the same export uploaded again, with 1% of the journals changed
+    with tempfile.TemporaryDirectory() as folder:
+        with open(journal, encoding="utf-8") as f:
+            lines = f.read().splitlines(keepends=True)
+        changed = os.path.join(folder, "doaj.csv")
+        with open(changed, "w", encoding="utf-8") as f:
+            f.write(lines[0])
+            for number, line in enumerate(lines[1:]):
+                f.write(line.replace(",No,", ",Yes,", 1) if number % 100 == 0 else line)
+
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl("memory://bench_delta")
+        for name, path in (("first upload", journal), ("same export", journal), ("1% changed", changed)):
+            seconds = timed(lambda: u.pushDataToDb(path))
+            triples = sum(t.get("triples", 0) for t in u.getBatchTimings())
+            print(f"delta_upload: {name} {seconds * 1000:.0f} ms, {triples} triples inserted, {u.getLastDelta()}")
+
+
+def journal_dataframe(path):
+    """
+    the dataframe returned by JournalQueryHandler.getAllJournals, built directly from the csv file
+    """
+    rows = []
+    u = JournalUploadHandler()
+    for idx, row in u._read_journals(path):
+        rows.append({
+            "journal": str(u._subject(idx, row)),
+            "title": row["Journal title"],
+            "identifiers": [i for i in (row["Journal ISSN (print version)"], row["Journal EISSN (online version)"]) if i],
+            "languages": [l.strip() for l in row["Languages in which the journal accepts manuscripts"].split(",")],
+            "publisher": row["Publisher"],
+            "license": row["Journal license"],
+            "apc": row["APC"],
+            "seal": row["DOAJ Seal"]
+        })
+    return pd.DataFrame(rows)
+
+
+def row_by_row_journals(input_dataframe):
+    # the previous version of BasicQueryEngine.createJournalObject, without categories and areas
+    journal_list = []
+    all_journal_identifiers_set = set()
+    for index, row in input_dataframe.iterrows():
+        all_journal_identifiers_set.update(row['identifiers'])
+    for row in input_dataframe.itertuples(index=False):
+        journal_list.append(Journal(
+            id=row.identifiers,
+            title=row.title,
+            languages=list(row.languages) if isinstance(row.languages, list) and len(row.languages) > 0 else [],
+            publisher=row.publisher if pd.notna(row.publisher) else None,
+            seal=True if pd.notna(row.seal) and str(row.seal.lower()).lower() == 'yes' else False,
+            license=row.license if pd.notna(row.license) else None,
+            apc=True if pd.notna(row.apc) and str(row.apc.lower()).lower() == 'yes' else False,
+            hasCategory=[],
+            hasArea=[]
+        ))
+    return journal_list
+
+
+def bench_create_journal_objects(repeat=5):
+    df = journal_dataframe(journal)
+    engine = BasicQueryEngine()
+    vectorized = timed(lambda: engine.createJournalObject(df), repeat)
+    row_by_row = timed(lambda: row_by_row_journals(df), repeat)
+    print(f"create_journal_objects: {len(df)} journals, row by row {row_by_row * 1000:.1f} ms, "
+          f"vectorized {vectorized * 1000:.1f} ms ({row_by_row / vectorized:.1f}x)")
+
+
+def bench_journal_memory():
+    df = journal_dataframe(journal)
+    engine = BasicQueryEngine()
+    tracemalloc.start()
+    journals = engine.createJournalObject(df)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"journal_memory: {len(journals)} journals, {size / 1024 / 1024:.1f} MiB "
+          f"({size / len(journals):.0f} bytes per journal)")
+
+
+if __name__ == "__main__":
+    benchmarks = {name[len("bench_"):]: f for name, f in sorted(globals().items()) if name.startswith("bench_")}
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()
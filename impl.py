@@ -4,42 +4,81 @@ import numpy as np
 import pandas as pd
 import time
 import re
-from sqlite3 import connect, Error
+import threading
+import functools
+import weakref
+import asyncio
+import inspect
+import hashlib
+import bisect
+import itertools
+import csv
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from sys import intern
+from sqlite3 import connect, Error, sqlite_version_info
 from typing import List, Set
+from urllib.parse import quote
 from SPARQLWrapper import SPARQLWrapper, JSON
 from rdflib import Graph, URIRef, Literal, RDF 
 from rdflib.plugins.stores.sparqlstore import SPARQLUpdateStore
+from rdflib.util import guess_format
+try:
+    import httpx
+except ImportError: # the queries are then sent with SPARQLWrapper, and the asynchronous ones in a thread
+    httpx = None
+_httpx_warnings = set() # the features already reported as missing without httpx, each one is printed once
+
+
+def _warn_without_httpx(feature):
+    if feature not in _httpx_warnings:
+        _httpx_warnings.add(feature)
+        print(f"httpx is not installed, {feature}: install it with pip install httpx")
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError: # only needed for the columnar snapshots
+    pa = None
 
 # ------------------------------------------------------------------------------------------------------
 # Python Objects - Edoardo AM Tarpinelli
 
+def _intern(value):
+    # only strings can be interned, the other values are returned as they are
+    return intern(value) if isinstance(value, str) else value
+
 class IdentifiableEntity(object):
+    # __slots__ instead of a __dict__ for each object, the whole catalogue is kept in memory
+    __slots__ = ("id",)
+
     def __init__(self, identifiers):
-        self.id = set()
-        for item in identifiers:
-            self.id.add(item) # string[1..*]
+        self.id = tuple(dict.fromkeys(identifiers)) # string[1..*], without repetitions
     
     def getIds(self) -> List[str]:
-        return list(self.id) # Convert set to list and sort 
+        return list(self.id)
 
 class Journal(IdentifiableEntity):
+    __slots__ = ("title", "languages", "publisher", "seal", "license", "apc", "hasCategory", "hasArea")
+
     def __init__(self, id, title, languages, publisher, seal, license, apc, hasCategory, hasArea):
         super().__init__(id)
         self.title = title # string[1]
-        self.languages = set()
-        self.languages = languages # string[1..*]
-        self.publisher = publisher if publisher else None # string[0..1]
+        # the same few languages, licences and publishers are repeated by many journals,
+        # interning them keeps only one copy of each string
+        self.languages = tuple(sorted({_intern(language) for language in languages})) # string[1..*], sorted once
+        self.publisher = _intern(publisher) if publisher else None # string[0..1]
         self.seal = seal # boolean[1]
-        self.license = license # string[1]
+        self.license = _intern(license) # string[1]
         self.apc = apc # boolean[1]
-        self.hasCategory = list(hasCategory) if hasCategory else [] # 0..*
-        self.hasArea = list(hasArea) if hasArea else [] # 0..*
+        self.hasCategory = tuple(hasCategory) if hasCategory else () # 0..*
+        self.hasArea = tuple(hasArea) if hasArea else () # 0..*
     
     def getTitle(self):
         return self.title # string
     
     def getLanguages(self): 
-        return sorted(list(self.languages)) # list[string]
+        return list(self.languages) # list[string]
 
     def getPublisher(self):
         return self.publisher 
@@ -60,17 +99,301 @@ class Journal(IdentifiableEntity):
         return list(self.hasArea) # list[Area]
                
 class Category(IdentifiableEntity):
+    __slots__ = ("quartile",)
+
     def __init__(self, id, quartile):
         super().__init__(id)
-        self.quartile = quartile if quartile else None  # string[0..1]
+        self.quartile = _intern(quartile) if quartile else None  # string[0..1]
         
     def getQuartile(self):
         return self.quartile # string or None 
 
 class Area(IdentifiableEntity):
+    __slots__ = ()
+
     def __init__(self, id):
         super().__init__(id)
 
+# ------------------------------------------------------------------------------------------------------
+# Query cache
+
+class QueryCache(object):
+    """
+    keeps the dataframes returned by the query handlers, with LRU eviction, a time to live and a memory bound;
+    the entries of a database are removed when an upload handler pushes data to it
+    """
+    _instances = weakref.WeakSet() # all the caches, so that an upload can invalidate every one of them
+    _versions = {} # dbPathOrUrl -> number of uploads to the database, for what is kept outside the caches
+
+    def __init__(self, maxEntries=128, ttl=600.0, maxBytes=256 * 1024 * 1024):
+        self.maxEntries = maxEntries # number of results kept
+        self.ttl = ttl # seconds after which a result is not used anymore
+        self.maxBytes = maxBytes # approximate memory used by all the results
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (expiry time, size in bytes, dataframe), the oldest used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        QueryCache._instances.add(self)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2].copy()
+
+    def put(self, key, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.maxBytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, df.copy())
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.maxEntries or self._bytes > self.maxBytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        expiry, size, df = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, dbPathOrUrl=None):
+        """
+        removes the results of one database, or all of them if no database is given
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if dbPathOrUrl is None or key[0] == dbPathOrUrl:
+                    self._remove(key)
+        return True
+
+    @classmethod
+    def invalidateAll(cls, dbPathOrUrl):
+        cls._versions[dbPathOrUrl] = cls._versions.get(dbPathOrUrl, 0) + 1
+        for cache in list(cls._instances):
+            cache.invalidate(dbPathOrUrl)
+
+    @classmethod
+    def version(cls, dbPathOrUrl):
+        # changes every time invalidateAll is called for the database
+        return cls._versions.get(dbPathOrUrl, 0)
+
+    def getStats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes}
+
+query_cache = QueryCache() # shared by all the query handlers, unless they are given their own
+
+
+def _freeze(value):
+    # the arguments of the queries become hashable, so they can be part of the cache key
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def cached(method):
+    """
+    decorator for the query methods of the handlers: the result is kept in self.cache,
+    keyed on the database, the method and its arguments
+    """
+    def key(self, args, kwargs):
+        return (self.dbPathOrUrl, type(self).__name__, method.__name__, _freeze(args), _freeze(kwargs))
+
+    # a dataframe without columns is what the handlers return after an error, it is not kept, and neither is
+    # a result computed while an upload changed the database: it could be older than the upload
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            cache = getattr(self, "cache", None)
+            if cache is None:
+                return await method(self, *args, **kwargs)
+            df = cache.get(key(self, args, kwargs))
+            if df is None:
+                version = QueryCache.version(self.dbPathOrUrl)
+                df = await method(self, *args, **kwargs)
+                if len(df.columns) > 0 and QueryCache.version(self.dbPathOrUrl) == version:
+                    cache.put(key(self, args, kwargs), df)
+            return df
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = getattr(self, "cache", None)
+        if cache is None:
+            return method(self, *args, **kwargs)
+        df = cache.get(key(self, args, kwargs))
+        if df is None:
+            version = QueryCache.version(self.dbPathOrUrl)
+            df = method(self, *args, **kwargs)
+            if len(df.columns) > 0 and QueryCache.version(self.dbPathOrUrl) == version:
+                cache.put(key(self, args, kwargs), df)
+        return df
+    return wrapper
+
+# ------------------------------------------------------------------------------------------------------
+# Local graph backend
+
+# when dbPathOrUrl is not an http(s) URL the graph is kept in this process instead of Blazegraph:
+# "memory://name" is a graph that lives only in memory, "file://path" or the path of an existing file is
+# a file (N-Triples unless the extension says otherwise) loaded in memory and written back after every upload
+_local_graphs = {} # dbPathOrUrl -> [graph, modification time of the file when it was loaded]
+_local_graphs_lock = threading.Lock()
+# the graphs are not safe for threads, and the engines query them from the threads of the fan-out
+_local_graph_locks = {} # dbPathOrUrl -> lock held while the graph is queried or changed
+
+
+def _is_endpoint(pathOrUrl):
+    return pathOrUrl.lower().startswith(("http://", "https://"))
+
+
+def _is_local_graph(pathOrUrl):
+    if _is_endpoint(pathOrUrl):
+        return False
+    if pathOrUrl.startswith(("memory://", "file://")) or os.path.isfile(pathOrUrl):
+        return True
+    # an empty path or a URL without its scheme would otherwise become a new graph in this process
+    raise ValueError(f"{pathOrUrl!r} is not a SPARQL endpoint, a memory:// or file:// graph or an existing file")
+
+
+def _local_graph_path(pathOrUrl):
+    return pathOrUrl[len("file://"):] if pathOrUrl.startswith("file://") else pathOrUrl
+
+
+def _local_graph_format(pathOrUrl):
+    return guess_format(_local_graph_path(pathOrUrl)) or "nt"
+
+
+def _local_graph_lock(pathOrUrl):
+    with _local_graphs_lock:
+        return _local_graph_locks.setdefault(pathOrUrl, threading.RLock())
+
+
+def _local_graph(pathOrUrl):
+    """
+    returns the graph of a local dbPathOrUrl, loading it from the file if it changed since the last time
+    """
+    with _local_graphs_lock:
+        entry = _local_graphs.get(pathOrUrl)
+        if pathOrUrl.startswith("memory://"):
+            if entry is None:
+                entry = _local_graphs[pathOrUrl] = [Graph(), None]
+            return entry[0]
+
+        path = _local_graph_path(pathOrUrl)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if entry is None or entry[1] != mtime:
+            graph = Graph()
+            if mtime is not None:
+                graph.parse(path, format=_local_graph_format(pathOrUrl))
+            entry = _local_graphs[pathOrUrl] = [graph, mtime]
+        return entry[0]
+
+
+def _save_local_graph(pathOrUrl):
+    # the file is written next to the old one and then replaced, so readers never see half a graph
+    if pathOrUrl.startswith("memory://"):
+        return
+    with _local_graphs_lock:
+        entry = _local_graphs[pathOrUrl]
+        path = _local_graph_path(pathOrUrl)
+        temporary = path + ".tmp"
+        entry[0].serialize(destination=temporary, format=_local_graph_format(pathOrUrl), encoding="utf-8")
+        os.replace(temporary, path)
+        entry[1] = os.path.getmtime(path)
+
+# ------------------------------------------------------------------------------------------------------
+# Columnar snapshots
+
+# the upload handlers can also write what they uploaded in an Arrow IPC file, that the query engine
+# memory-maps at start instead of asking the databases again; the version is stored in the schema
+# metadata and a snapshot written by a different version is not loaded
+SNAPSHOT_VERSION = "1"
+
+
+def _journal_snapshot_schema():
+    # the same columns of the dataframes returned by JournalQueryHandler
+    return pa.schema([
+        ("journal", pa.string()),
+        ("title", pa.string()),
+        ("identifiers", pa.list_(pa.string())),
+        ("languages", pa.list_(pa.string())),
+        ("publisher", pa.string()),
+        ("license", pa.string()),
+        ("apc", pa.string()),
+        ("seal", pa.string())
+    ])
+
+
+def _category_snapshot_schema():
+    # one row for each item of the scimago json file
+    return pa.schema([
+        ("identifiers", pa.list_(pa.string())),
+        ("categories", pa.list_(pa.struct([("id", pa.string()), ("quartile", pa.string())]))),
+        ("areas", pa.list_(pa.string()))
+    ])
+
+
+def _write_snapshot(path, kind, schema, batches):
+    """
+    writes the record batches in an Arrow IPC file, batches is a list of dictionaries {column: list of values}
+    """
+    if pa is None:
+        print("pyarrow is not installed, the snapshot was not written")
+        return False
+    schema = schema.with_metadata({"snapshot_version": SNAPSHOT_VERSION, "snapshot_kind": kind})
+    temporary = path + ".tmp"
+    try:
+        with pa.OSFile(temporary, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(pa.RecordBatch.from_pydict(batch, schema=schema))
+        os.replace(temporary, path)
+        return True
+    except Exception as e:
+        print(f"Error occurred while writing the snapshot: {str(e)}")
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        return False
+
+
+_snapshot_databases = itertools.count(1) # names of the in-memory databases of the category snapshots
+
+
+def _read_snapshot(path, kind):
+    """
+    returns the table of the snapshot, its columns are read from the memory-mapped file and not copied;
+    None if the file cannot be used
+    """
+    if pa is None:
+        print("pyarrow is not installed, the snapshot cannot be loaded")
+        return None
+    try:
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    except Exception as e:
+        print(f"Error occurred while reading the snapshot: {str(e)}")
+        return None
+    metadata = table.schema.metadata or {}
+    if metadata.get(b"snapshot_kind") != kind.encode() or metadata.get(b"snapshot_version") != SNAPSHOT_VERSION.encode():
+        print(f"{path} is not a {kind} snapshot of version {SNAPSHOT_VERSION}, upload the data again to rebuild it")
+        return None
+    return table
+
 # ------------------------------------------------------------------------------------------------------
 # Handler, UploadHandler, CategoryUploadHandler and JournalUploadHandler - Chiara Picardi
 
@@ -103,147 +426,416 @@ class CategoryUploadHandler(UploadHandler):
 
     def __init__(self):
         super().__init__()
-    
-    def pushDataToDb(self, path: str) -> bool: 
-        
-        #creating the database 
-        with connect(self.dbPathOrUrl) as con: 
-            con.commit() #commit the current transactions to the database  
+        self.snapshotPath = None # Arrow IPC file written after every upload, None to not write it
+        self.upsert = False # merge the items into the existing tables by identifier instead of replacing them
+        self.batchSize = 5000 # items written to the database with each executemany
+        self.readSize = 64 * 1024 # characters of the json file read at the same time
 
-        with open(path, "r", encoding="utf-8") as c: 
-            json_data = json.load(c) #reading the file 
+    def setBatchSize(self, size: int) -> bool:
+        if size < 1:
+            return False
+        self.batchSize = size
+        return True
 
-            category_tracker = []
-            area_tracker = []
+    def setSnapshotPath(self, path) -> bool:
+        if path is not None and pa is None:
+            print("pyarrow is not installed, the snapshot cannot be written")
+            return False
+        self.snapshotPath = path
+        return True
 
-            identifier_list = []
-            
-            category_mapping_dict = {} #using it to keep track of what we have
-            categories_list = []
+    def setUpsert(self, upsert: bool) -> bool:
+        self.upsert = bool(upsert)
+        return True
 
-            area_mapping_dict = {}
-            area_list = []
-            
-            #internal identifier of all the items 
-            for idx, item in enumerate(json_data): 
-                item_internal_id = ("item_" + str(idx)) 
-                
-                #1. creating internal ids for each element: identifiers 
-                identifiers = item.get("identifiers", []) #selecting the identifiers and using this method to retrive information from a dictionary and take into consideration the possibility that there is not an id 
-
-                #iterating through the identifiers inside  the bigger loop of items
-                for idx, row in enumerate(identifiers): #i use the iteration because there are more than one in some cases 
-
-                    identifier_list.append({
-                            "item_internal_id": item_internal_id,
-                            "identifiers": row #which is the single identifier 
-                            }) 
-
-                #2. creating internal ids for the categories, this is trickier because they have more than one value and they can have same id
-                #i have to iterate through everything but check if the "id" is the same, so it's useful to use a dictionary 
-                categories = item.get("categories", []) #especially for category, quartile and area, that in the UML are noted as optional ([0...*]) it's better to do it this way 
-
-                for row in categories: 
-                    cat_id = row.get("id")
-                    cat_quart = row.get("quartile")
-                    if cat_quart != None:
-                        join = (cat_id, cat_quart)
-                        id_quartile_combination = "_".join(join)
-                    elif cat_quart == None:
-                        id_quartile_combination = cat_id
-                    if id_quartile_combination not in category_mapping_dict: #checking if the category is not already in the dictionary 
-                        category_id = ("category_") + str(len(category_mapping_dict))
-                        category_mapping_dict[id_quartile_combination] = (category_id)
-                    else: 
-                        category_id = category_mapping_dict[id_quartile_combination] #if it's already inside the dict consider the original id 
-
-                    #checking for the quartile, because it's optional in the UML
-                    quartile = row.get("quartile", "")
-
-                    categories_list.append({
-                        "item_internal_id": item_internal_id,
-                        "category_internal_id" : category_id,
-                        "category_id": cat_id,
-                        "category_quartile": quartile
-                    })
+    def _snapshot_batches(self, items): 
+        #one record batch every batchSize items
+        batch = {"identifiers": [], "categories": [], "areas": []}
+        for item in items: 
+            batch["identifiers"].append(list(dict.fromkeys(item.get("identifiers", []))))
+            batch["categories"].append([{"id": row.get("id"), "quartile": row.get("quartile", "")} for row in item.get("categories", [])])
+            batch["areas"].append(list(dict.fromkeys(item.get("areas", []))))
+            if len(batch["identifiers"]) == self.batchSize: 
+                yield batch
+                batch = {"identifiers": [], "categories": [], "areas": []}
+        if batch["identifiers"]: 
+            yield batch
+
+    def _write_snapshot(self, items) -> bool: 
+        return _write_snapshot(self.snapshotPath, "category", _category_snapshot_schema(), self._snapshot_batches(items))
+
+    def _create_schema(self, con, drop=True): 
+        #one row per journal, identifier, category and area, the links between them are stored in two separate tables
+        #instead of repeating every identifier for every combination of category and area like the old 'info' table;
+        #every statement is executed alone, executescript would commit the transaction of the caller
+        if drop: 
+            for table in ("info", "hasCategory", "hasArea", "journal_category", "journal_area", 
+                          "identifier", "category", "area", "journal"): 
+                con.execute(f"DROP TABLE IF EXISTS {table}")
+
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                journal_id INTEGER PRIMARY KEY
+            )""")
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS identifier (
+                journal_id INTEGER NOT NULL REFERENCES journal (journal_id),
+                identifier TEXT NOT NULL,
+                PRIMARY KEY (journal_id, identifier)
+            )""")
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS category (
+                category_pk INTEGER PRIMARY KEY,
+                category_id TEXT NOT NULL,
+                category_quartile TEXT,
+                UNIQUE (category_id, category_quartile)
+            )""")
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS area (
+                area_pk INTEGER PRIMARY KEY,
+                area TEXT NOT NULL UNIQUE
+            )""")
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS journal_category (
+                journal_id INTEGER NOT NULL REFERENCES journal (journal_id),
+                category_pk INTEGER NOT NULL REFERENCES category (category_pk),
+                PRIMARY KEY (journal_id, category_pk)
+            )""")
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS journal_area (
+                journal_id INTEGER NOT NULL REFERENCES journal (journal_id),
+                area_pk INTEGER NOT NULL REFERENCES area (area_pk),
+                PRIMARY KEY (journal_id, area_pk)
+            )""")
+
+    def _create_indexes(self, con, analyze=True): 
+        #the primary keys already cover the lookups from a journal to its identifiers, categories and areas,
+        #these indexes cover the opposite direction, used by the queries that start from an identifier,
+        #a category, a quartile or an area
+        con.execute("CREATE INDEX IF NOT EXISTS idx_identifier_identifier ON identifier (identifier, journal_id)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_category_quartile ON category (category_quartile, category_id)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_journal_category_category ON journal_category (category_pk, journal_id)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_journal_area_area ON journal_area (area_pk, journal_id)")
+        if analyze: 
+            con.execute("ANALYZE")
+
+    def _iter_items(self, path): 
+        #the items of the scimago json file one at a time: the array is decoded with raw_decode on a buffer
+        #that holds only the part of the file not decoded yet, so memory does not grow with the size of the file
+        decoder = json.JSONDecoder()
+        whitespace = re.compile(r"[ \t\n\r]*")
+        with open(path, "r", encoding="utf-8") as f: 
+            buffer = f.read(self.readSize)
+            position = 0
+            started = False
+            while True: 
+                position = whitespace.match(buffer, position).end()
+                if position == len(buffer): 
+                    more = f.read(self.readSize)
+                    if not more: 
+                        raise ValueError(f"{path} ended before the end of the json array")
+                    buffer, position = more, 0
+                    continue
 
-                    category_tracker.append({
-                        "item_internal_id": item_internal_id,
-                        "category_internal_id": category_id
-                    })
-                
-                
-                #3. creating internal ids for areas, this is the same but without any more value 
-                areas = item.get("areas", [])
-
-                for area in areas: 
-                    if area not in area_mapping_dict: 
-                        area_id = (("area_") + str(len(area_mapping_dict)))
-                        area_mapping_dict[area] = area_id
-                    else: 
-                        area_id = area_mapping_dict[area]
-                
-                    area_list.append({
-                        "item_internal_id": item_internal_id, 
-                        "area_internal_id": area_id,
-                        "area": area
-                    })
+                character = buffer[position]
+                if not started: 
+                    if character != "[": 
+                        raise ValueError(f"{path} does not contain a json array")
+                    started = True
+                    position += 1
+                elif character == ",": 
+                    position += 1
+                elif character == "]": 
+                    return
+                else: 
+                    try: 
+                        item, end = decoder.raw_decode(buffer, position)
+                    except json.JSONDecodeError: 
+                        end = None
+                    if end is None or end == len(buffer) or buffer[end] not in ",] \t\n\r": 
+                        #the item continues in the next part of the file: a value is accepted only when the 
+                        #buffer holds what follows it, otherwise a number cut by the read (12 of 12345, 
+                        #1 of 1.5) would be decoded as a whole value
+                        more = f.read(self.readSize)
+                        if more: 
+                            buffer, position = buffer[position:] + more, 0
+                            continue
+                        if end is None or end < len(buffer): 
+                            raise ValueError(f"{path} is not a valid json array")
+                    position = end
+                    yield item
+                    if position > self.readSize: 
+                        buffer, position = buffer[position:], 0
+
+    def _write_items(self, con, items): 
+        #items is an iterable of dictionaries with the same structure of the scimago json file, 
+        #the rows are written every batchSize items so only one batch of rows is in memory
+        rows = {table: [] for table in ("journal", "identifier", "category", "area", "journal_category", "journal_area")}
+        inserts = {
+            "journal": "INSERT INTO journal (journal_id) VALUES (?)",
+            "identifier": "INSERT INTO identifier (journal_id, identifier) VALUES (?, ?)",
+            "category": "INSERT INTO category (category_pk, category_id, category_quartile) VALUES (?, ?, ?)",
+            "area": "INSERT INTO area (area_pk, area) VALUES (?, ?)",
+            "journal_category": "INSERT INTO journal_category (journal_id, category_pk) VALUES (?, ?)",
+            "journal_area": "INSERT INTO journal_area (journal_id, area_pk) VALUES (?, ?)"
+        }
 
-                    area_tracker.append({
-                        "item_internal_id": item_internal_id,
-                        "area_internal_id": area_id
-                    })
-            
-            
-            #converting the data in dataframes 
-            identifiers_df = pd.DataFrame(identifier_list)
-            categories_df = pd.DataFrame(categories_list)
-            areas_df = pd.DataFrame(area_list)
-            cat_df = pd.DataFrame(category_tracker)
-            ar_df = pd.DataFrame(area_tracker)
-            # unirle
-            merge_1 = pd.merge(identifiers_df, categories_df, left_on='item_internal_id', right_on='item_internal_id')
-            merge_2 = pd.merge(merge_1, areas_df, left_on='item_internal_id', right_on='item_internal_id')
-
-            # create hasCategory table - Edoardo
-            hasCategory = pd.merge(identifiers_df, cat_df, left_on='item_internal_id', right_on='item_internal_id')
-
-            # create hasArea table - Edoardo
-            hasArea = pd.merge(identifiers_df, ar_df, left_on='item_internal_id', right_on='item_internal_id')
+        def flush(): 
+            for table, table_rows in rows.items(): 
+                con.executemany(inserts[table], table_rows)
+                table_rows.clear()
+
+        category_mapping_dict = {} #using it to keep track of what we have
+        area_mapping_dict = {}
+
+        #the old tables are replaced in a single transaction, the other connections keep seeing the old data
+        #until the commit and nothing changes if something fails
+        con.execute("BEGIN IMMEDIATE")
+        self._create_schema(con)
+
+        for idx, item in enumerate(items): 
+            journal_id = idx + 1 #integer key of the item, used by all the other tables
+            rows["journal"].append((journal_id,))
+
+            #1. the identifiers, a set because the same identifier could be repeated inside an item
+            for identifier in dict.fromkeys(item.get("identifiers", [])): 
+                rows["identifier"].append((journal_id, identifier))
+
+            #2. the categories, the same category with the same quartile is stored only once
+            linked_categories = set()
+            for row in item.get("categories", []): 
+                cat_id = row.get("id")
+                quartile = row.get("quartile", "") #checking for the quartile, because it's optional in the UML
+                if (cat_id, quartile) not in category_mapping_dict: 
+                    category_mapping_dict[(cat_id, quartile)] = len(category_mapping_dict) + 1
+                    rows["category"].append((category_mapping_dict[(cat_id, quartile)], cat_id, quartile))
+                category_pk = category_mapping_dict[(cat_id, quartile)]
+                if category_pk not in linked_categories: 
+                    linked_categories.add(category_pk)
+                    rows["journal_category"].append((journal_id, category_pk))
+
+            #3. the areas, same as the categories but without the quartile
+            linked_areas = set()
+            for area in item.get("areas", []): 
+                if area not in area_mapping_dict: 
+                    area_mapping_dict[area] = len(area_mapping_dict) + 1
+                    rows["area"].append((area_mapping_dict[area], area))
+                area_pk = area_mapping_dict[area]
+                if area_pk not in linked_areas: 
+                    linked_areas.add(area_pk)
+                    rows["journal_area"].append((journal_id, area_pk))
+
+            if len(rows["journal"]) == self.batchSize: 
+                flush()
+
+        flush()
+        #the indexes are created after loading the data, it is faster than updating them for every insert
+        self._create_indexes(con)
+        con.commit()
+
+    def _upsert_items(self, con, items): 
+        #every item replaces the journal having one of its identifiers (or it is added as a new journal),
+        #the journals that are not in items are left as they are; everything in a single transaction.
+        #An item without identifiers cannot be matched with a journal, so it is skipped instead of 
+        #being added again at every upsert
+        con.execute("BEGIN IMMEDIATE")
+        self._create_schema(con, drop=False)
+        self._create_indexes(con, analyze=False)
+        #the categories and areas unlinked by this upsert, the only ones that can be left without journals
+        unlinked_categories, unlinked_areas = set(), set()
+
+        for item in items: 
+            identifiers = list(dict.fromkeys(item.get("identifiers", [])))
+            if not identifiers: 
+                continue
+            placeholders = ", ".join(["?"] * len(identifiers))
+            journal_ids = [row[0] for row in con.execute(
+                f"SELECT DISTINCT journal_id FROM identifier WHERE identifier IN ({placeholders}) ORDER BY journal_id", identifiers)]
+
+            if journal_ids: 
+                #an item can join journals that were separate before, they all become the first one
+                journal_id = journal_ids[0]
+                old_ids = [(old_id,) for old_id in journal_ids]
+                for old_id in journal_ids: 
+                    unlinked_categories.update(row[0] for row in con.execute(
+                        "SELECT category_pk FROM journal_category WHERE journal_id = ?", (old_id,)))
+                    unlinked_areas.update(row[0] for row in con.execute(
+                        "SELECT area_pk FROM journal_area WHERE journal_id = ?", (old_id,)))
+                con.executemany("DELETE FROM identifier WHERE journal_id = ?", old_ids)
+                con.executemany("DELETE FROM journal_category WHERE journal_id = ?", old_ids)
+                con.executemany("DELETE FROM journal_area WHERE journal_id = ?", old_ids)
+                con.executemany("DELETE FROM journal WHERE journal_id = ?", old_ids[1:])
+            else: 
+                journal_id = con.execute("INSERT INTO journal DEFAULT VALUES").lastrowid
+
+            con.executemany("INSERT INTO identifier (journal_id, identifier) VALUES (?, ?)", 
+                            [(journal_id, identifier) for identifier in identifiers])
+            for row in item.get("categories", []): 
+                category = (row.get("id"), row.get("quartile", ""))
+                #IS instead of = because the quartile can be null
+                found = con.execute("SELECT category_pk FROM category WHERE category_id = ? AND category_quartile IS ?", category).fetchone()
+                category_pk = found[0] if found else con.execute(
+                    "INSERT INTO category (category_id, category_quartile) VALUES (?, ?)", category).lastrowid
+                con.execute("INSERT OR IGNORE INTO journal_category (journal_id, category_pk) VALUES (?, ?)", (journal_id, category_pk))
+            for area in item.get("areas", []): 
+                found = con.execute("SELECT area_pk FROM area WHERE area = ?", (area,)).fetchone()
+                area_pk = found[0] if found else con.execute("INSERT INTO area (area) VALUES (?)", (area,)).lastrowid
+                con.execute("INSERT OR IGNORE INTO journal_area (journal_id, area_pk) VALUES (?, ?)", (journal_id, area_pk))
+
+        #categories and areas that no journal uses anymore, each one checked on idx_journal_category_category
+        #and idx_journal_area_area instead of scanning the whole tables
+        con.executemany("""
+            DELETE FROM category WHERE category_pk = ? 
+            AND NOT EXISTS (SELECT 1 FROM journal_category WHERE category_pk = ?)""", 
+            [(category_pk, category_pk) for category_pk in unlinked_categories])
+        con.executemany("""
+            DELETE FROM area WHERE area_pk = ? 
+            AND NOT EXISTS (SELECT 1 FROM journal_area WHERE area_pk = ?)""", 
+            [(area_pk, area_pk) for area_pk in unlinked_areas])
+        con.commit()
+
+    def _read_items(self, con): 
+        #the items stored in the database, with the same structure of the scimago json file
+        items = {}
+        for journal_id, identifier in con.execute("SELECT journal_id, identifier FROM identifier ORDER BY journal_id"): 
+            items.setdefault(journal_id, {"identifiers": [], "categories": [], "areas": []})["identifiers"].append(identifier)
+        for journal_id, category_id, quartile in con.execute("""
+                SELECT jc.journal_id, c.category_id, c.category_quartile
+                FROM journal_category jc JOIN category c ON c.category_pk = jc.category_pk"""): 
+            if journal_id in items: 
+                items[journal_id]["categories"].append({"id": category_id, "quartile": quartile})
+        for journal_id, area in con.execute("""
+                SELECT ja.journal_id, a.area FROM journal_area ja JOIN area a ON a.area_pk = ja.area_pk"""): 
+            if journal_id in items: 
+                items[journal_id]["areas"].append(area)
+        return list(items.values())
+
+    def pushDataToDb(self, path: str) -> bool: 
         try:
+            #the file is read while the rows are written, instead of loading it all with json.load
             with connect(self.dbPathOrUrl) as con:
-                merge_2.to_sql('info', con, if_exists='replace', index=False)
-                hasCategory.to_sql('hasCategory', con, if_exists='replace', index=False)
-                hasArea.to_sql('hasArea', con, if_exists='replace', index=False)
-                    # TODO: why not 'con.commit()'
+                if self.upsert: 
+                    self._upsert_items(con, self._iter_items(path))
+                    #the snapshot has all the journals of the database, not only the ones in the file
+                    items = self._read_items(con) if self.snapshotPath else None
+                else: 
+                    self._write_items(con, self._iter_items(path))
+                    items = self._iter_items(path)
+            if self.snapshotPath: 
+                return self._write_snapshot(items)
             return True
         except Exception as e:
             print(f"Error occurred while pushing data to DB: {str(e)}")
             return False 
+        finally:
+            # the results kept for this database are not valid anymore
+            QueryCache.invalidateAll(self.dbPathOrUrl)
+
+    def migrateInfoDb(self) -> bool: 
+        """
+        converts a database created with the old 'info' table into the normalized tables
+        """
+        try:
+            with connect(self.dbPathOrUrl) as con:
+                info = pd.read_sql_query(
+                    "SELECT item_internal_id, identifiers, category_id, category_quartile, area FROM info", con)
+
+                #rebuilding the items of the json file from the rows of the cartesian table
+                items = []
+                for item_internal_id, rows in info.groupby("item_internal_id", sort=False): 
+                    categories = rows[["category_id", "category_quartile"]].drop_duplicates()
+                    items.append({
+                        "identifiers": rows["identifiers"].drop_duplicates().tolist(),
+                        "categories": [{"id": cat_id, "quartile": quartile} for cat_id, quartile in categories.itertuples(index=False)],
+                        "areas": rows["area"].drop_duplicates().tolist()
+                    })
+
+                self._write_items(con, items)
+            #the old tables are dropped, vacuum gives the free pages back to the file system
+            with connect(self.dbPathOrUrl) as con:
+                con.execute("VACUUM")
+            return True
+        except Exception as e:
+            print(f"Error occurred while migrating the database: {str(e)}")
+            return False
+        finally:
+            QueryCache.invalidateAll(self.dbPathOrUrl)
+
             
 #second case: the path is the one of a graph database, the csv file
 
+#hash of the triples of a journal, stored with them to find the journals that changed since the last upload
+CONTENT_HASH = URIRef("https://comp-data.github.io/res/contentHash")
+
 class JournalUploadHandler(UploadHandler): 
     def __init__(self):
         self.dbPathOrUrl = ""
+        self.batchSize = 5000 # number of triples sent in each INSERT DATA request
+        self.maxRetries = 3 # attempts for a single batch before the upload is stopped
+        self.retryDelay = 1.0 # seconds to wait before retrying a failed batch (grows with the attempts)
+        self.batchTimings = [] # one dictionary per batch sent during the last upload
+        self.chunkSize = 1000 # rows of the csv file read at the same time
+        self.snapshotPath = None # Arrow IPC file written after every upload, None to not write it
+        self.lastDelta = {} # journals inserted, updated, deleted and unchanged by the last upload
+
+    def setSnapshotPath(self, path) -> bool:
+        if path is not None and pa is None:
+            print("pyarrow is not installed, the snapshot cannot be written")
+            return False
+        self.snapshotPath = path
+        return True
 
-    def pushDataToDb(self, path) -> bool:  
-        my_graph = Graph() #creating the database
+    def setBatchSize(self, size: int) -> bool:
+        if size < 1:
+            return False
+        self.batchSize = size
+        return True
 
-        #classes
-        Journal = URIRef("https://schema.org/Periodical") 
+    def getBatchTimings(self):
+        return list(self.batchTimings)
 
-        #attributes related to classes 
-        id = URIRef("https://schema.org/identifier")
-        title = URIRef("https://schema.org/title")
-        languages = URIRef("https://schema.org/inLanguage") 
-        publisher = URIRef("https://schema.org/publisher")
-        doajSeal = URIRef("https://schema.org/Certification") 
-        licence = URIRef("https://schema.org/license")
-        apc = URIRef("https://schema.org/isAccessibleForFree")
-        
-        journals = pd.read_csv(path, 
+    def getLastDelta(self):
+        return dict(self.lastDelta)
+
+    def _send_update(self, store, update, timing) -> bool:
+        #timing is the dictionary added to batchTimings when the update succeeds
+        batch_number = len(self.batchTimings) + 1
+
+        for attempt in range(1, self.maxRetries + 1):
+            start = time.perf_counter()
+            try:
+                store.update(update)
+            except Exception as e:
+                #the failed update stays in the store transaction, so it has to be dropped before retrying
+                #otherwise it would be sent again together with the next one
+                store.rollback()
+                print(f"Batch {batch_number} failed (attempt {attempt} of {self.maxRetries}): {e}")
+                if attempt < self.maxRetries:
+                    time.sleep(self.retryDelay * attempt)
+                continue
+
+            self.batchTimings.append(dict(timing, batch=batch_number, attempts=attempt, seconds=time.perf_counter() - start))
+            return True
+
+        return False
+
+    def _send_batch(self, store, batch) -> bool:
+        #all the triples of the batch go in a single INSERT DATA, instead of one request per triple
+        body = "\n".join(f"{s.n3()} {p.n3()} {o.n3()} ." for s, p, o in batch)
+        update = "INSERT DATA {\n" + body + "\n}"
+        return self._send_update(store, update, {"operation": "insert", "triples": len(batch)})
+
+    def _send_delete(self, store, subjects) -> bool:
+        #all the triples of these journals are removed with a single request
+        values = " ".join(subject.n3() for subject in subjects)
+        update = "DELETE { ?journal ?p ?o } WHERE {\n VALUES ?journal { " + values + " }\n ?journal ?p ?o \n}"
+        return self._send_update(store, update, {"operation": "delete", "subjects": len(subjects)})
+
+    def _read_journals(self, path): 
+        #reading the csv in chunks, so that only chunkSize rows are in memory at the same time
+        reader = pd.read_csv(path, 
                             keep_default_na=False, 
+                            chunksize=self.chunkSize,
                             dtype={
                                 "Journal title": "string",
                                 "Journal ISSN (print version)": "string",
@@ -254,44 +846,203 @@ class JournalUploadHandler(UploadHandler):
                                 "Journal license" : "string",
                                 "APC": "string"
                             })
-
-        #giving unique identifiers 
+        for chunk in reader: 
+            #the index of the chunks continues from the previous one, so idx is still the row number in the file
+            for idx, row in zip(chunk.index, chunk.to_dict("records")): 
+                yield idx, row
+
+    def _subject(self, idx, row): 
+        #giving unique identifiers: the ISSN (or the EISSN) of the journal, so the same journal keeps 
+        #its subject in every export of DOAJ, the row number only when it has none of them
         base_url = "https://comp-data.github.io/res" 
+        key = row["Journal ISSN (print version)"] or row["Journal EISSN (online version)"] or "row-" + str(idx)
+        return URIRef(base_url + "journal-" + quote(key, safe="-"))
+
+    def _languages(self, row): 
+        #as indicated in the F.A.Q on the github they are separated with a comma but inside quotes of course ",", 
+        #so I separate each item and delete whitespaces and repeated languages
+        language_string = row["Languages in which the journal accepts manuscripts"]
+        if not language_string: 
+            return []
+        return list(dict.fromkeys(l.strip() for l in language_string.split(",")))
+
+    def _content_hash(self, triples): 
+        #the same triples give the same hash, whatever the order of the columns or of the languages
+        content = "\n".join(sorted(f"{p.n3()} {o.n3()}" for s, p, o in triples))
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def _journal_triples(self, path, unchanged=()): 
+        #the triples of the journals not in unchanged, each journal ends with its content hash,
+        #so a journal whose batch failed has no hash yet and it is sent again by the next upload
+        for subj, triples in self._journal_rows(path): 
+            if subj not in unchanged: 
+                yield from triples
+                yield (subj, CONTENT_HASH, Literal(self._content_hash(triples)))
+
+    def _journal_rows(self, path): 
+        #classes
+        Journal = URIRef("https://schema.org/Periodical") 
 
-        for idx, row in journals.iterrows(): 
-            local_id = "journal-" + str(idx)
-            subj = URIRef(base_url + local_id) #new local identifiers for each item in the graph database 
+        #attributes related to classes 
+        id = URIRef("https://schema.org/identifier")
+        title = URIRef("https://schema.org/title")
+        languages = URIRef("https://schema.org/inLanguage") 
+        publisher = URIRef("https://schema.org/publisher")
+        doajSeal = URIRef("https://schema.org/Certification") 
+        licence = URIRef("https://schema.org/license")
+        apc = URIRef("https://schema.org/isAccessibleForFree")
 
-            my_graph.add(((subj, RDF.type, Journal))) #the subject of the row is a journal 
+        #one (subject, list of triples) for each row of the csv
+        for idx, row in self._read_journals(path): 
+            subj = self._subject(idx, row)
+            triples = [(subj, RDF.type, Journal)] #the subject of the row is a journal 
                 
             #checking every category in the row (which is none other than a list of vocabularies)
             if row["Journal title"]: 
-                my_graph.add((subj, title, Literal(row["Journal title"])))
+                triples.append((subj, title, Literal(row["Journal title"])))
             
             if row["Journal ISSN (print version)"]: 
-                my_graph.add((subj, id, Literal(row["Journal ISSN (print version)"])))
+                triples.append((subj, id, Literal(row["Journal ISSN (print version)"])))
                 
             if row["Journal EISSN (online version)"]: 
-                my_graph.add((subj, id, Literal(row["Journal EISSN (online version)"])))
+                triples.append((subj, id, Literal(row["Journal EISSN (online version)"])))
     
-            if row["Languages in which the journal accepts manuscripts"]: #there could be more languages so it's better to iterate through each of them 
-                language_string = row["Languages in which the journal accepts manuscripts"] #1. taking in consideration the whole row
-                language_list = language_string.split(",") #as indicated in the F.A.Q on the github they are separated with a comma but inside quotes of course ",", so I separate each item 
-                for language in language_list: 
-                    language = language.strip() #to delete whitespaces and facilitate the query 
-                    my_graph.add((subj, languages, Literal(language)))
+            for language in self._languages(row): #there could be more languages so it's better to iterate through each of them 
+                triples.append((subj, languages, Literal(language)))
                 
             if row["Publisher"]: 
-                my_graph.add((subj, publisher, Literal(row["Publisher"])))
+                triples.append((subj, publisher, Literal(row["Publisher"])))
             
             if row["DOAJ Seal"]: 
-                my_graph.add((subj, doajSeal, Literal(row["DOAJ Seal"])))
+                triples.append((subj, doajSeal, Literal(row["DOAJ Seal"])))
                 
             if row["Journal license"]: 
-                my_graph.add((subj, licence, Literal(row["Journal license"])))
+                triples.append((subj, licence, Literal(row["Journal license"])))
 
             if row["APC"]: 
-                my_graph.add((subj, apc, Literal(row["APC"]))) 
+                triples.append((subj, apc, Literal(row["APC"]))) 
+
+            yield subj, triples
+
+    def _existing_hashes(self): 
+        #the content hash of every journal already in the database, "" for the journals uploaded without it
+        if _is_local_graph(self.dbPathOrUrl): 
+            #read directly from the triples of the graph, without parsing a query
+            with _local_graph_lock(self.dbPathOrUrl): 
+                graph = _local_graph(self.dbPathOrUrl)
+                hashes = dict.fromkeys(graph.subjects(RDF.type, URIRef("https://schema.org/Periodical")), "")
+                hashes.update((journal, str(h)) for journal, h in graph.subject_objects(CONTENT_HASH) if journal in hashes)
+            return hashes
+
+        query = f"""
+        SELECT ?journal ?hash
+        WHERE {{
+            ?journal a <https://schema.org/Periodical> .
+            OPTIONAL {{ ?journal {CONTENT_HASH.n3()} ?hash }}
+        }}
+        """
+        sparql = SPARQLWrapper(self.dbPathOrUrl)
+        sparql.setReturnFormat(JSON)
+        sparql.setQuery(query)
+        result = sparql.queryAndConvert()
+        return {URIRef(row["journal"]["value"]): row.get("hash", {}).get("value", "") for row in result["results"]["bindings"]}
+
+    def _diff(self, path, existing): 
+        #first pass over the csv, only the subjects already in the database are kept in memory, so a new 
+        #database costs the same memory for any csv: returns the journals that are not sent again and the 
+        #ones to delete (changed or not in the csv anymore), all the others are inserted
+        delta = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        unchanged = set()
+        to_delete = []
+        seen = set()
+        for subj, triples in self._journal_rows(path): 
+            content_hash = existing.get(subj)
+            if content_hash is None: 
+                delta["inserted"] += 1
+                continue
+            seen.add(subj)
+            if content_hash != self._content_hash(triples): 
+                delta["updated"] += 1
+                to_delete.append(subj)
+            else: 
+                delta["unchanged"] += 1
+                unchanged.add(subj)
+        for subj in existing: 
+            if subj not in seen: 
+                delta["deleted"] += 1
+                to_delete.append(subj)
+        self.lastDelta = delta
+        return unchanged, to_delete
+
+    def _snapshot_batches(self, path): 
+        #one record batch for each chunk of the csv, with the rows that the queries of JournalQueryHandler return:
+        #title, identifiers, languages and license are required there, publisher, apc and seal are optional
+        columns = [field.name for field in _journal_snapshot_schema()]
+        batch = {column: [] for column in columns}
+        for idx, row in self._read_journals(path): 
+            identifiers = [i for i in (row["Journal ISSN (print version)"], row["Journal EISSN (online version)"]) if i]
+            languages = self._languages(row)
+            if not (row["Journal title"] and identifiers and languages and row["Journal license"]): 
+                continue
+            values = (str(self._subject(idx, row)), row["Journal title"], identifiers, languages, 
+                      row["Publisher"], row["Journal license"], row["APC"], row["DOAJ Seal"])
+            for column, value in zip(columns, values): 
+                batch[column].append(value)
+            if len(batch["journal"]) == self.chunkSize: 
+                yield batch
+                batch = {column: [] for column in columns}
+        if batch["journal"]: 
+            yield batch
+
+    def _batches(self, triples): 
+        #grouping the triples in lists of batchSize, only one batch is kept in memory
+        batch = []
+        for triple in triples: 
+            batch.append(triple)
+            if len(batch) == self.batchSize: 
+                yield batch
+                batch = []
+        if batch: 
+            yield batch
+
+    def _push_local(self, path) -> bool: 
+        #the triples are added directly to the graph kept in this process, still batchSize at a time
+        try: 
+            with _local_graph_lock(self.dbPathOrUrl): 
+                graph = _local_graph(self.dbPathOrUrl)
+                unchanged, to_delete = self._diff(path, self._existing_hashes())
+                for subj in to_delete: 
+                    graph.remove((subj, None, None))
+                for batch in self._batches(self._journal_triples(path, unchanged)): 
+                    start = time.perf_counter()
+                    graph.addN((s, p, o, graph) for s, p, o in batch)
+                    self.batchTimings.append({
+                        "batch": len(self.batchTimings) + 1,
+                        "operation": "insert",
+                        "triples": len(batch),
+                        "attempts": 1,
+                        "seconds": time.perf_counter() - start
+                    })
+                _save_local_graph(self.dbPathOrUrl)
+            if self.snapshotPath: 
+                return _write_snapshot(self.snapshotPath, "journal", _journal_snapshot_schema(), self._snapshot_batches(path))
+            return True
+        except Exception as e: 
+            print("Problems with the local graph: ", e)
+            return False
+        finally: 
+            QueryCache.invalidateAll(self.dbPathOrUrl)
+
+    def pushDataToDb(self, path) -> bool:  
+        self.batchTimings = []
+        self.lastDelta = {}
+        try: 
+            local = _is_local_graph(self.dbPathOrUrl)
+        except ValueError as e: 
+            print("Problems with the database: ", e)
+            return False
+        if local: 
+            return self._push_local(path)
 
         #opening the connection to upload the graph 
         store = SPARQLUpdateStore() #initializing it as an object 
@@ -299,11 +1050,29 @@ class JournalUploadHandler(UploadHandler):
             #endpoint =  self.dbPathOrUrl the endopoint is the url or path of the database 
             store.open((self.dbPathOrUrl, self.dbPathOrUrl))
 
-            for triple in my_graph.triples((None, None, None)): 
-                store.add(triple)
+            #only the journals that changed since the last upload are sent: the old triples of the changed
+            #and removed journals are deleted, then the new and changed journals are inserted
+            unchanged, to_delete = self._diff(path, self._existing_hashes())
+            for start in range(0, len(to_delete), self.batchSize): 
+                if not self._send_delete(store, to_delete[start:start + self.batchSize]): 
+                    print("Upload stopped: the old journals could not be deleted")
+                    store.close()
+                    return False
+
+            #the triples are produced while reading the csv and sent as soon as a batch is full,
+            #a batch that keeps failing stops the upload but the batches already sent are not sent again
+            sent = 0
+            for batch in self._batches(self._journal_triples(path, unchanged)): 
+                if not self._send_batch(store, batch): 
+                    print(f"Upload stopped: {sent} triples were sent before the failed batch")
+                    store.close()
+                    return False
+                sent += len(batch)
 
             #closing the connection when we finish 
             store.close()
+            if self.snapshotPath: 
+                return _write_snapshot(self.snapshotPath, "journal", _journal_snapshot_schema(), self._snapshot_batches(path))
             return True
 
         except Exception as e: 
@@ -312,6 +1081,10 @@ class JournalUploadHandler(UploadHandler):
             #closing the connection when we finish 
             store.close()
             return False
+
+        finally: 
+            #the results kept for this database are not valid anymore, even if only some batches were sent
+            QueryCache.invalidateAll(self.dbPathOrUrl)
            
 # ------------------------------------------------------------------------------------------------------
 # CategoryQueryHandler and QueryHandler - Cecilia Vesci
@@ -320,6 +1093,7 @@ class QueryHandler(Handler):
     def __init__(self, dbPathOrUrl=""):  
         super().__init__()
         self.dbPathOrUrl = dbPathOrUrl
+        self.cache = query_cache # results of the queries, None to always ask the database
 
     def getById(self, id: str):
         """
@@ -334,18 +1108,61 @@ class CategoryQueryHandler(QueryHandler):
             super().__init__()
             self.dbPathOrUrl = dbPathOrUrl
             self.db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), self.dbPathOrUrl))
+            self.mmapSize = 256 * 1024 * 1024 # bytes of the database file mapped in memory
+            self.cacheSize = 64 * 1024 # KiB of page cache for each connection
+            self._local = threading.local() # one read connection for each thread using the handler
+            self._connections = [] # all the open connections, so that close() can reach them
+            self._lock = threading.Lock()
+
+    def setDbPathOrUrl(self, pathOrUrl: str) -> bool:
+        # the connections opened on the previous database are not valid anymore
+        self.close()
+        return super().setDbPathOrUrl(pathOrUrl)
+
+    def _get_connection(self):
+        """
+        returns the read connection of the current thread, opening it the first time
+        """
+        con = getattr(self._local, "con", None)
+        if con is None:
+            # each connection is used only by its thread, but close() can be called from any thread
+            # file: URIs are the in-memory databases of the category snapshots
+            con = connect(self.dbPathOrUrl, check_same_thread=False, uri=self.dbPathOrUrl.startswith("file:"))
+            try:
+                # WAL lets the upload handler write while the connection is reading
+                con.execute("PRAGMA journal_mode=WAL")
+            except Error as e:
+                print(f"Database warning: WAL mode not enabled on {self.dbPathOrUrl}: {e}")
+            con.execute(f"PRAGMA mmap_size={int(self.mmapSize)}")
+            con.execute(f"PRAGMA cache_size=-{int(self.cacheSize)}")
+            con.execute("PRAGMA query_only=ON")
+            self._local.con = con
+            with self._lock:
+                self._connections.append(con)
+        return con
+
+    def close(self):
+        """
+        closes the connections opened by every thread, they are opened again by the next query
+        """
+        with self._lock:
+            for con in self._connections:
+                con.close()
+            self._connections = []
+        self._local = threading.local()
+        return True
     
     def _execute_query(self, query: str, params: tuple = None):
         try:
-            with connect(self.dbPathOrUrl) as con:
-                if params:
-                    df = pd.read_sql_query(query, con, params=params)
-                else:
-                    df = pd.read_sql_query(query, con)
-                return df
+            con = self._get_connection()
+            if params:
+                df = pd.read_sql_query(query, con, params=params)
+            else:
+                df = pd.read_sql_query(query, con)
+            return df
         except Error as e:
-            if "no such table: info" in str(e):
-                 print(f"Database error: The table 'info' does not exist in {self.dbPathOrUrl}")
+            if "no such table" in str(e):
+                 print(f"Database error: {e} in {self.dbPathOrUrl} (databases with the old 'info' table can be converted with CategoryUploadHandler.migrateInfoDb)")
             else:
                  print(f"Database error during query execution: {e}")
            
@@ -355,16 +1172,23 @@ class CategoryQueryHandler(QueryHandler):
             print(f"An unexpected error occurred during query execution: {e}")
             return pd.DataFrame()
         
+    def getQueryPlan(self, query: str, params: tuple = None):
+        """
+        returns the plan chosen by SQLite for the query, useful to check which indexes are used
+        """
+        return self._execute_query("EXPLAIN QUERY PLAN " + query, params)
+
+    @cached
     def getById(self, id: str):
         query = """
-        SELECT DISTINCT area AS identity, NULL AS category_quartile
-        FROM info
+        SELECT area AS identity, NULL AS category_quartile
+        FROM area
         WHERE area = :id
 
         UNION ALL
 
-        SELECT DISTINCT category_id AS identity, category_quartile
-        FROM info
+        SELECT category_id AS identity, category_quartile
+        FROM category
         WHERE category_id = :id;
         """
         df = self._execute_query(query, params={'id': id})
@@ -377,12 +1201,13 @@ class CategoryQueryHandler(QueryHandler):
         return df # return empty dataframe as no IdentifiableEntity in relational db
 
     # Prendere tutte le categorie (distinte)
+    @cached
     def getAllCategories(self):
         """
         return all categories included in database with no repetition
         """    
-        # Select distinct non-null category IDs from the 'info' table
-        query = "SELECT DISTINCT category_id, category_quartile FROM info WHERE category_id IS NOT NULL"
+        # Every category/quartile pair is stored only once in the 'category' table
+        query = "SELECT category_id, category_quartile FROM category"
         df = self._execute_query(query)
         # Ensure correct column name if df is empty
         if df.empty and 'category_id' not in df.columns:
@@ -390,26 +1215,28 @@ class CategoryQueryHandler(QueryHandler):
         return df
 
         # Prendere tutte le aree (distinte)
+    @cached
     def getAllAreas(self):
         """
         return all area included in database with no repetition
         """
-        # Select distinct non-null areas from the 'info' table
-        query = "SELECT DISTINCT area FROM info WHERE area IS NOT NULL"
+        # Every area is stored only once in the 'area' table
+        query = "SELECT area FROM area"
         df = self._execute_query(query)
         # Ensure correct column name if df is empty
         if df.empty and 'area' not in df.columns:
              return pd.DataFrame(columns=['area'])
         return df
 
+    @cached
     def getCategoriesWithQuartile(self, quartiles=Set[str]):
         """
         if quartiles is given it returns a df showing all the categories associated to that quartile
         if quartiles is not given, it returns a df with all categories 
         """
         if not quartiles:
-            # Return all distinct category/quartile pairs
-            query = "SELECT DISTINCT category_id, category_quartile FROM info WHERE category_id IS NOT NULL"
+            # Return all category/quartile pairs
+            query = "SELECT category_id, category_quartile FROM category"
             df = self._execute_query(query)
         else:
             # Build the WHERE clause carefully to handle different types and NULL
@@ -442,9 +1269,9 @@ class CategoryQueryHandler(QueryHandler):
                  return pd.DataFrame(columns=['category_id', 'category_quartile'])
 
             query = f"""
-                SELECT DISTINCT category_id, category_quartile
-                FROM info
-                WHERE category_id IS NOT NULL AND ({where_clause})
+                SELECT category_id, category_quartile
+                FROM category
+                WHERE {where_clause}
             """
             df = self._execute_query(query, tuple(params))
 
@@ -453,22 +1280,30 @@ class CategoryQueryHandler(QueryHandler):
              return pd.DataFrame(columns=['category_id', 'category_quartile'])
         return df
 
+    @cached
     def getCategoriesAssignedToAreas(self, areas=Set[str]):
         """
         if areas is given it returns a df showing all the categories associated to that areas
         if areas is not given, it returns a df with all categories
         """
         if not areas:
-            # If no areas specified, get all distinct categories/quartiles
-            query = "SELECT DISTINCT category_id, category_quartile FROM info WHERE category_id IS NOT NULL"
+            # If no areas specified, get all categories/quartiles
+            query = "SELECT category_id, category_quartile FROM category"
             df = self._execute_query(query)
         else:
             # Create placeholders for the areas in the IN clause
+            # EXISTS returns each category once, without a DISTINCT over all the journals of the areas
             placeholders = ','.join('?' for _ in areas)
             query = f"""
-                SELECT DISTINCT category_id, category_quartile
-                FROM info
-                WHERE area IN ({placeholders}) AND category_id IS NOT NULL
+                SELECT c.category_id, c.category_quartile
+                FROM category c
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM journal_category jc
+                    JOIN journal_area ja ON ja.journal_id = jc.journal_id
+                    JOIN area a ON a.area_pk = ja.area_pk
+                    WHERE jc.category_pk = c.category_pk AND a.area IN ({placeholders})
+                )
             """
             df = self._execute_query(query, tuple(areas))
 
@@ -477,22 +1312,29 @@ class CategoryQueryHandler(QueryHandler):
              return pd.DataFrame(columns=['category_id', 'category_quartile'])
         return df
 
+    @cached
     def getAreasAssignedToCategories(self, categories=Set[str]):
         """
         if category is given it returns a df showing all the areas associated to that category
         if category is not given, it returns a df with all areas
         """
         if not categories:
-            # If no categories specified, get all distinct areas
-            query = "SELECT DISTINCT area FROM info WHERE area IS NOT NULL"
+            # If no categories specified, get all areas
+            query = "SELECT area FROM area"
             df = self._execute_query(query)
         else:
             # Create placeholders for the categories in the IN clause
             placeholders = ','.join('?' for _ in categories)
             query = f"""
-                SELECT DISTINCT area
-                FROM info
-                WHERE category_id IN ({placeholders}) AND area IS NOT NULL
+                SELECT a.area
+                FROM area a
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM journal_area ja
+                    JOIN journal_category jc ON jc.journal_id = ja.journal_id
+                    JOIN category c ON c.category_pk = jc.category_pk
+                    WHERE ja.area_pk = a.area_pk AND c.category_id IN ({placeholders})
+                )
             """
             df = self._execute_query(query, tuple(categories))
 
@@ -501,342 +1343,991 @@ class CategoryQueryHandler(QueryHandler):
              return pd.DataFrame(columns=['area'])
         return df
 
+    def _categories_page_query(self, size, after=None):
+        # the pages are made of whole categories, ordered by category_id, with all their quartiles
+        where = "WHERE category_id > ?" if after is not None else ""
+        query = f"""
+            SELECT c.category_id, c.category_quartile
+            FROM (SELECT DISTINCT category_id FROM category {where} ORDER BY category_id LIMIT ?) p
+            JOIN category c ON c.category_id = p.category_id
+            ORDER BY c.category_id, c.category_quartile
+        """
+        params = (after, int(size)) if after is not None else (int(size),)
+        return query, params
+
+    @cached
+    def getCategoriesPage(self, size: int, after: str = None):
+        """
+        returns the categories like getAllCategories, but only the first size category ids greater than after
+        (from the first one when after is None): the category_id of the last row is the after of the next page
+        """
+        df = self._execute_query(*self._categories_page_query(size, after))
+        if df.empty and 'category_id' not in df.columns:
+             return pd.DataFrame(columns=['category_id', 'category_quartile'])
+        return df
+
+    @cached
+    def getStatistics(self):
+        """
+        returns the number of distinct journal identifiers in the database ("identifiers"), in each area,
+        category and quartile, as rows of kind, value and count: the engines use them to plan their queries
+        """
+        query = """
+            SELECT 'identifiers' AS kind, '' AS value, COUNT(DISTINCT identifier) AS count
+            FROM identifier
+
+            UNION ALL
+
+            SELECT 'area', a.area, COUNT(DISTINCT i.identifier)
+            FROM area a
+            JOIN journal_area ja ON ja.area_pk = a.area_pk
+            JOIN identifier i ON i.journal_id = ja.journal_id
+            GROUP BY a.area
+
+            UNION ALL
+
+            SELECT 'category', c.category_id, COUNT(DISTINCT i.identifier)
+            FROM category c
+            JOIN journal_category jc ON jc.category_pk = c.category_pk
+            JOIN identifier i ON i.journal_id = jc.journal_id
+            GROUP BY c.category_id
+
+            UNION ALL
+
+            SELECT 'quartile', COALESCE(c.category_quartile, ''), COUNT(DISTINCT i.identifier)
+            FROM category c
+            JOIN journal_category jc ON jc.category_pk = c.category_pk
+            JOIN identifier i ON i.journal_id = jc.journal_id
+            GROUP BY c.category_quartile
+        """
+        df = self._execute_query(query)
+        if df.empty and 'kind' not in df.columns:
+             return pd.DataFrame(columns=['kind', 'value', 'count'])
+        return df
+
 
 # ------------------------------------------------------------------------------------------------------
 # JournalQueryHandler - Faride
 
+# media types of the result formats accepted by JournalQueryHandler.setResultFormat
+SPARQL_RESULT_FORMATS = {
+    "json": "application/sparql-results+json",
+    "csv": "text/csv",
+    "tsv": "text/tab-separated-values"
+}
+
+# GROUP_CONCAT joins the identifiers and the languages of a journal with this character, that is not in the data
+SPARQL_SEPARATOR = "\x1f"
+SPARQL_SEPARATOR_ESCAPED = "\\u001F"
+
+_tsv_literal = re.compile(r'^"(.*)"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?$', re.DOTALL)
+_tsv_escape = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+_tsv_escapes = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f"}
+
+
+def _tsv_value(term):
+    # the value of a term of a TSV result, written like in N-Triples: <iri>, "literal"@lang, "literal"^^<type> or 42
+    if not term:
+        return None
+    if term.startswith("<") and term.endswith(">"):
+        return term[1:-1]
+    match = _tsv_literal.match(term)
+    if match is None:
+        return term
+    literal = match.group(1)
+    if "\\" not in literal:
+        return literal
+    return _tsv_escape.sub(lambda m: chr(int(m.group(1) or m.group(2), 16)) if m.group(3) is None
+                           else _tsv_escapes.get(m.group(3), m.group(3)), literal)
+
+
 class JournalQueryHandler(QueryHandler):
     def __init__(self):
         self.dbPathOrUrl = ""
+        self.cache = query_cache # results of the queries, None to always ask the database
+        self.valuesBatchSize = 500 # identifiers sent in the VALUES block of a single query
+        self.timeout = 60.0 # seconds to wait for the endpoint
+        self.maxConnections = 10 # connections kept open to the endpoint, set them before the first query
+        self.resultFormat = "json"
+        self.aggregate = True # the endpoint returns one row for each journal, with its identifiers and languages joined by GROUP_CONCAT
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        # one session for the handler, shared by the threads of the engines, its connections stay open
+        # between the queries so each one does not pay a new TCP handshake
+        with self._session_lock:
+            if self._session is None:
+                limits = httpx.Limits(max_connections=self.maxConnections, max_keepalive_connections=self.maxConnections)
+                self._session = httpx.Client(timeout=self.timeout, limits=limits)
+            return self._session
+
+    def close(self):
+        """
+        closes the connections to the endpoint, they are opened again by the next query
+        """
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+        return True
 
-    def execute_sparql_query(self, query):
+    def setResultFormat(self, resultFormat: str) -> bool:
+        """
+        "json" (the default), "csv" or "tsv": the text formats are smaller and faster to decode for large results,
+        they are used only with httpx
+        """
+        if resultFormat not in SPARQL_RESULT_FORMATS:
+            print(f"Unknown SPARQL result format {resultFormat}, use one of {', '.join(SPARQL_RESULT_FORMATS)}")
+            return False
+        self.resultFormat = resultFormat
+        return True
+
+    def _request(self, query):
+        # the query is sent in the body, the VALUES blocks can be longer than the URLs accepted by the server
+        return {"data": {"query": query},
+                "headers": {"Accept": SPARQL_RESULT_FORMATS[self.resultFormat], "Accept-Encoding": "gzip"}}
+
+    def _response_result(self, response):
+        response.raise_for_status()
+        return response.json() if self.resultFormat == "json" else response.text
+
+    def _query_local_graph(self, query):
+        # same structure of the JSON returned by the endpoint, built directly from the rdflib result
+        with _local_graph_lock(self.dbPathOrUrl):
+            result = _local_graph(self.dbPathOrUrl).query(query)
+            variables = [str(var) for var in result.vars]
+            bindings = []
+            for row in result:
+                bindings.append({var: {"value": str(value)} for var, value in zip(variables, row) if value is not None})
+        return {"head": {"vars": variables}, "results": {"bindings": bindings}}
+
+    def _fetch(self, query):
+        # the results as sent by the endpoint, or as built from the local graph
+        if _is_local_graph(self.dbPathOrUrl):
+            return self._query_local_graph(query)
+        if httpx is not None:
+            return self._response_result(self._get_session().post(self.dbPathOrUrl, **self._request(query)))
+        _warn_without_httpx("every SPARQL query opens a new connection to the endpoint")
         sparql = SPARQLWrapper(self.dbPathOrUrl)
         sparql.setReturnFormat(JSON)
         sparql.setQuery(query)
+        return sparql.queryAndConvert()
+
+    def execute_sparql_query(self, query):
         try:
-            result = sparql.queryAndConvert()
+            result = self._fetch(query)
         except Exception as e:
             print("SPARQL Error:", e)
             return pd.DataFrame()
-        
+        return self._decode_results(result)
+
+    def _execute_table_query(self, query):
+        # the queries that are not about journals, one column for each variable and one row for each result
+        try:
+            result = self._fetch(query)
+            if isinstance(result, str):
+                variables, rows = self._text_rows(result)
+            else:
+                if isinstance(result, bytes):
+                    result = json.loads(result)
+                variables = result["head"]["vars"]
+                rows = ({var: value["value"] for var, value in binding.items()} for binding in result["results"]["bindings"])
+            return pd.DataFrame([[row.get(var) for var in variables] for row in rows], columns=variables)
+        except Exception as e:
+            print("SPARQL Error:", e)
+            return pd.DataFrame()
+
+    def _decode_results(self, result):
+        # the JSON results, as a dictionary or as the bytes sent by the endpoint
+        if isinstance(result, str):
+            return self._decode_text(result)
         if isinstance(result, bytes):
             try:
-                # Decodifica i bytes in una stringa usando UTF-8 (la più comune)
-                result_str = result.decode('utf-8')
-                # Parsa la stringa JSON in un dizionario Python
-                result = json.loads(result_str)
-            except json.JSONDecodeError as jde:
-                print(f"Errore JSONDecodeError: Impossibile parsare la stringa come JSON. Dettagli: {jde}")
-                print(f"Stringa che ha causato l'errore: {result_str[:200]}...") # Stampa i primi 200 caratteri per debug
+                result = json.loads(result)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                print(f"Errore: Impossibile parsare la risposta come JSON. Dettagli: {e}")
                 return pd.DataFrame() # Restituisce un DataFrame vuoto in caso di errore
-            except UnicodeDecodeError as ude:
-                print(f"Errore UnicodeDecodeError: Impossibile decodificare i byte con UTF-8. Dettagli: {ude}")
-                return pd.DataFrame()
+        try:
+            variables = result["head"]["vars"]
+            bindings = result["results"]["bindings"]
+        except (KeyError, TypeError):
+            return pd.DataFrame()
+        return self._group_rows(variables, bindings, wrapped=True)
+
+    def _text_rows(self, text):
+        # the variables and the rows of the CSV or TSV results, the first line has the variables
+        if self.resultFormat == "tsv":
+            # only the line feeds end the lines, the literals can have the other unicode line separators
+            lines = [line[:-1] if line.endswith("\r") else line for line in text.split("\n")]
+            if not lines[0]:
+                return [], []
+            variables = [var.lstrip("?") for var in lines[0].split("\t")]
+            rows = ({var: value for var, value in zip(variables, map(_tsv_value, line.split("\t"))) if value is not None}
+                    for line in lines[1:] if line)
+        else:
+            reader = csv.reader(io.StringIO(text, newline=""))
+            variables = next(reader, None)
+            if not variables:
+                return [], []
+            # an unbound variable is an empty field
+            rows = ({var: value for var, value in zip(variables, row) if value} for row in reader)
+        return variables, rows
+
+    def _decode_text(self, text):
+        variables, rows = self._text_rows(text)
+        if not variables:
+            return pd.DataFrame()
+        return self._group_rows(variables, rows)
 
-        if result and "head" in result and "vars" in result["head"] and "results" in result and "bindings" in result["results"]:
-            journals_data = {}
-            for row in result["results"]["bindings"]:
+    def _group_rows(self, variables, rows, wrapped=False):
+        """
+        one row per journal in a single pass over the results: the rows are dictionaries with the values of
+        the bound variables, or with {"value": value} when wrapped like the JSON bindings; the identifiers and
+        the languages are collected in lists without repetitions, the other variables keep the value of the
+        last row of the journal
+        """
+        if "journal" not in variables:
+            return pd.DataFrame()
+        lists = [var for var in ("identifiers", "languages") if var in variables]
+        scalars = [var for var in variables if var not in ("journal", "identifiers", "languages")]
+
+        journal_index = {} # journal IRI -> position in the columns
+        journals = []
+        # dictionaries used as sets that keep the order in which the values are found
+        list_values = {var: [] for var in lists}
+        scalar_values = {var: [] for var in scalars}
+        for row in rows:
+            journal_uri = row.get("journal")
+            if journal_uri is None:
+                continue
+            if wrapped:
+                journal_uri = journal_uri["value"]
+            index = journal_index.get(journal_uri)
+            if index is None:
+                index = journal_index[journal_uri] = len(journals)
+                journals.append(journal_uri)
+                for values in list_values.values():
+                    values.append({})
+                for values in scalar_values.values():
+                    values.append(None)
+            for var in lists:
+                value = row.get(var)
+                if value is not None:
+                    values = list_values[var][index]
+                    # the values joined by GROUP_CONCAT, or a single value
+                    for item in (value["value"] if wrapped else value).split(SPARQL_SEPARATOR):
+                        if item:
+                            values[item] = None
+            for var in scalars:
+                value = row.get(var)
+                scalar_values[var][index] = value["value"] if wrapped and value is not None else value
+
+        if not journals:
+            return pd.DataFrame()
+        # the dataframe is built column by column, in the order of the variables
+        columns = {}
+        for var in variables:
+            if var == "journal":
+                columns[var] = journals
+            elif var in lists:
+                columns[var] = [list(values) for values in list_values[var]]
+            else:
+                columns[var] = ["" if value is None else value for value in scalar_values[var]]
+        return pd.DataFrame(columns)
 
-                journal_uri = row.get("journal", {}).get("value")
-                if not journal_uri:
-                    continue
+    # the text of the queries, shared with AsyncJournalQueryHandler
 
-                if journal_uri not in journals_data:
-                    journals_data[journal_uri] = {}
-                    for var in result["head"]["vars"]:
-                        journals_data[journal_uri][var] = row.get(var, {}).get("value", "") if var not in ["identifiers", "languages"] else []
-
-                for var in result["head"]["vars"]:
-                    value = row.get(var, {}).get("value")
-                    if var == "identifiers" and value not in journals_data[journal_uri]["identifiers"]:
-                        journals_data[journal_uri]["identifiers"].append(value)
-                    elif var == "languages" and value not in journals_data[journal_uri]["languages"]:
-                        journals_data[journal_uri]["languages"].append(value)
-                    elif var not in ["journal", "identifiers", "languages"]:
-                        journals_data[journal_uri][var] = value
-
-        # convert the dictionary in a list of dictionaries to create the Dataframe
-            list_data = []
-            for uri, data in journals_data.items():
-                list_data.append(data)
-
-            df = pd.DataFrame(list_data)
-            return df.replace(np.nan, "")
-        else:
-            return pd.DataFrame()
+    def _select(self, where):
+        """
+        the query of the journals matching where, which binds ?identifier and ?language: with aggregate each
+        journal is a single row with all its identifiers and languages joined by GROUP_CONCAT, otherwise
+        there is a row for each pair of identifier and language; the local graphs have no payload to save
+        and rdflib is slower with GROUP BY, so they always get the rows
+        """
+        if self.aggregate and _is_endpoint(self.dbPathOrUrl):
+            return f"""
+        SELECT ?journal ?title
+               (GROUP_CONCAT(DISTINCT ?identifier; separator="{SPARQL_SEPARATOR_ESCAPED}") AS ?identifiers)
+               (GROUP_CONCAT(DISTINCT ?language; separator="{SPARQL_SEPARATOR_ESCAPED}") AS ?languages)
+               ?publisher ?license ?apc ?seal
+        WHERE {{{where}}}
+        GROUP BY ?journal ?title ?publisher ?license ?apc ?seal
+        """
+        return f"""
+        SELECT DISTINCT ?journal ?title (?identifier AS ?identifiers) (?language AS ?languages) ?publisher ?license ?apc ?seal
+        WHERE {{{where}}}
+        """
 
-    def getById(self, identifier):
-        query = f"""
-        SELECT DISTINCT ?journal ?title ?identifiers ?languages ?publisher ?license ?apc ?seal
-        WHERE {{
+    def _by_id_query(self, identifier):
+        return self._select(f"""
+            ?journal <https://schema.org/identifier> {Literal(identifier).n3()} .
             ?journal a <https://schema.org/Periodical> ;
                     <https://schema.org/title> ?title ;
-                    <https://schema.org/identifier> ?identifiers ;
-                    <https://schema.org/inLanguage> ?languages ;
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/inLanguage> ?language ;
                     <https://schema.org/license> ?license .
 
             OPTIONAL {{ ?journal <https://schema.org/publisher> ?publisher }}
             OPTIONAL {{ ?journal <https://schema.org/isAccessibleForFree> ?apc }}
             OPTIONAL {{ ?journal <https://schema.org/Certification> ?seal }}
-            FILTER(CONTAINS(LCASE(?identifiers), "{identifier}"))
-        }}
-        """
-        return self.execute_sparql_query(query)
+        """)
+
+    def _by_id_substring_query(self, identifier):
+        escaped_identifier = identifier.replace('\\', '\\\\').replace('"', '\\"')
+        return self._select(f"""
+            # ?key is the identifier that matches, ?identifier still returns all the identifiers of the journal
+            ?journal <https://schema.org/identifier> ?key .
+            FILTER(CONTAINS(LCASE(?key), "{escaped_identifier.lower()}"))
+            ?journal a <https://schema.org/Periodical> ;
+                    <https://schema.org/title> ?title ;
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/inLanguage> ?language ;
+                    <https://schema.org/license> ?license .
 
-    def getAllJournals(self):
-        query =         """
-        SELECT DISTINCT ?journal ?title ?identifiers ?languages ?publisher ?license ?apc ?seal
-        WHERE {
+            OPTIONAL {{ ?journal <https://schema.org/publisher> ?publisher }}
+            OPTIONAL {{ ?journal <https://schema.org/isAccessibleForFree> ?apc }}
+            OPTIONAL {{ ?journal <https://schema.org/Certification> ?seal }}
+        """)
+
+    def _all_journals_query(self):
+        return self._select("""
           ?journal a <https://schema.org/Periodical> ;
                    <https://schema.org/title> ?title ;
-                   <https://schema.org/identifier> ?identifiers ;
-                   <https://schema.org/inLanguage> ?languages ;
+                   <https://schema.org/identifier> ?identifier ;
+                   <https://schema.org/inLanguage> ?language ;
                    <https://schema.org/license> ?license .
           OPTIONAL { ?journal <https://schema.org/publisher> ?publisher }
           OPTIONAL { ?journal <https://schema.org/isAccessibleForFree> ?apc }
           OPTIONAL { ?journal <https://schema.org/Certification> ?seal }
-        }
-        """
-        return self.execute_sparql_query(query)   #if there was an error the issn schema can be altered
-                                                  
-    def getJournalsWithTitle(self, title: str):
+        """)
+
+    def _title_query(self, title):
         escaped_title = title.replace('"', '\\"')
-        query = f"""
-        SELECT DISTINCT ?journal ?title ?identifiers ?languages ?publisher ?license ?apc ?seal
-        WHERE {{
+        return self._select(f"""
             ?journal a <https://schema.org/Periodical> ;
                     <https://schema.org/title> ?title ;
-                    <https://schema.org/identifier> ?identifiers ;
-                    <https://schema.org/inLanguage> ?languages ;
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/inLanguage> ?language ;
                     <https://schema.org/license> ?license .
             
             OPTIONAL {{ ?journal <https://schema.org/publisher> ?publisher }}
             OPTIONAL {{ ?journal <https://schema.org/isAccessibleForFree> ?apc }}
             OPTIONAL {{ ?journal <https://schema.org/Certification> ?seal }}
             FILTER(CONTAINS(LCASE(?title), "{escaped_title.lower()}"))
-        }}
-        """
-        return self.execute_sparql_query(query)
+        """)
 
-    def getJournalsPublishedBy(self, publisher: str):
+    def _publisher_query(self, publisher):
         publisher = publisher.replace('"', '\\"')
-        query = f"""
-        SELECT DISTINCT ?journal ?title ?identifiers ?languages ?publisher ?license ?apc ?seal
-        WHERE {{
+        return self._select(f"""
             ?journal a <https://schema.org/Periodical> ;
                     <https://schema.org/title> ?title ;
-                    <https://schema.org/identifier> ?identifiers ;
-                    <https://schema.org/inLanguage> ?languages ;
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/inLanguage> ?language ;
                     <https://schema.org/license> ?license .
             
             OPTIONAL {{ ?journal <https://schema.org/publisher> ?publisher }}
             OPTIONAL {{ ?journal <https://schema.org/isAccessibleForFree> ?apc }}
             OPTIONAL {{ ?journal <https://schema.org/Certification> ?seal }}
             FILTER(CONTAINS(LCASE(?publisher), "{publisher.lower()}"))
-        }}
-        """
-        return self.execute_sparql_query(query)
+        """)
 
-    def getJournalsWithLicense(self, license_set: Set[str]):
+    def _license_query(self, license_set):
         # Sanitize le stringhe nella lista per evitare problemi con le virgolette nella query
         sanitized_licenses = [lic.replace('"', '\\"') for lic in license_set]
         # Costruisci la parte della clausola FILTER con l'operatore IN
         filter_clause = 'FILTER (LCASE(?license) IN (' + ', '.join([f'"{lic.lower()}"' for lic in sanitized_licenses]) + '))'
 
-        query = f"""
-        SELECT DISTINCT ?journal ?title ?identifiers ?languages ?publisher ?license ?apc ?seal
-        WHERE {{
+        # the licenses are filtered in their own group, so the local rdflib backend joins the other properties
+        # only to the journals with these licenses instead of filtering all the journals at the end
+        return self._select(f"""
+            {{ ?journal <https://schema.org/license> ?license .
+              {filter_clause} }}
             ?journal a <https://schema.org/Periodical> ;
                     <https://schema.org/title> ?title ;
-                    <https://schema.org/identifier> ?identifiers ;
-                    <https://schema.org/inLanguage> ?languages ;
-                    <https://schema.org/license> ?license .
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/inLanguage> ?language .
 
             OPTIONAL {{ ?journal <https://schema.org/publisher> ?publisher }}
             OPTIONAL {{ ?journal <https://schema.org/isAccessibleForFree> ?apc }}
             OPTIONAL {{ ?journal <https://schema.org/Certification> ?seal }}
-            {filter_clause}
-        }}
-        """
-        return self.execute_sparql_query(query)
+        """)
 
-    def getJournalsWithAPC(self):
-        query = """
-        SELECT DISTINCT ?journal ?title ?identifiers ?languages ?publisher ?license ?apc ?seal
-        WHERE {{
+    def _apc_query(self):
+        return self._select("""
             ?journal a <https://schema.org/Periodical> ;
                     <https://schema.org/title> ?title ;
-                    <https://schema.org/identifier> ?identifiers ;
-                    <https://schema.org/inLanguage> ?languages ;
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/inLanguage> ?language ;
                     <https://schema.org/license> ?license .
             
-            OPTIONAL {{ ?journal <https://schema.org/publisher> ?publisher }}
-            OPTIONAL {{ ?journal <https://schema.org/isAccessibleForFree> ?apc }}
-            OPTIONAL {{ ?journal <https://schema.org/Certification> ?seal }}
+            OPTIONAL { ?journal <https://schema.org/publisher> ?publisher }
+            OPTIONAL { ?journal <https://schema.org/isAccessibleForFree> ?apc }
+            OPTIONAL { ?journal <https://schema.org/Certification> ?seal }
           FILTER(LCASE(?apc) = "yes")
-        }}
-        """
-        return self.execute_sparql_query(query)
+        """)
 
-    def getJournalsWithDOAJSeal(self):
-        query = """
-        SELECT DISTINCT ?journal ?title ?identifiers ?languages ?publisher ?license ?apc ?seal
-        WHERE {{
+    def _seal_query(self):
+        return self._select("""
             ?journal a <https://schema.org/Periodical> ;
                     <https://schema.org/title> ?title ;
-                    <https://schema.org/identifier> ?identifiers ;
-                    <https://schema.org/inLanguage> ?languages ;
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/inLanguage> ?language ;
                     <https://schema.org/license> ?license .
             
+            OPTIONAL { ?journal <https://schema.org/publisher> ?publisher }
+            OPTIONAL { ?journal <https://schema.org/isAccessibleForFree> ?apc }
+            OPTIONAL { ?journal <https://schema.org/Certification> ?seal }
+          FILTER(LCASE(?seal) = "yes")
+        """)
+
+    def _page_query(self, size, after=None):
+        # the IRIs of the journals of a page, only the journals with the properties asked by _journals_query
+        after_filter = f"FILTER(STR(?journal) > {Literal(after).n3()})" if after is not None else ""
+        return f"""
+        SELECT ?journal
+        WHERE {{
+            ?journal a <https://schema.org/Periodical> .
+            {after_filter}
+            FILTER EXISTS {{
+                ?journal <https://schema.org/title> [] ;
+                        <https://schema.org/identifier> [] ;
+                        <https://schema.org/inLanguage> [] ;
+                        <https://schema.org/license> [] .
+            }}
+        }}
+        ORDER BY STR(?journal)
+        LIMIT {int(size)}
+        """
+
+    def _statistics_query(self):
+        # the journals and their identifiers for each license, the licenses are compared in lower case like _license_query
+        return """
+        SELECT ?license (COUNT(DISTINCT ?journal) AS ?journals) (COUNT(DISTINCT ?identifier) AS ?identifiers)
+        WHERE {
+            ?journal a <https://schema.org/Periodical> ;
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/license> ?value .
+            BIND(LCASE(STR(?value)) AS ?license)
+        }
+        GROUP BY ?license
+        """
+
+    def _local_statistics(self):
+        # the same counts of _statistics_query walking the local graph, rdflib is slow with GROUP BY
+        graph = _local_graph(self.dbPathOrUrl)
+        schema = "https://schema.org/"
+        periodicals = set(graph.subjects(RDF.type, URIRef(schema + "Periodical")))
+        licenses = {}
+        for journal, license in graph.subject_objects(URIRef(schema + "license")):
+            if journal in periodicals:
+                licenses.setdefault(str(license).lower(), set()).add(journal)
+        rows = []
+        for license, journals in licenses.items():
+            identifiers = {identifier for journal in journals for identifier in graph.objects(journal, URIRef(schema + "identifier"))}
+            if identifiers:
+                rows.append([license, len(journals), len(identifiers)])
+        return pd.DataFrame(rows, columns=["license", "journals", "identifiers"])
+
+    def _journals_query(self, journals):
+        values = " ".join(URIRef(journal).n3() for journal in journals)
+        return self._select(f"""
+            VALUES ?journal {{ {values} }}
+            ?journal <https://schema.org/title> ?title ;
+                    <https://schema.org/identifier> ?identifier ;
+                    <https://schema.org/inLanguage> ?language ;
+                    <https://schema.org/license> ?license .
             OPTIONAL {{ ?journal <https://schema.org/publisher> ?publisher }}
             OPTIONAL {{ ?journal <https://schema.org/isAccessibleForFree> ?apc }}
             OPTIONAL {{ ?journal <https://schema.org/Certification> ?seal }}
-          FILTER(LCASE(?seal) = "yes")
-        }}
+        """)
+
+    def _local_page(self, size, after=None):
+        """
+        the page read directly from the local graph: rdflib sorts all the journals for every ORDER BY and
+        takes a few milliseconds for each journal of a VALUES block, the triples are much faster to walk
+        """
+        graph = _local_graph(self.dbPathOrUrl)
+        schema = "https://schema.org/"
+        properties = [("title", URIRef(schema + "title")), ("identifiers", URIRef(schema + "identifier")),
+                      ("languages", URIRef(schema + "inLanguage")), ("publisher", URIRef(schema + "publisher")),
+                      ("license", URIRef(schema + "license")), ("apc", URIRef(schema + "isAccessibleForFree")),
+                      ("seal", URIRef(schema + "Certification"))]
+        required = {"title", "identifiers", "languages", "license"}
+        journals = sorted(str(journal) for journal in graph.subjects(RDF.type, URIRef(schema + "Periodical")))
+
+        rows = []
+        for journal in journals[bisect.bisect_right(journals, after) if after is not None else 0:]:
+            row = {"journal": journal}
+            for var, predicate in properties:
+                values = [str(value) for value in graph.objects(URIRef(journal), predicate)]
+                if values:
+                    # the lists are joined like GROUP_CONCAT does, the other variables take one of the values
+                    row[var] = SPARQL_SEPARATOR.join(values) if var in ("identifiers", "languages") else values[0]
+            if required.issubset(row):
+                rows.append(row)
+                if len(rows) == size:
+                    break
+        return self._group_rows(["journal"] + [var for var, _ in properties], rows)
+
+    def _sort_page(self, df):
+        if df.empty:
+            return df
+        return df.sort_values("journal", ignore_index=True)
+
+    def _identifiers_queries(self, identifiers, licenses=None):
+        # one query every valuesBatchSize identifiers
+        identifiers = list(dict.fromkeys(identifiers))
+        filter_clause = ""
+        if licenses:
+            filter_clause = 'FILTER (LCASE(?license) IN (' + ', '.join(Literal(lic.lower()).n3() for lic in licenses) + '))'
+
+        queries = []
+        for start in range(0, len(identifiers), self.valuesBatchSize):
+            values = " ".join(Literal(identifier).n3() for identifier in identifiers[start:start + self.valuesBatchSize])
+            # ?key is the identifier we are looking for, ?identifier still returns all the identifiers of the journal
+            queries.append(self._select(f"""
+                VALUES ?key {{ {values} }}
+                ?journal <https://schema.org/identifier> ?key .
+                # the type is checked in a FILTER, otherwise the local rdflib backend starts the join
+                # from all the periodicals instead of the few journals with these identifiers
+                FILTER EXISTS {{ ?journal a <https://schema.org/Periodical> }}
+                ?journal <https://schema.org/title> ?title ;
+                        <https://schema.org/identifier> ?identifier ;
+                        <https://schema.org/inLanguage> ?language ;
+                        <https://schema.org/license> ?license .
+
+                OPTIONAL {{ ?journal <https://schema.org/publisher> ?publisher }}
+                OPTIONAL {{ ?journal <https://schema.org/isAccessibleForFree> ?apc }}
+                OPTIONAL {{ ?journal <https://schema.org/Certification> ?seal }}
+                {filter_clause}
+            """))
+        return queries
+
+    def _concat_batches(self, batch_dfs):
+        batch_dfs = [batch_df for batch_df in batch_dfs if not batch_df.empty]
+        if not batch_dfs:
+            return pd.DataFrame()
+        # a journal with identifiers in two different batches is returned by both of them
+        return pd.concat(batch_dfs, ignore_index=True).drop_duplicates(subset="journal", ignore_index=True)
+
+    @cached
+    def getById(self, identifier, substring=False):
+        """
+        returns the journal having exactly this identifier, the identifier is bound in the triple pattern
+        so the triplestore can answer with its index; with substring=True it returns the journals
+        having an identifier that contains it, which needs a scan of all the identifiers
+        """
+        if substring:
+            return self.execute_sparql_query(self._by_id_substring_query(identifier))
+        return self.execute_sparql_query(self._by_id_query(identifier))
+
+    def getByIds(self, identifiers):
+        """
+        returns the journals having exactly one of the identifiers, valuesBatchSize identifiers for each request
+        """
+        return self.getJournalsWithIdentifiers(identifiers)
+
+    @cached
+    def getAllJournals(self):
+        return self.execute_sparql_query(self._all_journals_query())   #if there was an error the issn schema can be altered
+                                                  
+    @cached
+    def getJournalsWithTitle(self, title: str):
+        return self.execute_sparql_query(self._title_query(title))
+
+    @cached
+    def getJournalsPublishedBy(self, publisher: str):
+        return self.execute_sparql_query(self._publisher_query(publisher))
+
+    @cached
+    def getJournalsWithLicense(self, license_set: Set[str]):
+        return self.execute_sparql_query(self._license_query(license_set))
+
+    @cached
+    def getJournalsWithAPC(self):
+        return self.execute_sparql_query(self._apc_query())
+
+    @cached
+    def getJournalsWithDOAJSeal(self):
+        return self.execute_sparql_query(self._seal_query())
+
+    @cached
+    def getJournalsPage(self, size: int, after: str = None):
+        """
+        returns the journals like getAllJournals, but only the first size journals with an IRI greater than
+        after (from the first one when after is None), ordered by IRI: the journal of the last row is the
+        after of the next page
+        """
+        try:
+            local = _is_local_graph(self.dbPathOrUrl)
+        except ValueError as e:
+            print("SPARQL Error:", e)
+            return pd.DataFrame()
+        if local:
+            with _local_graph_lock(self.dbPathOrUrl):
+                return self._sort_page(self._local_page(size, after))
+        # the IRIs of the journals of the page first, then their properties
+        journals = self.execute_sparql_query(self._page_query(size, after))
+        if journals.empty:
+            return journals
+        return self._sort_page(self.execute_sparql_query(self._journals_query(journals["journal"].tolist())))
+
+    @cached
+    def getJournalsWithIdentifiers(self, identifiers, licenses=None):
+        """
+        returns only the journals having at least one of the identifiers (and one of the licenses, if given),
+        the identifiers are sent to the triplestore in a VALUES block, valuesBatchSize at a time
         """
-        return self.execute_sparql_query(query)
+        return self._concat_batches([self.execute_sparql_query(query) for query in self._identifiers_queries(identifiers, licenses)])
+
+    @cached
+    def getStatistics(self):
+        """
+        returns the number of journals in the graph ("journals"), of their identifiers ("identifiers") and of
+        the journals with each license in lower case, as rows of kind, value and count like
+        CategoryQueryHandler.getStatistics
+        """
+        try:
+            local = _is_local_graph(self.dbPathOrUrl)
+        except ValueError as e:
+            print("SPARQL Error:", e)
+            return pd.DataFrame()
+        if local:
+            with _local_graph_lock(self.dbPathOrUrl):
+                df = self._local_statistics()
+        else:
+            df = self._execute_table_query(self._statistics_query())
+            if len(df.columns) == 0:
+                return df
+        counts = df[["journals", "identifiers"]].apply(pd.to_numeric)
+        rows = [["journals", "", int(counts["journals"].sum())], ["identifiers", "", int(counts["identifiers"].sum())]]
+        rows += [["license", license, int(count)] for license, count in zip(df["license"], counts["journals"])]
+        return pd.DataFrame(rows, columns=["kind", "value", "count"])
 
 # ------------------------------------------------------------------------------------------------------
 # Basic Query Engine - Edoardo AM Tarpinelli
 
+# threads used by all the engines to ask the handlers at the same time, they are kept alive between the
+# queries so the handlers can reuse the connections opened by each thread
+_handler_executor = None
+_handler_executor_lock = threading.Lock()
+
+
+def _get_handler_executor():
+    global _handler_executor
+    with _handler_executor_lock:
+        if _handler_executor is None:
+            _handler_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="handler")
+        return _handler_executor
+
+
+def _sqlite_has_json():
+    # json_each is in the JSON1 extension, built in since SQLite 3.38 but optional before
+    con = connect(":memory:")
+    try:
+        con.execute("SELECT value FROM json_each('[]')")
+        return True
+    except Error:
+        return False
+    finally:
+        con.close()
+
+# the sets of values are sent as a single JSON parameter when SQLite can read it, otherwise as batches of
+# variables, below the 999 allowed by the SQLite builds before 3.32
+_sqlite_json = _sqlite_has_json()
+_sqlite_materialized = sqlite_version_info >= (3, 35, 0) # AS MATERIALIZED in a WITH clause
+SQLITE_VARIABLES_BATCH = 900
+
+
+def _retire_handler_executor(executor):
+    """
+    a call that did not answer in time cannot be stopped and keeps its thread: the threads of executor are
+    left to the calls already sent to them, and the next queries get a new executor, so a few databases
+    that never answer cannot take all the threads of the engines
+    """
+    global _handler_executor
+    with _handler_executor_lock:
+        if _handler_executor is executor:
+            _handler_executor = None
+    executor.shutdown(wait=False)
+
+
 class BasicQueryEngine(object):
 
     def __init__(self):
         self.journalQuery = [] # [0..*] - graph
         self.categoryQuery = [] # [0..*] - rdb
+        self.handlerTimeout = 60.0 # seconds to wait for each handler, the ones that do not answer in time are left out
+        self.journalSnapshot = None # memory-mapped journal snapshot, used instead of journalQuery when loaded
+        self.categorySnapshot = None # memory-mapped category snapshot, used instead of categoryQuery when loaded
+        self._snapshotCategoryHandler = None # CategoryQueryHandler of the category snapshot, copied in an in-memory database
+        self._snapshotConnection = None # keeps the in-memory database of the category snapshot alive
+
+    def loadSnapshot(self, journalPath=None, categoryPath=None) -> bool:
+        """
+        memory-maps the snapshots written by the upload handlers, the journal queries, the category and area
+        queries and the cross queries are then answered from them without asking the databases
+        """
+        if journalPath is not None:
+            table = _read_snapshot(journalPath, "journal")
+            if table is None:
+                return False
+            self.journalSnapshot = table
+
+        if categoryPath is not None:
+            table = _read_snapshot(categoryPath, "category")
+            if table is None:
+                return False
+            self._load_category_snapshot(table)
+            self.categorySnapshot = table
+        return True
+
+    def unloadSnapshot(self) -> bool:
+        self.journalSnapshot = None
+        self.categorySnapshot = None
+        self._close_category_snapshot()
+        return True
+
+    def _close_category_snapshot(self):
+        if self._snapshotCategoryHandler is not None:
+            self._snapshotCategoryHandler.close()
+            self._snapshotConnection.close()
+        self._snapshotCategoryHandler = None
+        self._snapshotConnection = None
+
+    def _load_category_snapshot(self, table):
+        """
+        the items of the category snapshot are written in an in-memory database with the tables of
+        CategoryUploadHandler, so the category, area and cross queries run the same SQL of the relational
+        databases; the database lives until the connection that wrote it is closed
+        """
+        self._close_category_snapshot()
+        path = f"file:category-snapshot-{next(_snapshot_databases)}?mode=memory&cache=shared"
+        con = connect(path, uri=True, check_same_thread=False)
+        CategoryUploadHandler()._write_items(con, table.to_pylist())
+        handler = CategoryQueryHandler()
+        handler.setDbPathOrUrl(path)
+        handler.cache = None
+        self._snapshotConnection = con
+        self._snapshotCategoryHandler = handler
+
+    def _journal_snapshot_of_identifiers(self, identifiers, licenses=None):
+        # the journals of the snapshot with one of the identifiers (and one of the licenses), like getJournalsWithIdentifiers
+        column = self.journalSnapshot.column("identifiers").combine_chunks()
+        found = pc.is_in(pc.list_flatten(column), value_set=pa.array(list(identifiers), pa.string()))
+        mask = np.zeros(len(column), dtype=bool)
+        mask[pc.list_parent_indices(column).to_numpy()[found.to_numpy(zero_copy_only=False)]] = True
+        if licenses:
+            mask &= self._snapshot_mask("getJournalsWithLicense", licenses).to_numpy(zero_copy_only=False)
+        return self._journal_snapshot_df(pa.array(mask))
+
+    def _category_df(self, method, *args):
+        # the categories and the areas from the snapshot if it is loaded, otherwise from all the category handlers
+        if self.categorySnapshot is not None:
+            return getattr(self._snapshotCategoryHandler, method)(*args)
+        return self._categories(method, *args)
+
+    def _journal_snapshot_df(self, mask=None):
+        # only the selected rows are converted to a dataframe, the list columns as python lists
+        # like the ones built by JournalQueryHandler
+        return self._journal_table_df(self.journalSnapshot if mask is None else self.journalSnapshot.filter(mask))
+
+    def _journal_snapshot_page(self, size, after=None):
+        table = self.journalSnapshot
+        if after is not None:
+            table = table.filter(pc.greater(table.column("journal"), after))
+        indices = pc.select_k_unstable(table, k=min(size, table.num_rows), sort_keys=[("journal", "ascending")])
+        return self._journal_table_df(table.take(indices).sort_by("journal"))
+
+    def _journal_table_df(self, table):
+        df = table.drop_columns(["identifiers", "languages"]).to_pandas()
+        df["identifiers"] = table.column("identifiers").to_pylist()
+        df["languages"] = table.column("languages").to_pylist()
+        return df[table.column_names]
+
+    def _fan_out(self, handlers, method, *args):
+        """
+        calls the same method of all the handlers at the same time and returns their results in the order of
+        the handlers, the handlers that fail or do not answer within handlerTimeout seconds are left out
+        """
+        if not handlers:
+            return []
+        executor = _get_handler_executor()
+        futures = [executor.submit(getattr(handler, method), *args) for handler in handlers]
+        done, not_done = wait(futures, timeout=self.handlerTimeout)
+        if not_done:
+            _retire_handler_executor(executor)
+
+        results = []
+        for handler, future in zip(handlers, futures):
+            if future in not_done:
+                future.cancel()
+                print(f"{method} on {handler.getDbPathOrUrl()} did not answer within {self.handlerTimeout} seconds")
+                continue
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"{method} on {handler.getDbPathOrUrl()} failed: {e}")
+        return results
+
+    def _merge(self, dfs, subset=None):
+        # the rows returned by more than one handler are kept once, journals are compared by their IRI
+        dfs = [df for df in dfs if not df.empty]
+        if not dfs:
+            return pd.DataFrame()
+        if len(dfs) == 1:
+            return dfs[0]
+        return pd.concat(dfs, ignore_index=True).drop_duplicates(subset=subset, ignore_index=True)
+
+    def _journals(self, method, *args):
+        return self._merge(self._fan_out(self.journalQuery, method, *args), subset="journal")
+
+    def _categories(self, method, *args):
+        return self._merge(self._fan_out(self.categoryQuery, method, *args))
+
+    def _links_queries(self, identifiers):
+        """
+        the queries, with their parameters, for the categories and the areas of a set of identifiers: the
+        identifiers are a single JSON parameter, read once into a CTE that is scanned while each identifier is
+        found with the index of the identifier table, so there can be more than the variables allowed by
+        SQLite (and CREATE TEMP TABLE is not allowed on the query_only connections); without json_each
+        they are sent SQLITE_VARIABLES_BATCH at a time
+        """
+        if _sqlite_json:
+            materialized = "MATERIALIZED" if _sqlite_materialized else ""
+            wanted = f"WITH wanted(identifier) AS {materialized} (SELECT DISTINCT value FROM json_each(?))"
+            return [(self._links_query(wanted), (json.dumps(list(identifiers)),))]
+        identifiers = list(dict.fromkeys(identifiers))
+        queries = []
+        for start in range(0, len(identifiers), SQLITE_VARIABLES_BATCH):
+            batch = identifiers[start:start + SQLITE_VARIABLES_BATCH]
+            values = ", ".join("(?)" for _ in batch)
+            queries.append((self._links_query(f"WITH wanted(identifier) AS (VALUES {values})"), tuple(batch)))
+        return queries
+
+    def _links_query(self, wanted):
+        return f"""
+            {wanted}
+            SELECT i.identifier AS identifiers, 'category' AS kind, c.category_id AS value
+            FROM wanted w
+            JOIN identifier i ON i.identifier = w.identifier
+            JOIN journal_category jc ON jc.journal_id = i.journal_id
+            JOIN category c ON c.category_pk = jc.category_pk
+
+            UNION ALL
+
+            SELECT i.identifier, 'area', a.area
+            FROM wanted w
+            JOIN identifier i ON i.identifier = w.identifier
+            JOIN journal_area ja ON ja.journal_id = i.journal_id
+            JOIN area a ON a.area_pk = ja.area_pk
+        """
+
+    def _group_lists(self, df):
+        # identifier -> its values without repetitions, in the order they are found: the rows are sorted by
+        # identifier once and cut where the identifier changes
+        codes, identifiers = pd.factorize(df["identifiers"])
+        order = np.argsort(codes, kind="stable")
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        return dict(zip(identifiers.tolist(), [values.tolist() for values in np.split(df["value"].to_numpy(object)[order], bounds)]))
+
+    def _links(self, dfs):
+        # the rows of all the relational databases grouped by identifier, for the areas and for the categories
+        dfs = [df for df in dfs if not df.empty]
+        if not dfs:
+            return {}, {}
+        df = pd.concat(dfs, ignore_index=True).drop_duplicates(ignore_index=True)
+        areas = df["kind"] == "area"
+        return self._group_lists(df[areas]), self._group_lists(df[~areas])
+
+    def _identifier_links(self, all_identifiers):
+        """
+        returns the dictionaries {'journal_identifier': list['associated_area']} and
+        {'journal_identifier': list['associated_category']}, asking each relational database only once
+        """
+        if (self.categorySnapshot is None and not self.categoryQuery) or not all_identifiers:
+            return {}, {}
+        return self._links(self._category_queries(self._links_queries(all_identifiers)))
+
+    def _category_queries(self, queries):
+        # the rows of each query and parameters from the category snapshot if it is loaded, otherwise from all the relational databases
+        if self.categorySnapshot is not None:
+            return [self._snapshotCategoryHandler._execute_query(query, params) for query, params in queries]
+        return [df for query, params in queries for df in self._fan_out(self.categoryQuery, "_execute_query", query, params)]
 
     def getCategoryQuartile_mapped(self, all_identifiers):
         """
         it returns a dictionary with {'journal_identifier': list['associated_category_quartile']} for each journal in the input list 
         """
-        identifier_to_category_quartiles = {}
-        if not self.categoryQuery or not all_identifiers:
-            return identifier_to_category_quartiles
-
-        for handler in self.categoryQuery:
-            with connect(handler.dbPathOrUrl) as con:
-                placeholders = ', '.join(['?'] * len(all_identifiers))
-                query = f"""
-                    SELECT identifiers, category_id, category_quartile
-                    FROM info
-                    WHERE identifiers IN ({placeholders})
-                """
-                df = pd.read_sql_query(query, con, params=all_identifiers)
-                if not df.empty:
-                    for index, row in df.iterrows():
-                        identifier = row['identifiers']
-                        category_id = row['category_id']
-                        category_quartile = row['category_quartile']
-                        if identifier not in identifier_to_category_quartiles:
-                            identifier_to_category_quartiles[identifier] = []
-                        # Memorizziamo la coppia (category_id, category_quartile) come una tupla
-                        if category_id not in identifier_to_category_quartiles[identifier]:
-                            identifier_to_category_quartiles[identifier].append(category_id)
-        return identifier_to_category_quartiles
+        return self._identifier_links(all_identifiers)[1]
 
     def gethasArea_mapped(self, all_identifiers):
         """
         it returns a dictionary with {'journal_identifier': list['associated_area']} for each journal in the input list 
         """
-        identifier_to_areas = {}
-        if not self.categoryQuery or not all_identifiers:
-            return identifier_to_areas
-
-        for handler in self.categoryQuery:
-            with connect(handler.dbPathOrUrl) as con:
-                placeholders = ', '.join(['?'] * len(all_identifiers))
-                query = f"""
-                    SELECT identifiers, area
-                    FROM info
-                    WHERE identifiers IN ({placeholders})
-                """
-                df = pd.read_sql_query(query, con, params=all_identifiers)
-                if not df.empty:
-                    # print(df)
-                    for index, row in df.iterrows():
-                        identifier = row['identifiers']
-                        area_value = row['area']
-                        if identifier not in identifier_to_areas:
-                            identifier_to_areas[identifier] = []
-                        if area_value not in identifier_to_areas[identifier]:
-                            identifier_to_areas[identifier].append(area_value)
-        return identifier_to_areas
-    
-    def createJournalObject(self, input_dataframe):
+        return self._identifier_links(all_identifiers)[0]
 
-        journal_list = list()
-        all_journal_identifiers_set = set()
+    def _journal_identifiers(self, input_dataframe):
+        return [x if isinstance(x, list) else [x] if isinstance(x, str) else []
+                for x in input_dataframe['identifiers'].tolist()]
 
-        for index, row in input_dataframe.iterrows(): 
-            # check whether a journal has one or more identifiers to be used in hasArea/hasCategory methods
-            identifiers = row['identifiers']
-            if isinstance(identifiers, list):
-                all_journal_identifiers_set.update(identifiers)
-            elif isinstance(identifiers, str):
-                all_journal_identifiers_set.add(identifiers)
-
-        all_journal_identifiers = list(all_journal_identifiers_set)
+    def createJournalObject(self, input_dataframe):
+        if input_dataframe.empty:
+            return []
 
         # get hasCategory and hasArea for each journal in a dictionary ('journal identifier': list['has...'])
-        identifier_to_areas = self.gethasArea_mapped(all_journal_identifiers)
-        identifier_to_categories = self.getCategoryQuartile_mapped(all_journal_identifiers)
-
-        for row in input_dataframe.itertuples(index=False):
-            
-            first_identifier = row.identifiers[0] if isinstance(row.identifiers, list) and len(row.identifiers) > 0 else row.identifiers if isinstance(row.identifiers, str) else None
-            has_area = identifier_to_areas.get(first_identifier, [])
-            has_category = identifier_to_categories.get(first_identifier, [])
-            # print(first_identifier, "\n", 
-            #     row.title, "\n", 
-            #     list(row.languages) if isinstance(row.languages, list) and len(row.languages) > 0 else [], "\n", 
-            #     row.publisher if pd.notna(row.publisher) else None, "\n", 
-            #     True if pd.notna(row.seal) and str(row.seal.lower()).lower() == 'yes' else False, "\n", 
-            #     row.license if pd.notna(row.license) else None, "\n", 
-            #     True if pd.notna(row.apc) and str(row.apc.lower()).lower() == 'yes' else False, "\n", 
-                # has_category, # Implementa la logica di recupero efficiente se necessario
-                # has_area)
-            journal = Journal(
-                id=row.identifiers,
-                title=row.title,
-                languages=list(row.languages) if isinstance(row.languages, list) and len(row.languages) > 0 else [],
-                publisher=row.publisher if pd.notna(row.publisher) else None,
-                seal=True if pd.notna(row.seal) and str(row.seal.lower()).lower() == 'yes' else False,
-                license=row.license if pd.notna(row.license) else None,
-                apc=True if pd.notna(row.apc) and str(row.apc.lower()).lower() == 'yes' else False,
-                hasCategory=has_category, # Implementa la logica di recupero efficiente se necessario
+        identifiers = self._journal_identifiers(input_dataframe)
+        all_journal_identifiers = list({i for ids in identifiers for i in ids})
+        identifier_to_areas, identifier_to_categories = self._identifier_links(all_journal_identifiers)
+        return self._build_journals(input_dataframe, identifiers, identifier_to_areas, identifier_to_categories)
+
+    def _build_journals(self, input_dataframe, identifiers, identifier_to_areas, identifier_to_categories):
+        # every column is prepared at once, then the objects are created in a single pass
+        languages = [list(x) if isinstance(x, list) else [] for x in input_dataframe['languages'].tolist()]
+        publishers = input_dataframe['publisher'].astype(object).where(input_dataframe['publisher'].notna(), None).tolist()
+        licenses = input_dataframe['license'].astype(object).where(input_dataframe['license'].notna(), None).tolist()
+        seals = input_dataframe['seal'].fillna('').astype(str).str.lower().eq('yes').tolist()
+        apcs = input_dataframe['apc'].fillna('').astype(str).str.lower().eq('yes').tolist()
+
+        # hasCategory and hasArea are looked up with the first identifier of each journal
+        first_identifiers = [ids[0] if ids else None for ids in identifiers]
+        has_areas = [identifier_to_areas.get(i, []) for i in first_identifiers]
+        has_categories = [identifier_to_categories.get(i, []) for i in first_identifiers]
+
+        return [
+            Journal(
+                id=ids,
+                title=title,
+                languages=langs,
+                publisher=publisher,
+                seal=seal,
+                license=license,
+                apc=apc,
+                hasCategory=has_category,
                 hasArea=has_area
             )
-            journal_list.append(journal)
-
-        return journal_list
+            for ids, title, langs, publisher, seal, license, apc, has_category, has_area in zip(
+                identifiers, input_dataframe['title'].tolist(), languages, publishers, seals, licenses, apcs,
+                has_categories, has_areas)
+        ]
 
     def createCategoryObject(self, input_dataframe):
-        category_list = list()
+        if input_dataframe.empty:
+            return []
+        # each category gets only its own identifier, one object for each category_id (with its first quartile)
         input_dataframe = input_dataframe.drop_duplicates(subset=['category_id'], keep='first')
-        # print(len(input_dataframe['category_id']))
-        id_list = list()
-        for index, row in input_dataframe.iterrows():
-            # print(row['category_id'], "\n",
-                # row['category_quartile'])
-            id_list.append(row['category_id'])
-            category = Category(
-                id=id_list,
-                quartile=row['category_quartile']
-            )
-            category_list.append(category)
-        return category_list
+        return [
+            Category(id=[category_id], quartile=category_quartile)
+            for category_id, category_quartile in zip(input_dataframe['category_id'].tolist(),
+                                                      input_dataframe['category_quartile'].tolist())
+        ]
 
     def createAreaObject(self, input_dataframe):
-        area_list = list()
-        id_list = list()
-        for index, row in input_dataframe.iterrows():
-            # print(row['area'])
-            id_list.append(row['area'])
-            area = Area(
-                id=id_list,
-            )
-            area_list.append(area)
-        return area_list    
+        if input_dataframe.empty:
+            return []
+        # each area gets only its own identifier
+        return [Area(id=[area_value]) for area_value in input_dataframe['area'].tolist()]
 
     def cleanJournalHandlers(self):
         self.journalQuery.clear() # Boolean
@@ -856,14 +2347,9 @@ class BasicQueryEngine(object):
     
     def getEntityById(self, input_identifier: str) -> IdentifiableEntity:
         
-        if len(self.journalQuery) > 0:
-            for handler in self.journalQuery:
-                journal_df = handler.getById(input_identifier)
-        
-        if len(self.categoryQuery) > 0:
-            for handler in self.categoryQuery:
-                cat_area_df = handler.getById(input_identifier)
-        
+        journal_df = self._journals("getById", input_identifier)
+        cat_area_df = self._category_df("getById", input_identifier)
+
         if journal_df.empty and cat_area_df.empty:
             return None
 
@@ -879,328 +2365,828 @@ class BasicQueryEngine(object):
                 cat_area_df = cat_area_df.rename(columns={'identity': 'area'})
                 return Area
 
-    def getAllJournals(self) -> List[Journal]:
-        
-        if len(self.journalQuery) > 0:
-            for handler in self.journalQuery:
-                new_journal_df = handler.getAllJournals()
-                 
+    def _snapshot_mask(self, method, *args):
+        # the filter of each journal query on the columns of the snapshot, None for all the journals
+        def column(name):
+            return pc.utf8_lower(self.journalSnapshot.column(name))
+
+        if method == "getJournalsWithTitle":
+            return pc.match_substring(column("title"), args[0].lower())
+        if method == "getJournalsPublishedBy":
+            return pc.match_substring(column("publisher"), args[0].lower())
+        if method == "getJournalsWithLicense":
+            return pc.is_in(column("license"), value_set=pa.array([l.lower() for l in args[0]], pa.string()))
+        if method == "getJournalsWithAPC":
+            return pc.equal(column("apc"), "yes")
+        if method == "getJournalsWithDOAJSeal":
+            return pc.equal(column("seal"), "yes")
+        return None
+
+    def _journal_df(self, method, *args):
+        # the journals from the snapshot if it is loaded, otherwise from all the journal handlers
+        if self.journalSnapshot is not None:
+            return self._journal_snapshot_df(self._snapshot_mask(method, *args))
+        return self._journals(method, *args)
 
-        return self.createJournalObject(new_journal_df)
+    def getAllJournals(self) -> List[Journal]:
+        return self.createJournalObject(self._journal_df("getAllJournals"))
     
     def getJournalsWithTitle(self, partialTitle: str) -> List[Journal]:
-        if len(self.journalQuery) > 0:
-            for handler in self.journalQuery:
-                # print(handler)
-                new_journal_df = handler.getJournalsWithTitle(partialTitle)
-
-        return self.createJournalObject(new_journal_df)
-
+        return self.createJournalObject(self._journal_df("getJournalsWithTitle", partialTitle))
 
     def getJournalsPublishedBy(self, partialName: str) -> List[Journal]:
-        if len(self.journalQuery) > 0:
-            for handler in self.journalQuery:
-                new_journal_df = handler.getJournalsPublishedBy(partialName)
-
-        return self.createJournalObject(new_journal_df)
+        return self.createJournalObject(self._journal_df("getJournalsPublishedBy", partialName))
 
     def getJournalsWithLicense(self, licenses: Set[str]) -> List[Journal]:
-        if len(self.journalQuery) > 0:
-            for handler in self.journalQuery:
-                new_journal_df = handler.getJournalsWithLicense(licenses)
-
-        return self.createJournalObject(new_journal_df)
+        return self.createJournalObject(self._journal_df("getJournalsWithLicense", licenses))
 
     def getJournalsWithAPC(self) -> List[Journal]:
-        if len(self.journalQuery) > 0:
-            for handler in self.journalQuery:
-                new_journal_df = handler.getJournalsWithAPC()
-
-        return self.createJournalObject(new_journal_df)
+        return self.createJournalObject(self._journal_df("getJournalsWithAPC"))
 
     def getJournalsWithDOAJSeal(self) -> List[Journal]:
-        if len(self.journalQuery) > 0:
-            for handler in self.journalQuery:
-                new_journal_df = handler.getJournalsWithDOAJSeal()
-
-        return self.createJournalObject(new_journal_df)
+        return self.createJournalObject(self._journal_df("getJournalsWithDOAJSeal"))
     
     def getAllCategories(self) -> List[Category]:
-        if len(self.categoryQuery) > 0:
-            for handler in self.categoryQuery:
-                new_category_df = handler.getAllCategories()
-            
+        new_category_df = self._category_df("getAllCategories")
         return self.createCategoryObject(new_category_df)
 
     
     def getAllAreas(self) -> List[Area]:
-        if len(self.categoryQuery) > 0:
-            for handler in self.categoryQuery:
-                new_area_df = handler.getAllAreas()
-            
+        new_area_df = self._category_df("getAllAreas")
         return self.createAreaObject(new_area_df)
         
     
     def getCategoriesWithQuartile(self, quartiles=None) -> List[Category]:
-        if len(self.categoryQuery) > 0:
-            for handler in self.categoryQuery:
-                new_category_df = handler.getCategoriesWithQuartile(quartiles)
-            
+        new_category_df = self._category_df("getCategoriesWithQuartile", quartiles)
         return self.createCategoryObject(new_category_df)   
     
     def getCategoriesAssignedToAreas(self, area_ids=None) -> List[Category]:
-        if len(self.categoryQuery) > 0:
-            for handler in self.categoryQuery:
-                new_category_df = handler.getCategoriesAssignedToAreas(area_ids)
-            
+        new_category_df = self._category_df("getCategoriesAssignedToAreas", area_ids)
         return self.createCategoryObject(new_category_df)
         
 
     def getAreasAssignedToCategories(self, category_ids=None) -> List[Area]:
-        if len(self.categoryQuery) > 0:
-            for handler in self.categoryQuery:
-                new_area_df = handler.getAreasAssignedToCategories(category_ids)
-            
+        new_area_df = self._category_df("getAreasAssignedToCategories", category_ids)
         return self.createAreaObject(new_area_df)
+
+    def _first_keys(self, df, column, size):
+        # every handler returns its own next page, the page of the engine has the first size keys among them
+        if df.empty:
+            return df
+        df = df.sort_values(column, kind="stable", ignore_index=True)
+        keys = df[column].drop_duplicates().iloc[:size]
+        return df[df[column].isin(keys)].reset_index(drop=True)
+
+    def _next_after(self, df, column, size):
+        # a page shorter than size is the last one
+        return df[column].iloc[-1] if df[column].nunique() == size else None
+
+    def getJournalsPage(self, size: int, after: str = None):
+        """
+        returns the first size journals, in the order of their IRIs, after the IRI after (from the first journal
+        when after is None), and the after of the next page, None when this is the last page
+        """
+        if self.journalSnapshot is not None:
+            df = self._journal_snapshot_page(size, after)
+        else:
+            df = self._first_keys(self._journals("getJournalsPage", size, after), "journal", size)
+        if df.empty:
+            return [], None
+        return self.createJournalObject(df), self._next_after(df, "journal", size)
+
+    def getCategoriesPage(self, size: int, after: str = None):
+        """
+        returns the first size categories, in the order of their ids, after the id after (from the first
+        category when after is None), and the after of the next page, None when this is the last page
+        """
+        df = self._first_keys(self._category_df("getCategoriesPage", size, after), "category_id", size)
+        if df.empty:
+            return [], None
+        return self.createCategoryObject(df), self._next_after(df, "category_id", size)
+
+    def iterJournals(self, pageSize: int = 1000):
+        """
+        yields all the journals one page at a time, so only a page of them is in memory
+        """
+        journals, after = self.getJournalsPage(pageSize)
+        yield from journals
+        while after is not None:
+            journals, after = self.getJournalsPage(pageSize, after)
+            yield from journals
+
+    def iterCategories(self, pageSize: int = 1000):
+        """
+        yields all the categories one page at a time
+        """
+        categories, after = self.getCategoriesPage(pageSize)
+        yield from categories
+        while after is not None:
+            categories, after = self.getCategoriesPage(pageSize, after)
+            yield from categories
         
 # ------------------------------------------------------------------------------------------------------
 # Full Query Engine - Edoardo AM Tarpinelli
 
+def _safe_string_to_list(s):
+    if isinstance(s, str):
+        s = s.strip()
+        if s.startswith('[') and s.endswith(']'):
+            s = s[1:-1]
+            items = re.split(r',\s*(?=[^\]"]*(?:\"[^\]\"]*\"[^\]"]*)*[^\]"]*$)', s)
+            items = [item.strip().strip('"').strip("'") for item in items]
+            return items
+        else:
+            return [s]
+    return s
+
+
+# the filters of the cross queries of FullQueryEngine, evaluated by the relational databases and by the graph
+# (None when the graph has no filter, so it cannot be asked first)
+_cross_queries = {
+    "getJournalsInCategoriesWithQuartile": ("identifiers in the categories with the quartiles", None),
+    "getJournalsInAreasWithLicense": ("identifiers in the areas", "journals with the licenses"),
+    "getDiamondJournalsInAreasAndCategoriesWithQuartile": ("identifiers in the areas and in the categories with the quartiles", None)
+}
+
+
 class FullQueryEngine(BasicQueryEngine):
 
-    def getJournalsInCategoriesWithQuartile(self, category_id=Set[str], category_quartile=Set[str]) -> List[Journal]:
-        def safe_string_to_list(s):
-            if isinstance(s, str):
-                s = s.strip()
-                if s.startswith('[') and s.endswith(']'):
-                    s = s[1:-1]
-                    items = re.split(r',\s*(?=[^\]"]*(?:\"[^\]\"]*\"[^\]"]*)*[^\]"]*$)', s)
-                    items = [item.strip().strip('"').strip("'") for item in items]
-                    return items
-                else:
-                    return [s]
-            return s
-
-        if len(category_id) == 0:
-            for handler in self.categoryQuery:
-                cat_id_df = handler.getAllCategories()
-            category_id = cat_id_df['category_id'].unique().tolist()
-
-        if len(category_quartile) == 0:
-            for handler in self.categoryQuery:
-                cat_id_df = handler.getAllCategories()
-            category_quartile = cat_id_df['category_quartile'].unique().tolist()            
-        
-        category_id_quartile_list = []
-
-        for item in category_id:
-            for quart in category_quartile:
-                category_id_quartile_list.append((item, quart))
-
-        for handler in self.categoryQuery:
-            with connect(handler.dbPathOrUrl) as con:
-                placeholders = ', '.join(['(?, ?)'] * len(category_id_quartile_list))
-                query = f"""
-                    SELECT identifiers
-                    FROM info
-                    WHERE (category_id, category_quartile) IN ({placeholders});
-                """
-                params = [item for pair in category_id_quartile_list for item in pair]
-                df = pd.read_sql_query(query, con, params=params)
-        df = df.drop_duplicates(subset="identifiers", keep='first', inplace=False) # HERE I GET THE DF WITH IDENTIFIERS OF INTEREST
-            
-        if len(self.journalQuery) > 0:
-            all_journal_dfs = []
-            for handler in self.journalQuery:
-                new_journal_df = handler.getAllJournals()
-                all_journal_dfs.append(new_journal_df) # HERE I GET THE DF WITH ALL JOURNALS 
-                
-            if all_journal_dfs:
-                all_journals_df = pd.concat(all_journal_dfs, ignore_index=True)
+    def __init__(self):
+        super().__init__()
+        self.planner = True # the statistics of the handlers choose which side is asked first, False to always start from the relational databases
+        self._plannerStatistics = None # (handlers and versions of their databases, statistics) of the last _statistics
+
+    def _add_statistics(self, dfs):
+        # the counts of all the handlers of a kind added together, (kind, value) -> count
+        dfs = [df for df in dfs if not df.empty]
+        if not dfs:
+            return {}
+        df = pd.concat(dfs, ignore_index=True)
+        return df.groupby(["kind", "value"])["count"].sum().to_dict()
+
+    def _statistics_key(self):
+        # the statistics are asked again only when a handler is added or removed or one of the databases is uploaded
+        return tuple((handler, handler.getDbPathOrUrl(), QueryCache.version(handler.getDbPathOrUrl()))
+                     for handler in self.categoryQuery + self.journalQuery)
+
+    def _keep_statistics(self, key, category_dfs, journal_dfs):
+        statistics = (self._add_statistics(category_dfs), self._add_statistics(journal_dfs))
+        # a handler that failed is asked again the next time
+        if len(category_dfs) == len(self.categoryQuery) and len(journal_dfs) == len(self.journalQuery) \
+                and all(len(df.columns) > 0 for df in category_dfs + journal_dfs):
+            self._plannerStatistics = (key, statistics)
+        return statistics
+
+    def _statistics(self):
+        key = self._statistics_key()
+        if self._plannerStatistics is not None and self._plannerStatistics[0] == key:
+            return self._plannerStatistics[1]
+        return self._keep_statistics(key, self._fan_out(self.categoryQuery, "getStatistics"),
+                                     self._fan_out(self.journalQuery, "getStatistics"))
+
+    def _estimate(self, statistics, total, kind, values):
+        # the identifiers with any of the values, an empty set is no filter; a journal can have more than one of
+        # the values, so the sum is at most all the identifiers
+        if not values:
+            return statistics.get((total, ""), 0)
+        count = sum(statistics.get((kind, "" if value is None else str(value)), 0) for value in values)
+        return min(count, statistics.get((total, ""), 0))
+
+    def _plan(self, method, args, category_statistics, journal_statistics):
+        """
+        the estimated identifiers returned by each side of a cross query and the side asked first: the one
+        returning fewer identifiers, whose identifiers are then the only ones looked up on the other side
+        """
+        if method == "getJournalsInCategoriesWithQuartile":
+            category_id, category_quartile = args
+            sql = min(self._estimate(category_statistics, "identifiers", "category", category_id),
+                      self._estimate(category_statistics, "identifiers", "quartile", category_quartile))
+        elif method == "getJournalsInAreasWithLicense":
+            sql = self._estimate(category_statistics, "identifiers", "area", args[0])
+        else:
+            area, category_id, category_quartile = args
+            sql = min(self._estimate(category_statistics, "identifiers", "area", area),
+                      self._estimate(category_statistics, "identifiers", "category", category_id),
+                      self._estimate(category_statistics, "identifiers", "quartile", category_quartile))
+
+        graph = journal_statistics.get(("identifiers", ""), 0)
+        licenses = args[1] if method == "getJournalsInAreasWithLicense" else None
+        if licenses:
+            # the licenses are counted in journals, each one with the average number of identifiers
+            journals = journal_statistics.get(("journals", ""), 0)
+            per_journal = graph / journals if journals else 0
+            # only the license rows are rescaled, the total of the identifiers is still the cap of the estimate
+            scaled = {key: count * per_journal if key[0] == "license" else count for key, count in journal_statistics.items()}
+            graph = round(self._estimate(scaled, "identifiers", "license", [license.lower() for license in licenses]))
+        first = "graph" if licenses and graph < sql else "sqlite"
+        return {"method": method, "first": first, "sqlite": int(sql), "graph": int(graph)}
+
+    def _graph_first(self, method, *args):
+        # the statistics are asked only when the graph can be asked first, the other queries start from the relational databases
+        if not self.planner or not self.categoryQuery or not self.journalQuery or not _cross_queries[method][1] or not args[-1]:
+            return False
+        return self._plan(method, args, *self._statistics())["first"] == "graph"
+
+    def _explain(self, plan):
+        sql_filter, graph_filter = _cross_queries[plan["method"]]
+        both = min(plan["sqlite"], plan["graph"])
+        if plan["first"] == "graph":
+            steps = [("graph", graph_filter, plan["graph"]),
+                     ("sqlite", sql_filter + ", among the identifiers of these journals", both)]
+        else:
+            lookup = "journals with these identifiers" + (" and the licenses" if graph_filter else "")
+            steps = [("sqlite", sql_filter, plan["sqlite"]), ("graph", lookup, both)]
+        steps.append(("engine", "join on the identifiers" + (", diamond journals only" if plan["method"].startswith("getDiamond") else ""), both))
+        return pd.DataFrame([[step, side, operation, rows] for step, (side, operation, rows) in enumerate(steps, 1)],
+                            columns=["step", "database", "operation", "estimated_identifiers"])
 
-                # Converti le stringhe delle liste nella colonna 'identifier' in vere liste
-                all_journals_df['identifiers'] = all_journals_df['identifiers'].apply(safe_string_to_list)
-                # Esplodi la colonna 'identifier' per avere un identifier per riga
-                all_journals_exploded_df = all_journals_df.explode('identifiers')
+    def explain(self, method: str, *args):
+        """
+        returns the plan of a cross query called with args, one row for each step in the order they run,
+        with the database asked and the identifiers it is expected to return according to the statistics
+        of the handlers
+        """
+        if method not in _cross_queries:
+            print(f"No plan for {method}, use one of {', '.join(_cross_queries)}")
+            return pd.DataFrame()
+        plan = self._plan(method, args, *self._statistics())
+        if not self.planner:
+            plan["first"] = "sqlite"
+        return self._explain(plan)
+
+    def _graph_identifiers(self, journal_dfs):
+        # all the identifiers of the journals returned by the graph, once
+        return list(dict.fromkeys(identifier for df in journal_dfs if not df.empty
+                                  for identifiers in df["identifiers"] for identifier in _safe_string_to_list(identifiers)))
+
+    def _json_values(self, column, values, params):
+        # a set of values as a single JSON parameter, the query has the same size for any number of values;
+        # without json_each one variable for each value
+        if not _sqlite_json:
+            params.extend(values)
+            return f"{column} IN ({', '.join('?' for _ in values)})"
+        params.append(json.dumps(list(values)))
+        return f"{column} IN (SELECT value FROM json_each(?))"
+
+    def _identifiers_query(self, area=None, category_id=None, category_quartile=None, identifiers=None):
+        """
+        the identifiers of the journals in one of the areas and in one of the categories with one of the
+        quartiles: each set is an independent predicate instead of all their combinations, an empty set
+        is no filter on its values (the journal still needs an area or a category) and None leaves the
+        areas or the categories out; identifiers keeps only the ones found first by the graph
+        """
+        conditions = []
+        params = []
+        if category_id is not None or category_quartile is not None:
+            filters = [self._json_values(column, values, params)
+                       for column, values in (("c.category_id", category_id), ("c.category_quartile", category_quartile)) if values]
+            conditions.append(f"""i.journal_id IN (
+                SELECT jc.journal_id
+                FROM journal_category jc
+                JOIN category c ON c.category_pk = jc.category_pk
+                {"WHERE " + " AND ".join(filters) if filters else ""})""")
+        if area is not None:
+            area_filter = "WHERE " + self._json_values("a.area", area, params) if area else ""
+            conditions.append(f"""i.journal_id IN (
+                SELECT ja.journal_id
+                FROM journal_area ja
+                JOIN area a ON a.area_pk = ja.area_pk
+                {area_filter})""")
+        if identifiers is not None:
+            # TEMP tables cannot be created on the query_only connections
+            conditions.append(self._json_values("i.identifier", identifiers, params))
+        query = f"""
+            SELECT i.identifier AS identifiers
+            FROM identifier i
+            WHERE {" AND ".join(conditions)};
+        """
+        return query, params
+
+    def _identifiers_queries(self, area=None, category_id=None, category_quartile=None, identifiers=None):
+        # _identifiers_query for all the identifiers at once, or for batches of them when each one is a variable
+        if _sqlite_json or identifiers is None:
+            return [self._identifiers_query(area, category_id, category_quartile, identifiers)]
+        identifiers = list(identifiers)
+        size = max(1, SQLITE_VARIABLES_BATCH - sum(len(values or ()) for values in (area, category_id, category_quartile)))
+        return [self._identifiers_query(area, category_id, category_quartile, identifiers[start:start + size])
+                for start in range(0, len(identifiers), size)]
+
+    def _category_identifiers(self, area=None, category_id=None, category_quartile=None, identifiers=None):
+        # the identifiers of _identifiers_query from the category snapshot if it is loaded, otherwise from all the relational databases
+        return self._merge(self._category_queries(self._identifiers_queries(area, category_id, category_quartile, identifiers)))
+
+    def _has_journals(self):
+        return self.journalSnapshot is not None or len(self.journalQuery) > 0
+
+    def _journal_dfs_of_identifiers(self, identifiers, licenses=None):
+        # the journals having one of the identifiers, from the journal snapshot or from all the graphs
+        if self.journalSnapshot is not None:
+            return [self._journal_snapshot_of_identifiers(identifiers, licenses)]
+        return self._fan_out(self.journalQuery, "getJournalsWithIdentifiers", identifiers, licenses)
+
+    def _journals_of_identifiers(self, df, new_journal_dfs):
+        """
+        joins the identifiers found by the relational databases with the journals returned by the graph,
+        one row for each journal with only the identifiers found in both
+        """
+        all_journal_dfs = [new_journal_df for new_journal_df in new_journal_dfs if not new_journal_df.empty]
+        if not all_journal_dfs:
+            return pd.DataFrame()
+        all_journals_df = pd.concat(all_journal_dfs, ignore_index=True)
 
-                # Estrai l'identifier stringa (gestendo anche il caso in cui non sia una tupla)
-                all_journals_exploded_df['merged_identifier'] = all_journals_exploded_df['identifiers'].apply(lambda x: x[0] if isinstance(x, tuple) else x)
+        # Converti le stringhe delle liste nella colonna 'identifier' in vere liste
+        all_journals_df['identifiers'] = all_journals_df['identifiers'].apply(_safe_string_to_list)
+        # Esplodi la colonna 'identifier' per avere un identifier per riga
+        all_journals_exploded_df = all_journals_df.explode('identifiers')
 
-                # Assicurati che 'merged_identifier' sia di tipo stringa
-                all_journals_exploded_df['merged_identifier'] = all_journals_exploded_df['merged_identifier'].astype(str)
+        # Estrai l'identifier stringa (gestendo anche il caso in cui non sia una tupla)
+        all_journals_exploded_df['merged_identifier'] = all_journals_exploded_df['identifiers'].apply(lambda x: x[0] if isinstance(x, tuple) else x)
 
-                # Unisci i due DataFrames
-                merged_df = pd.merge(df, all_journals_exploded_df, left_on='identifiers', right_on='merged_identifier', how='inner')
-                # print(merged_df.info())
-                # Rimuovi le colonne ausiliarie e rinomina
-                merged_df = merged_df.drop(columns=['merged_identifier', 'identifiers_y'])
-                merged_df = merged_df.rename(columns={'identifiers_x': 'identifiers'})
+        # Assicurati che 'merged_identifier' sia di tipo stringa
+        all_journals_exploded_df['merged_identifier'] = all_journals_exploded_df['merged_identifier'].astype(str)
 
-                # Rimuovi i duplicati basandosi sulla colonna 'identifier'
-                final_df = merged_df.drop_duplicates(subset='identifiers')
-                df_agg = final_df.groupby('journal')['identifiers'].apply(list).reset_index()
+        # Unisci i due DataFrames
+        merged_df = pd.merge(df, all_journals_exploded_df, left_on='identifiers', right_on='merged_identifier', how='inner')
+        # Rimuovi le colonne ausiliarie e rinomina
+        merged_df = merged_df.drop(columns=['merged_identifier', 'identifiers_y'])
+        merged_df = merged_df.rename(columns={'identifiers_x': 'identifiers'})
 
-                # Unisci il DataFrame aggregato con le altre colonne del DataFrame originale (prendendo la prima occorrenza per le altre colonne)
-                df_merged = pd.merge(df_agg, final_df.drop(columns=['identifiers']).groupby('journal').first().reset_index(), on='journal', how='left')
+        # Rimuovi i duplicati basandosi sulla colonna 'identifier'
+        final_df = merged_df.drop_duplicates(subset='identifiers')
+        df_agg = final_df.groupby('journal')['identifiers'].apply(list).reset_index()
 
+        # Unisci il DataFrame aggregato con le altre colonne del DataFrame originale (prendendo la prima occorrenza per le altre colonne)
+        return pd.merge(df_agg, final_df.drop(columns=['identifiers']).groupby('journal').first().reset_index(), on='journal', how='left')
 
-                return self.createJournalObject(df_merged)
+    def _diamond(self, df):
+        if df.empty:
+            return df
+        return df[df['apc'].isin(['No', False])]
+
+    def getJournalsInCategoriesWithQuartile(self, category_id=Set[str], category_quartile=Set[str]) -> List[Journal]:
+        # the identifiers found by all the relational databases
+        df = self._category_identifiers(category_id=category_id, category_quartile=category_quartile)
+        if df.empty:
+            return []
+        df = df.drop_duplicates(subset="identifiers", keep='first', inplace=False) # HERE I GET THE DF WITH IDENTIFIERS OF INTEREST
+            
+        if self._has_journals():
+            # only the journals with the identifiers found in the relational database are asked to the graph
+            new_journal_dfs = self._journal_dfs_of_identifiers(df['identifiers'].tolist())
+            return self.createJournalObject(self._journals_of_identifiers(df, new_journal_dfs))
+        return []
     
+    def _journals_in_areas_from_graph(self, area, license):
+        # the journals with the licenses first, then only their identifiers are looked up in the areas
+        journal_dfs = self._fan_out(self.journalQuery, "getJournalsWithLicense", license)
+        identifiers = self._graph_identifiers(journal_dfs)
+        if not identifiers:
+            return []
+        df = self._category_identifiers(area=area, identifiers=identifiers)
+        if df.empty:
+            return []
+        df = df.drop_duplicates(subset="identifiers", keep='first', inplace=False)
+        journal_df = self._journals_of_identifiers(df, journal_dfs)
+        if journal_df.empty:
+            return []
+        return self.createJournalObject(journal_df)
+
     def getJournalsInAreasWithLicense(self, area=Set[str], license=Set[str]) -> List[Journal]:
-        def safe_string_to_list(s):
-            if isinstance(s, str):
-                s = s.strip()
-                if s.startswith('[') and s.endswith(']'):
-                    s = s[1:-1]
-                    items = re.split(r',\s*(?=[^\]"]*(?:\"[^\]\"]*\"[^\]"]*)*[^\]"]*$)', s)
-                    items = [item.strip().strip('"').strip("'") for item in items]
-                    return items
-                else:
-                    return [s]
-            return s
-        
-        if len(area) == 0:
-            for handler in self.categoryQuery:
-                area_df = handler.getAllAreas()
-            area = area_df['area'].unique().tolist()
-        
-        # get journals with at least of of the areas in input
-        for handler in self.categoryQuery:
-            with connect(handler.dbPathOrUrl) as con:
-                placeholders = ', '.join(['?'] * len(area))
-                query = f"""
-                    SELECT identifiers
-                    FROM info
-                    WHERE area IN ({placeholders});
-                """
-                params = list(area)
-                df = pd.read_sql_query(query, con, params=params)
+        # a rare license is cheaper to start from than the areas
+        if self._graph_first("getJournalsInAreasWithLicense", area, license):
+            return self._journals_in_areas_from_graph(area, license)
+
+        # the identifiers found by all the relational databases
+        df = self._category_identifiers(area=area)
+        if df.empty:
+            return []
 
         journal_with_area_df = df.drop_duplicates(subset="identifiers", keep='first', inplace=False) # HERE I GET THE DF WITH IDENTIFIERS OF INTEREST
             
         # get journals with licenses
-        if len(self.journalQuery) > 0:
-            journal_with_licenses_dfs = []
-            for handler in self.journalQuery:
-                # print(len(license))
-                new_journal_with_licenses_df = handler.getJournalsWithLicense(license)
-                if new_journal_with_licenses_df.empty:
-                    # print('trovato df vuoto')
-                    new_journal_with_licenses_df = handler.getAllJournals()
-                journal_with_licenses_dfs.append(new_journal_with_licenses_df)
-            if journal_with_licenses_dfs:
-                journal_with_licenses_df = pd.concat(journal_with_licenses_dfs, ignore_index=True)
-                # print(journal_with_licenses_df.info())
-                # Converti le stringhe delle liste nella colonna 'identifier' in vere liste
-                journal_with_licenses_df['identifiers'] = journal_with_licenses_df['identifiers'].apply(safe_string_to_list)
+        if self._has_journals():
+            # both the identifiers and the licenses are filtered by the graph, an empty set of licenses means any license
+            new_journal_with_licenses_dfs = self._journal_dfs_of_identifiers(journal_with_area_df['identifiers'].tolist(), license)
+            return self.createJournalObject(self._journals_of_identifiers(journal_with_area_df, new_journal_with_licenses_dfs))
+        return []
+
+    
+    def getDiamondJournalsInAreasAndCategoriesWithQuartile(self, area=Set[str], category_id=Set[str], category_quartile=Set[str]) -> List[Journal]:
+        # the identifiers found by all the relational databases
+        df = self._category_identifiers(area, category_id, category_quartile)
+        if df.empty:
+            return []
+        df = df.drop_duplicates(subset="identifiers", keep='first', inplace=False) # HERE I GET THE DF WITH IDENTIFIERS OF INTEREST
+        
+        if self._has_journals():
+            # only the journals with the identifiers found in the relational database are asked to the graph
+            new_journal_dfs = self._journal_dfs_of_identifiers(df['identifiers'].tolist())
+            return self.createJournalObject(self._diamond(self._journals_of_identifiers(df, new_journal_dfs)))
+        return []
 
+# ------------------------------------------------------------------------------------------------------
+# Asynchronous query API
 
-                # Esplodi la colonna 'identifier' per avere un identifier per riga
-                journal_with_licenses_df_exploded = journal_with_licenses_df.explode('identifiers')
+async def _in_thread(function, *args):
+    # the blocking calls run in the threads of the engines, where the handlers keep their connections
+    return await asyncio.get_running_loop().run_in_executor(_get_handler_executor(), functools.partial(function, *args))
 
-                # Estrai l'identifier stringa (gestendo anche il caso in cui non sia una tupla)
-                journal_with_licenses_df_exploded['merged_identifier'] = journal_with_licenses_df_exploded['identifiers'].apply(lambda x: x[0] if isinstance(x, tuple) else x)
 
-                # Assicurati che 'merged_identifier' sia di tipo stringa
-                journal_with_licenses_df_exploded['merged_identifier'] = journal_with_licenses_df_exploded['merged_identifier'].astype(str)
+class AsyncCategoryQueryHandler(CategoryQueryHandler):
+    """
+    the queries of CategoryQueryHandler as coroutines, sqlite3 has no asynchronous interface so each
+    query runs in a thread with the read connection of that thread; the thread runs the query without
+    its @cached wrapper, so each result is counted and kept in the cache only once
+    """
 
-                # Unisci i due DataFrames
-                merged_df = pd.merge(journal_with_area_df, journal_with_licenses_df_exploded, left_on='identifiers', right_on='merged_identifier', how='inner')
+    @cached
+    async def getById(self, id: str):
+        return await _in_thread(CategoryQueryHandler.getById.__wrapped__, self, id)
 
-                # Rimuovi le colonne ausiliarie e rinomina
-                merged_df = merged_df.drop(columns=['merged_identifier', 'identifiers_y'])
-                merged_df = merged_df.rename(columns={'identifiers_x': 'identifiers'})
+    @cached
+    async def getAllCategories(self):
+        return await _in_thread(CategoryQueryHandler.getAllCategories.__wrapped__, self)
 
-                # Rimuovi i duplicati basandosi sulla colonna 'identifier'
-                final_df = merged_df.drop_duplicates(subset='identifiers')
-                df_agg = final_df.groupby('journal')['identifiers'].apply(list).reset_index()
+    @cached
+    async def getAllAreas(self):
+        return await _in_thread(CategoryQueryHandler.getAllAreas.__wrapped__, self)
 
-                # Unisci il DataFrame aggregato con le altre colonne del DataFrame originale (prendendo la prima occorrenza per le altre colonne)
-                df_merged = pd.merge(df_agg, final_df.drop(columns=['identifiers']).groupby('journal').first().reset_index(), on='journal', how='left')
+    @cached
+    async def getCategoriesWithQuartile(self, quartiles=Set[str]):
+        return await _in_thread(CategoryQueryHandler.getCategoriesWithQuartile.__wrapped__, self, quartiles)
 
+    @cached
+    async def getCategoriesAssignedToAreas(self, areas=Set[str]):
+        return await _in_thread(CategoryQueryHandler.getCategoriesAssignedToAreas.__wrapped__, self, areas)
 
-                return self.createJournalObject(df_merged)
+    @cached
+    async def getAreasAssignedToCategories(self, categories=Set[str]):
+        return await _in_thread(CategoryQueryHandler.getAreasAssignedToCategories.__wrapped__, self, categories)
 
-    
-    def getDiamondJournalsInAreasAndCategoriesWithQuartile(self, area=Set[str], category_id=Set[str], category_quartile=Set[str]) -> List[Journal]:
-        def safe_string_to_list(s):
-            if isinstance(s, str):
-                s = s.strip()
-                if s.startswith('[') and s.endswith(']'):
-                    s = s[1:-1]
-                    items = re.split(r',\s*(?=[^\]"]*(?:\"[^\]\"]*\"[^\]"]*)*[^\]"]*$)', s)
-                    items = [item.strip().strip('"').strip("'") for item in items]
-                    return items
-                else:
-                    return [s]
-            return s
-        if len(area) == 0:
-            for handler in self.categoryQuery:
-                area_df = handler.getAllAreas()
-            area = area_df['area'].unique().tolist()
-        if len(category_id) == 0:
-            for handler in self.categoryQuery:
-                cat_id_df = handler.getAllCategories()
-            category_id = cat_id_df['category_id'].unique().tolist()
-        if len(category_quartile) == 0:
-            for handler in self.categoryQuery:
-                cat_id_df = handler.getAllCategories()
-            category_quartile = cat_id_df['category_quartile'].unique().tolist()
-        
-        attribute_combination_list = []
-        for cat in category_id:
-            for quart in category_quartile:
-                for ar in area:
-                    attribute_combination_list.append((cat, quart, ar))
-
-        for handler in self.categoryQuery:
-            with connect(handler.dbPathOrUrl) as con:
-                placeholders = ', '.join(['(?, ?, ?)'] * len(attribute_combination_list))
-                query = f"""
-                    SELECT identifiers
-                    FROM info
-                    WHERE (category_id, category_quartile, area) IN ({placeholders});
-                """
-                params = [item for pair in attribute_combination_list for item in pair]
-                df = pd.read_sql_query(query, con, params=params)
-        df = df.drop_duplicates(subset="identifiers", keep='first', inplace=False) # HERE I GET THE DF WITH IDENTIFIERS OF INTEREST
-        
-        if len(self.journalQuery) > 0:
-            all_journal_dfs = []
-            for handler in self.journalQuery:
-                new_journal_df = handler.getAllJournals()
-                all_journal_dfs.append(new_journal_df) # HERE I GET THE DF WITH ALL JOURNALS 
-            # print(all_journal_dfs)   
-            if all_journal_dfs:
-                all_journals_df = pd.concat(all_journal_dfs, ignore_index=True)
+    @cached
+    async def getCategoriesPage(self, size: int, after: str = None):
+        return await _in_thread(CategoryQueryHandler.getCategoriesPage.__wrapped__, self, size, after)
+
+    @cached
+    async def getStatistics(self):
+        return await _in_thread(CategoryQueryHandler.getStatistics.__wrapped__, self)
+
+
+class AsyncJournalQueryHandler(JournalQueryHandler):
+    """
+    the queries of JournalQueryHandler as coroutines, the requests to the endpoint share an httpx.AsyncClient
+    so the connections are kept alive between the queries; the local graphs (and the endpoints, when httpx
+    is not installed) are queried in a thread. The client is released by aclose(), or by using the handler
+    as "async with AsyncJournalQueryHandler() as handler:" inside the event loop of its queries
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._client = None
+        self._client_loop = None
+
+    def _get_client(self):
+        # a client belongs to the event loop that created it, asyncio.run starts a new one every time
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            limits = httpx.Limits(max_connections=self.maxConnections, max_keepalive_connections=self.maxConnections)
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        """
+        closes the connections to the endpoint, they are opened again by the next query
+        """
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
+        return True
 
-                # Converti le stringhe delle liste nella colonna 'identifier' in vere liste
-                all_journals_df['identifiers'] = all_journals_df['identifiers'].apply(safe_string_to_list)
+    async def __aenter__(self):
+        return self
 
-                # Esplodi la colonna 'identifier' per avere un identifier per riga
-                all_journals_exploded_df = all_journals_df.explode('identifiers')
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
 
-                # Estrai l'identifier stringa (gestendo anche il caso in cui non sia una tupla)
-                all_journals_exploded_df['merged_identifier'] = all_journals_exploded_df['identifiers'].apply(lambda x: x[0] if isinstance(x, tuple) else x)
+    async def execute_sparql_query(self, query):
+        if not _is_endpoint(self.dbPathOrUrl) or httpx is None:
+            if httpx is None:
+                _warn_without_httpx("the asynchronous SPARQL queries run in threads")
+            return await _in_thread(super().execute_sparql_query, query)
+        try:
+            client = self._get_client()
+            result = self._response_result(await client.post(self.dbPathOrUrl, **self._request(query)))
+        except Exception as e:
+            print("SPARQL Error:", e)
+            return pd.DataFrame()
+        return self._decode_results(result)
+
+    @cached
+    async def getById(self, identifier, substring=False):
+        if substring:
+            return await self.execute_sparql_query(self._by_id_substring_query(identifier))
+        return await self.execute_sparql_query(self._by_id_query(identifier))
 
-                # Assicurati che 'merged_identifier' sia di tipo stringa
-                all_journals_exploded_df['merged_identifier'] = all_journals_exploded_df['merged_identifier'].astype(str)
+    async def getByIds(self, identifiers):
+        return await self.getJournalsWithIdentifiers(identifiers)
 
-                # Unisci i due DataFrames
-                merged_df = pd.merge(df, all_journals_exploded_df, left_on='identifiers', right_on='merged_identifier', how='inner')
+    @cached
+    async def getAllJournals(self):
+        return await self.execute_sparql_query(self._all_journals_query())
 
-                # Rimuovi le colonne ausiliarie e rinomina
-                merged_df = merged_df.drop(columns=['merged_identifier', 'identifiers_y'])
-                merged_df = merged_df.rename(columns={'identifiers_x': 'identifiers'})
+    @cached
+    async def getJournalsWithTitle(self, title: str):
+        return await self.execute_sparql_query(self._title_query(title))
 
-                # Rimuovi i duplicati basandosi sulla colonna 'identifier'
-                final_df = merged_df.drop_duplicates(subset='identifiers')
-                df_agg = final_df.groupby('journal')['identifiers'].apply(list).reset_index()
+    @cached
+    async def getJournalsPublishedBy(self, publisher: str):
+        return await self.execute_sparql_query(self._publisher_query(publisher))
 
-                # Unisci il DataFrame aggregato con le altre colonne del DataFrame originale (prendendo la prima occorrenza per le altre colonne)
-                df_merged = pd.merge(df_agg, final_df.drop(columns=['identifiers']).groupby('journal').first().reset_index(), on='journal', how='left')
+    @cached
+    async def getJournalsWithLicense(self, license_set: Set[str]):
+        return await self.execute_sparql_query(self._license_query(license_set))
 
-                df_filtered = df_merged[df_merged['apc'].isin(['No', False])]
+    @cached
+    async def getJournalsWithAPC(self):
+        return await self.execute_sparql_query(self._apc_query())
 
-                return self.createJournalObject(df_filtered) 
+    @cached
+    async def getJournalsWithDOAJSeal(self):
+        return await self.execute_sparql_query(self._seal_query())
 
+    @cached
+    async def getJournalsPage(self, size: int, after: str = None):
+        try:
+            local = _is_local_graph(self.dbPathOrUrl)
+        except ValueError as e:
+            print("SPARQL Error:", e)
+            return pd.DataFrame()
+        if local:
+            return await _in_thread(JournalQueryHandler.getJournalsPage.__wrapped__, self, size, after)
+        journals = await self.execute_sparql_query(self._page_query(size, after))
+        if journals.empty:
+            return journals
+        return self._sort_page(await self.execute_sparql_query(self._journals_query(journals["journal"].tolist())))
+
+    @cached
+    async def getJournalsWithIdentifiers(self, identifiers, licenses=None):
+        # the batches of identifiers are sent at the same time
+        queries = self._identifiers_queries(identifiers, licenses)
+        return self._concat_batches(await asyncio.gather(*(self.execute_sparql_query(query) for query in queries)))
+
+    @cached
+    async def getStatistics(self):
+        # asked once in a while by the engines to plan their queries, it does not need the asynchronous client
+        return await _in_thread(JournalQueryHandler.getStatistics.__wrapped__, self)
+
+
+class AsyncFullQueryEngine(FullQueryEngine):
+    """
+    the methods of FullQueryEngine as coroutines: all the handlers are asked at the same time, and the
+    relational and graph queries that do not depend on each other run together; the handlers can be
+    the asynchronous ones or the usual ones, which are then called in a thread. Used as
+    "async with AsyncFullQueryEngine() as engine:", the connections of all its handlers are closed at the end
+    """
+
+    async def aclose(self):
+        """
+        closes the connections of all the handlers, they are opened again by the next query
+        """
+        for handler in self.journalQuery + self.categoryQuery:
+            if hasattr(handler, "close"):
+                handler.close()
+            if hasattr(handler, "aclose"):
+                await handler.aclose()
+        return True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _call(self, handler, method, *args):
+        function = getattr(handler, method)
+        if inspect.iscoroutinefunction(function):
+            return await function(*args)
+        return await _in_thread(function, *args)
+
+    async def _fan_out(self, handlers, method, *args):
+        if not handlers:
+            return []
+        executor = _get_handler_executor()
+        answers = await asyncio.gather(*(asyncio.wait_for(self._call(handler, method, *args), self.handlerTimeout)
+                                         for handler in handlers), return_exceptions=True)
+        results = []
+        for handler, answer in zip(handlers, answers):
+            if isinstance(answer, asyncio.TimeoutError):
+                print(f"{method} on {handler.getDbPathOrUrl()} did not answer within {self.handlerTimeout} seconds")
+            elif isinstance(answer, Exception):
+                print(f"{method} on {handler.getDbPathOrUrl()} failed: {answer}")
+            else:
+                results.append(answer)
+        if any(isinstance(answer, asyncio.TimeoutError) for answer in answers):
+            # the calls that run in a thread are still there after the timeout
+            _retire_handler_executor(executor)
+        return results
+
+    async def _journals(self, method, *args):
+        return self._merge(await self._fan_out(self.journalQuery, method, *args), subset="journal")
+
+    async def _categories(self, method, *args):
+        return self._merge(await self._fan_out(self.categoryQuery, method, *args))
+
+    async def _category_df(self, method, *args):
+        if self.categorySnapshot is not None:
+            return getattr(self._snapshotCategoryHandler, method)(*args)
+        return await self._categories(method, *args)
+
+    async def _category_identifiers(self, area=None, category_id=None, category_quartile=None, identifiers=None):
+        if self.categorySnapshot is not None:
+            return super()._category_identifiers(area, category_id, category_quartile, identifiers)
+        answers = await asyncio.gather(*(self._fan_out(self.categoryQuery, "_execute_query", query, params)
+                                         for query, params in self._identifiers_queries(area, category_id, category_quartile, identifiers)))
+        return self._merge([df for dfs in answers for df in dfs])
+
+    async def _journal_dfs_of_identifiers(self, identifiers, licenses=None):
+        if self.journalSnapshot is not None:
+            return [self._journal_snapshot_of_identifiers(identifiers, licenses)]
+        return await self._fan_out(self.journalQuery, "getJournalsWithIdentifiers", identifiers, licenses)
+
+    async def _identifier_links(self, all_identifiers):
+        if self.categorySnapshot is not None or not self.categoryQuery or not all_identifiers:
+            return super()._identifier_links(all_identifiers)
+        answers = await asyncio.gather(*(self._fan_out(self.categoryQuery, "_execute_query", query, params)
+                                         for query, params in self._links_queries(all_identifiers)))
+        return self._links([df for dfs in answers for df in dfs])
+
+    async def getCategoryQuartile_mapped(self, all_identifiers):
+        return (await self._identifier_links(all_identifiers))[1]
+
+    async def gethasArea_mapped(self, all_identifiers):
+        return (await self._identifier_links(all_identifiers))[0]
+
+    async def createJournalObject(self, input_dataframe):
+        if input_dataframe.empty:
+            return []
+        identifiers = self._journal_identifiers(input_dataframe)
+        all_journal_identifiers = list({i for ids in identifiers for i in ids})
+        identifier_to_areas, identifier_to_categories = await self._identifier_links(all_journal_identifiers)
+        return self._build_journals(input_dataframe, identifiers, identifier_to_areas, identifier_to_categories)
+
+    async def getEntityById(self, input_identifier: str) -> IdentifiableEntity:
+        journal_df, cat_area_df = await asyncio.gather(self._journals("getById", input_identifier),
+                                                       self._category_df("getById", input_identifier))
+        if journal_df.empty and cat_area_df.empty:
+            return None
+        if cat_area_df.empty:
+            return Journal
+        if journal_df.empty:
+            return Category if len(cat_area_df.columns) == 2 else Area
+
+    async def _journal_df(self, method, *args):
+        if self.journalSnapshot is not None:
+            return self._journal_snapshot_df(self._snapshot_mask(method, *args))
+        return await self._journals(method, *args)
+
+    async def getAllJournals(self) -> List[Journal]:
+        return await self.createJournalObject(await self._journal_df("getAllJournals"))
+
+    async def getJournalsWithTitle(self, partialTitle: str) -> List[Journal]:
+        return await self.createJournalObject(await self._journal_df("getJournalsWithTitle", partialTitle))
+
+    async def getJournalsPublishedBy(self, partialName: str) -> List[Journal]:
+        return await self.createJournalObject(await self._journal_df("getJournalsPublishedBy", partialName))
+
+    async def getJournalsWithLicense(self, licenses: Set[str]) -> List[Journal]:
+        return await self.createJournalObject(await self._journal_df("getJournalsWithLicense", licenses))
+
+    async def getJournalsWithAPC(self) -> List[Journal]:
+        return await self.createJournalObject(await self._journal_df("getJournalsWithAPC"))
+
+    async def getJournalsWithDOAJSeal(self) -> List[Journal]:
+        return await self.createJournalObject(await self._journal_df("getJournalsWithDOAJSeal"))
+
+    async def getAllCategories(self) -> List[Category]:
+        return self.createCategoryObject(await self._category_df("getAllCategories"))
+
+    async def getAllAreas(self) -> List[Area]:
+        return self.createAreaObject(await self._category_df("getAllAreas"))
+
+    async def getCategoriesWithQuartile(self, quartiles=None) -> List[Category]:
+        return self.createCategoryObject(await self._category_df("getCategoriesWithQuartile", quartiles))
+
+    async def getCategoriesAssignedToAreas(self, area_ids=None) -> List[Category]:
+        return self.createCategoryObject(await self._category_df("getCategoriesAssignedToAreas", area_ids))
+
+    async def getAreasAssignedToCategories(self, category_ids=None) -> List[Area]:
+        return self.createAreaObject(await self._category_df("getAreasAssignedToCategories", category_ids))
+
+    async def getJournalsPage(self, size: int, after: str = None):
+        if self.journalSnapshot is not None:
+            df = self._journal_snapshot_page(size, after)
+        else:
+            df = self._first_keys(await self._journals("getJournalsPage", size, after), "journal", size)
+        if df.empty:
+            return [], None
+        return await self.createJournalObject(df), self._next_after(df, "journal", size)
+
+    async def getCategoriesPage(self, size: int, after: str = None):
+        df = self._first_keys(await self._category_df("getCategoriesPage", size, after), "category_id", size)
+        if df.empty:
+            return [], None
+        return self.createCategoryObject(df), self._next_after(df, "category_id", size)
+
+    async def iterJournals(self, pageSize: int = 1000):
+        journals, after = await self.getJournalsPage(pageSize)
+        for journal in journals:
+            yield journal
+        while after is not None:
+            journals, after = await self.getJournalsPage(pageSize, after)
+            for journal in journals:
+                yield journal
+
+    async def iterCategories(self, pageSize: int = 1000):
+        categories, after = await self.getCategoriesPage(pageSize)
+        for category in categories:
+            yield category
+        while after is not None:
+            categories, after = await self.getCategoriesPage(pageSize, after)
+            for category in categories:
+                yield category
+
+    async def _journals_with_identifiers(self, df, *args, diamond=False):
+        """
+        asks the graph for the journals of the identifiers found by the relational databases, and at the same
+        time the relational databases for their categories and areas: the identifiers of the returned journals
+        are only the ones in df, so their categories and areas are already among these
+        """
+        df = df.drop_duplicates(subset="identifiers", keep='first', inplace=False)
+        identifiers = df['identifiers'].tolist()
+        new_journal_dfs, (identifier_to_areas, identifier_to_categories) = await asyncio.gather(
+            self._journal_dfs_of_identifiers(identifiers, *args),
+            self._identifier_links(identifiers))
+        journal_df = self._journals_of_identifiers(df, new_journal_dfs)
+        if diamond:
+            journal_df = self._diamond(journal_df)
+        if journal_df.empty:
+            return []
+        return self._build_journals(journal_df, self._journal_identifiers(journal_df), identifier_to_areas, identifier_to_categories)
+
+    async def getJournalsInCategoriesWithQuartile(self, category_id=Set[str], category_quartile=Set[str]) -> List[Journal]:
+        df = await self._category_identifiers(category_id=category_id, category_quartile=category_quartile)
+        if df.empty or not self._has_journals():
+            return []
+        return await self._journals_with_identifiers(df)
+
+    async def _statistics(self):
+        key = self._statistics_key()
+        if self._plannerStatistics is not None and self._plannerStatistics[0] == key:
+            return self._plannerStatistics[1]
+        category_dfs, journal_dfs = await asyncio.gather(self._fan_out(self.categoryQuery, "getStatistics"),
+                                                         self._fan_out(self.journalQuery, "getStatistics"))
+        return self._keep_statistics(key, category_dfs, journal_dfs)
+
+    async def _graph_first(self, method, *args):
+        if not self.planner or not self.categoryQuery or not self.journalQuery or not _cross_queries[method][1] or not args[-1]:
+            return False
+        return self._plan(method, args, *await self._statistics())["first"] == "graph"
+
+    async def explain(self, method: str, *args):
+        if method not in _cross_queries:
+            print(f"No plan for {method}, use one of {', '.join(_cross_queries)}")
+            return pd.DataFrame()
+        plan = self._plan(method, args, *await self._statistics())
+        if not self.planner:
+            plan["first"] = "sqlite"
+        return self._explain(plan)
+
+    async def _journals_in_areas_from_graph(self, area, license):
+        journal_dfs = await self._fan_out(self.journalQuery, "getJournalsWithLicense", license)
+        identifiers = self._graph_identifiers(journal_dfs)
+        if not identifiers:
+            return []
+        df = await self._category_identifiers(area=area, identifiers=identifiers)
+        if df.empty:
+            return []
+        df = df.drop_duplicates(subset="identifiers", keep='first', inplace=False)
+        journal_df = self._journals_of_identifiers(df, journal_dfs)
+        if journal_df.empty:
+            return []
+        return await self.createJournalObject(journal_df)
+
+    async def getJournalsInAreasWithLicense(self, area=Set[str], license=Set[str]) -> List[Journal]:
+        if await self._graph_first("getJournalsInAreasWithLicense", area, license):
+            return await self._journals_in_areas_from_graph(area, license)
+        df = await self._category_identifiers(area=area)
+        if df.empty or not self._has_journals():
+            return []
+        return await self._journals_with_identifiers(df, license)
+
+    async def getDiamondJournalsInAreasAndCategoriesWithQuartile(self, area=Set[str], category_id=Set[str], category_quartile=Set[str]) -> List[Journal]:
+        df = await self._category_identifiers(area, category_id, category_quartile)
+        if df.empty or not self._has_journals():
+            return []
+        return await self._journals_with_identifiers(df, diamond=True)
@@ -13,12 +13,27 @@
 # ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
 # SOFTWARE.
 import unittest
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from os import sep
-from pandas import DataFrame
+from unittest import mock
+from pandas import DataFrame, read_csv
+import impl
 from impl import JournalUploadHandler, CategoryUploadHandler
 from impl import JournalQueryHandler, CategoryQueryHandler
 from impl import FullQueryEngine
+from impl import AsyncJournalQueryHandler, AsyncCategoryQueryHandler, AsyncFullQueryEngine
 from impl import Journal, Category, Area
+from impl import QueryCache
 
 # REMEMBER: before launching the tests, please run the Blazegraph instance!
 
@@ -200,3 +215,1314 @@ class TestProjectBasic(unittest.TestCase):
             self.assertIsInstance(i, Journal) 
         # print('2_finito_')
 
+
+
+# A local stand-in for the SPARQL endpoint, so that the upload can be tested without Blazegraph.
+# It records every update it receives and can be told to fail some of them.
+
+class StubSparqlEndpoint(object):
+
+    def __init__(self):
+        self.updates = [] # body of every update received, including the failed ones
+        self.failures = set() # numbers (starting from 1) of the requests that must fail
+        self.vars = [] # variables and results of every query
+        self.bindings = []
+        self.connections = 0 # connections opened by the clients
+        self.keepUpdates = True # False to count the updates without keeping their body
+        endpoint = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # the connections are kept open between the requests
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                endpoint.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                body = json.dumps({"head": {"vars": endpoint.vars}, "results": {"bindings": endpoint.bindings}}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/sparql-results+json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                if body.startswith("query="):
+                    # a query sent with POST, answered like the GET ones
+                    return self.do_GET()
+                endpoint.updates.append(body if endpoint.keepUpdates else "")
+                status = 500 if len(endpoint.updates) in endpoint.failures else 200
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+        self.url = "http://127.0.0.1:%d/sparql" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestJournalBatchUpload(unittest.TestCase):
+    journal = "test_data" + sep + "doaj.csv"
+
+    def test_batches_are_sent_as_insert_data(self):
+        with StubSparqlEndpoint() as endpoint:
+            u = JournalUploadHandler()
+            u.setDbPathOrUrl(endpoint.url)
+            self.assertTrue(u.setBatchSize(1000))
+            self.assertTrue(u.pushDataToDb(self.journal))
+
+            timings = u.getBatchTimings()
+            self.assertEqual(len(endpoint.updates), len(timings))
+            self.assertTrue(all(t["triples"] <= 1000 for t in timings))
+            self.assertTrue(all(update.startswith("INSERT DATA") for update in endpoint.updates))
+            sent = sum(update.count(" .\n") for update in endpoint.updates)
+            self.assertEqual(sent, sum(t["triples"] for t in timings))
+
+    def test_failed_batch_is_retried_alone(self):
+        with StubSparqlEndpoint() as endpoint:
+            endpoint.failures = {2}
+            u = JournalUploadHandler()
+            u.setDbPathOrUrl(endpoint.url)
+            u.setBatchSize(1000)
+            u.retryDelay = 0
+            self.assertTrue(u.pushDataToDb(self.journal))
+
+            timings = u.getBatchTimings()
+            self.assertEqual(timings[1]["attempts"], 2)
+            self.assertEqual(len(endpoint.updates), len(timings) + 1)
+            # the retry contains exactly the failed batch, not the batches already sent
+            self.assertEqual(endpoint.updates[1], endpoint.updates[2])
+            self.assertNotEqual(endpoint.updates[0], endpoint.updates[2])
+
+    def test_upload_stops_when_a_batch_keeps_failing(self):
+        with StubSparqlEndpoint() as endpoint:
+            endpoint.failures = {2, 3}
+            u = JournalUploadHandler()
+            u.setDbPathOrUrl(endpoint.url)
+            u.setBatchSize(1000)
+            u.maxRetries = 2
+            u.retryDelay = 0
+            self.assertFalse(u.pushDataToDb(self.journal))
+            self.assertEqual(len(u.getBatchTimings()), 1)
+            self.assertEqual(len(endpoint.updates), 3)
+
+    def test_upload_memory_does_not_grow_with_the_file(self):
+        columns = ["Journal title", "Journal ISSN (print version)", "Journal EISSN (online version)",
+                   "Languages in which the journal accepts manuscripts", "Publisher", "DOAJ Seal", "Journal license", "APC"]
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        path = os.path.join(folder.name, "doaj.csv")
+
+        def peak(size):
+            DataFrame([["Journal %d" % i, "%04d-%04d" % (i // 10000, i % 10000), "", "English, Spanish",
+                        "Publisher %d" % (i % 100), "No", "CC BY", "Yes"] for i in range(size)], columns=columns).to_csv(path, index=False)
+            with StubSparqlEndpoint() as endpoint:
+                endpoint.keepUpdates = False
+                u = JournalUploadHandler()
+                u.setDbPathOrUrl(endpoint.url)
+                u.setBatchSize(1000)
+                tracemalloc.start()
+                self.assertTrue(u.pushDataToDb(path))
+                result = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.assertEqual(u.getLastDelta()["inserted"], size)
+            return result
+
+        small, large = peak(5000), peak(20000)
+        self.assertLess(large, small * 1.5)
+
+
+
+class TestJournalDeltaUpload(unittest.TestCase):
+    journal = "test_data" + sep + "doaj.csv"
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.graph = "memory://" + self.id()
+        # the same export with a title changed, a journal removed and a new one
+        with open(self.journal, encoding="utf-8") as f:
+            lines = f.read().splitlines(keepends=True)
+        self.changed = os.path.join(self.folder.name, "doaj.csv")
+        with open(self.changed, "w", encoding="utf-8") as f:
+            f.write(lines[0])
+            f.write(lines[1].replace("Prolíngua", "Prolíngua (new title)"))
+            f.writelines(lines[3:])
+            if not lines[-1].endswith("\n"):
+                f.write("\n")
+            f.write("A New Journal,9999-0001,,English,Someone,No,CC BY,No\n")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def upload(self, path, dbPathOrUrl=None):
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl(dbPathOrUrl or self.graph)
+        u.setBatchSize(1000)
+        self.assertTrue(u.pushDataToDb(path))
+        return u
+
+    def test_only_changed_journals_are_sent(self):
+        u = self.upload(self.journal)
+        self.assertEqual(u.getLastDelta(), {"inserted": 855, "updated": 0, "deleted": 0, "unchanged": 0})
+
+        u = self.upload(self.journal)
+        self.assertEqual(u.getLastDelta(), {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 855})
+        self.assertEqual(u.getBatchTimings(), [])
+
+        u = self.upload(self.changed)
+        self.assertEqual(u.getLastDelta(), {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 853})
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl(self.graph)
+        self.assertEqual(len(q.getAllJournals()), 855)
+        self.assertEqual(q.getById("1983-9979")["title"].tolist(), ["Prolíngua (new title)"])
+        self.assertTrue(q.getById("2414-990X").empty)
+        self.assertEqual(len(q.getById("9999-0001")), 1)
+
+    def test_subjects_come_from_the_issn(self):
+        self.upload(self.journal)
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl(self.graph)
+        self.assertEqual(q.getById("2414-990X")["journal"].tolist(), ["https://comp-data.github.io/resjournal-2224-9281"])
+        self.assertEqual(q.getById("1983-9979")["journal"].tolist(), ["https://comp-data.github.io/resjournal-1983-9979"])
+
+    def test_remote_upload_sends_only_the_delta(self):
+        self.upload(self.journal)
+        graph = JournalQueryHandler()
+        graph.setDbPathOrUrl(self.graph)
+        hashes = graph._query_local_graph(
+            "SELECT ?journal ?hash WHERE { ?journal <https://comp-data.github.io/res/contentHash> ?hash }")
+
+        with StubSparqlEndpoint() as endpoint:
+            endpoint.bindings = hashes["results"]["bindings"]
+            u = self.upload(self.changed, endpoint.url)
+            self.assertEqual(u.getLastDelta(), {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 853})
+            self.assertEqual(len(endpoint.updates), 2)
+            self.assertTrue(endpoint.updates[0].startswith("DELETE"))
+            self.assertEqual(endpoint.updates[0].count("<https://comp-data.github.io/resjournal-"), 2)
+            self.assertTrue(endpoint.updates[1].startswith("INSERT DATA"))
+            self.assertIn("Prolíngua (new title)", endpoint.updates[1])
+            self.assertIn("A New Journal", endpoint.updates[1])
+            self.assertNotIn("2414-990X", endpoint.updates[1])
+
+# A small Scimago-like file written in a temporary folder, so that the relational
+# database can be tested without the full data.
+
+SCIMAGO_ITEMS = [
+    {"identifiers": ["1111-1111", "1111-2222"],
+     "categories": [{"id": "History", "quartile": "Q1"}, {"id": "Philosophy", "quartile": "Q2"}],
+     "areas": ["Arts and Humanities", "Social Sciences"]},
+    {"identifiers": ["2222-1111"],
+     "categories": [{"id": "History", "quartile": "Q1"}, {"id": "Sociology", "quartile": "Q3"}],
+     "areas": ["Social Sciences"]},
+    {"identifiers": ["3333-1111"],
+     "categories": [{"id": "Medicine", "quartile": "Q4"}],
+     "areas": ["Medicine"]}
+]
+
+
+class TestSparqlSession(unittest.TestCase):
+
+    def test_queries_reuse_the_connection(self):
+        with StubSparqlEndpoint() as endpoint:
+            endpoint.vars = ["journal", "title"]
+            endpoint.bindings = [{"journal": {"value": "https://comp-data.github.io/res/journal-1"},
+                                  "title": {"value": "A journal"}}]
+            q = JournalQueryHandler()
+            q.setDbPathOrUrl(endpoint.url)
+            q.cache = None
+            for _ in range(5):
+                self.assertEqual(q.getAllJournals()["title"][0], "A journal")
+            self.assertEqual(endpoint.connections, 1)
+
+            self.assertTrue(q.close())
+            self.assertEqual(len(q.getJournalsWithAPC()), 1)
+            self.assertEqual(endpoint.connections, 2)
+            q.close()
+
+    def test_unreachable_endpoint_returns_an_empty_dataframe(self):
+        with StubSparqlEndpoint() as endpoint:
+            url = endpoint.url
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl(url)
+        q.cache = None
+        self.assertTrue(q.getAllJournals().empty)
+
+    def test_missing_httpx_is_reported_once(self):
+        with StubSparqlEndpoint() as endpoint, mock.patch.object(impl, "httpx", None), \
+                mock.patch.object(impl, "_httpx_warnings", set()):
+            endpoint.vars = ["journal", "title"]
+            q = JournalQueryHandler()
+            q.setDbPathOrUrl(endpoint.url)
+            q.cache = None
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                q.getAllJournals()
+                q.getJournalsWithAPC()
+        self.assertEqual(output.getvalue().count("httpx is not installed"), 1)
+
+
+class TestSparqlResults(unittest.TestCase):
+    vars = ["journal", "title", "identifiers", "languages", "publisher"]
+
+    def expected(self, df):
+        self.assertEqual(list(df.columns), self.vars)
+        self.assertEqual(df["journal"].tolist(), ["https://comp-data.github.io/res/journal-1",
+                                                  "https://comp-data.github.io/res/journal-2"])
+        self.assertEqual(df["identifiers"].tolist(), [["1111-1111", "2222-2222"], ["3333-3333"]])
+        self.assertEqual(df["languages"].tolist(), [["English", "Italian"], ["French"]])
+        self.assertEqual(df["title"].tolist(), ["A journal", "Another\tjournal"])
+        self.assertEqual(df["publisher"].tolist(), ["A publisher", ""])
+
+    def test_bindings_are_grouped_by_journal(self):
+        rows = [("1", "A journal", "1111-1111", "English", "A publisher"),
+                ("1", "A journal", "2222-2222", "English", "A publisher"),
+                ("1", "A journal", "1111-1111", "Italian", "A publisher"),
+                ("2", "Another\tjournal", "3333-3333", "French", None)]
+        result = {"head": {"vars": self.vars}, "results": {"bindings": [
+            {var: {"value": "https://comp-data.github.io/res/journal-" + value if var == "journal" else value}
+             for var, value in zip(self.vars, row) if value is not None} for row in rows]}}
+        q = JournalQueryHandler()
+        self.expected(q._decode_results(result))
+        self.expected(q._decode_results(json.dumps(result).encode("utf-8")))
+        self.assertTrue(q._decode_results({"head": {"vars": self.vars}, "results": {"bindings": []}}).empty)
+
+    def test_journals_are_aggregated_by_the_endpoint(self):
+        local = JournalQueryHandler()
+        local.setDbPathOrUrl("memory://" + self.id())
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl(local.getDbPathOrUrl())
+        self.assertTrue(u.pushDataToDb("test_data" + sep + "doaj.csv"))
+
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl("http://127.0.0.1/sparql") # only the text of its queries is used
+        for query in ("_all_journals_query", "_apc_query"):
+            q.aggregate = False
+            rows = local._query_local_graph(getattr(q, query)())
+            q.aggregate = True
+            aggregated = local._query_local_graph(getattr(q, query)())
+            journals = {row["journal"]["value"] for row in rows["results"]["bindings"]}
+            self.assertEqual(len(aggregated["results"]["bindings"]), len(journals))
+            self.assertLess(len(aggregated["results"]["bindings"]), len(rows["results"]["bindings"]))
+
+            expected = q._decode_results(rows).sort_values("journal", ignore_index=True)
+            df = q._decode_results(aggregated).sort_values("journal", ignore_index=True)
+            self.assertEqual(list(df.columns), list(expected.columns))
+            for column in ("identifiers", "languages"):
+                df[column] = df[column].apply(sorted)
+                expected[column] = expected[column].apply(sorted)
+            self.assertTrue(df.equals(expected), query)
+
+    def test_csv_and_tsv_results(self):
+        q = JournalQueryHandler()
+        self.assertFalse(q.setResultFormat("xml"))
+        self.assertTrue(q.setResultFormat("csv"))
+        self.expected(q._decode_results(
+            "journal,title,identifiers,languages,publisher\r\n"
+            "https://comp-data.github.io/res/journal-1,A journal,1111-1111,English,A publisher\r\n"
+            "https://comp-data.github.io/res/journal-1,A journal,2222-2222,Italian,A publisher\r\n"
+            "https://comp-data.github.io/res/journal-2,\"Another\tjournal\",3333-3333,French,\r\n"))
+        self.assertTrue(q.setResultFormat("tsv"))
+        self.expected(q._decode_results(
+            "?journal\t?title\t?identifiers\t?languages\t?publisher\n"
+            "<https://comp-data.github.io/res/journal-1>\t\"A journal\"\t\"1111-1111\"\t\"English\"@en\t\"A publisher\"\n"
+            "<https://comp-data.github.io/res/journal-1>\t\"A journal\"\t\"2222-2222\"\t\"Italian\"\t\"A publisher\"\n"
+            "<https://comp-data.github.io/res/journal-2>\t\"Another\\tjournal\"\t\"3333-3333\"\t\"French\"\t\n"))
+
+
+class TestCategoryDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.category = os.path.join(self.folder.name, "scimago.json")
+        self.relational = os.path.join(self.folder.name, "relational.db")
+        with open(self.category, "w", encoding="utf-8") as f:
+            json.dump(SCIMAGO_ITEMS, f)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def count(self, table):
+        con = sqlite3.connect(self.relational)
+        try:
+            return con.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+        finally:
+            con.close()
+
+    def test_tables_are_normalized(self):
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(self.relational)
+        self.assertTrue(u.pushDataToDb(self.category))
+
+        self.assertEqual(self.count("journal"), 3)
+        self.assertEqual(self.count("identifier"), 4)
+        self.assertEqual(self.count("category"), 4)
+        self.assertEqual(self.count("area"), 3)
+        self.assertEqual(self.count("journal_category"), 5)
+        self.assertEqual(self.count("journal_area"), 4)
+
+        q = CategoryQueryHandler()
+        q.setDbPathOrUrl(self.relational)
+        self.assertEqual(len(q.getAllCategories()), 4)
+        self.assertEqual(set(q.getCategoriesAssignedToAreas({"Social Sciences"})["category_id"]),
+                         {"History", "Philosophy", "Sociology"})
+        self.assertEqual(set(q.getAreasAssignedToCategories({"Philosophy"})["area"]),
+                         {"Arts and Humanities", "Social Sciences"})
+
+    def test_migration_from_info_table(self):
+        rows = []
+        for idx, item in enumerate(SCIMAGO_ITEMS):
+            for identifier in item["identifiers"]:
+                for category in item["categories"]:
+                    for area in item["areas"]:
+                        rows.append({"item_internal_id": "item_%d" % idx, "identifiers": identifier,
+                                     "category_internal_id": None, "category_id": category["id"],
+                                     "category_quartile": category["quartile"],
+                                     "area_internal_id": None, "area": area})
+        con = sqlite3.connect(self.relational)
+        DataFrame(rows).to_sql("info", con, index=False)
+        con.close()
+
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(self.relational)
+        self.assertTrue(u.migrateInfoDb())
+        self.assertEqual(self.count("journal_category"), 5)
+        self.assertEqual(self.count("journal_area"), 4)
+
+        q = CategoryQueryHandler()
+        q.setDbPathOrUrl(self.relational)
+        self.assertEqual(set(q.getCategoriesWithQuartile({"Q1"})["category_id"]), {"History"})
+        self.assertEqual(set(q.getAllAreas()["area"]), {"Arts and Humanities", "Social Sciences", "Medicine"})
+
+    def test_lookups_use_indexes(self):
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(self.relational)
+        self.assertTrue(u.pushDataToDb(self.category))
+        q = CategoryQueryHandler()
+        q.setDbPathOrUrl(self.relational)
+
+        plan = q.getQueryPlan("""
+            SELECT i.identifier, c.category_id, c.category_quartile
+            FROM identifier i
+            JOIN journal_category jc ON jc.journal_id = i.journal_id
+            JOIN category c ON c.category_pk = jc.category_pk
+            WHERE i.identifier IN (?, ?)""", ("1111-1111", "2222-1111"))
+        self.assertIn("idx_identifier_identifier", " ".join(plan["detail"]))
+
+        plan = q.getQueryPlan("SELECT category_id FROM category WHERE category_quartile = ?", ("Q1",))
+        self.assertIn("idx_category_quartile", " ".join(plan["detail"]))
+
+        plan = q.getQueryPlan("""
+            SELECT i.identifier
+            FROM area a
+            JOIN journal_area ja ON ja.area_pk = a.area_pk
+            JOIN identifier i ON i.journal_id = ja.journal_id
+            WHERE a.area = ?""", ("Medicine",))
+        self.assertIn("idx_journal_area_area", " ".join(plan["detail"]))
+        self.assertNotIn("SCAN", " ".join(plan["detail"]))
+
+    def test_query_handler_reuses_its_connection(self):
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(self.relational)
+        self.assertTrue(u.pushDataToDb(self.category))
+        q = CategoryQueryHandler()
+        q.setDbPathOrUrl(self.relational)
+
+        con = q._get_connection()
+        q.getAllCategories()
+        q.getAllAreas()
+        self.assertIs(q._get_connection(), con)
+        self.assertEqual(con.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        with self.assertRaises(sqlite3.OperationalError):
+            con.execute("DELETE FROM area")
+
+        # the data written by the upload handler is visible to the open connection
+        self.assertTrue(u.pushDataToDb(self.category))
+        self.assertEqual(len(q.getAllAreas()), 3)
+
+        self.assertTrue(q.close())
+        self.assertIsNot(q._get_connection(), con)
+        q.close()
+
+    def upload(self, items, upsert=False):
+        path = os.path.join(self.folder.name, "items.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(items, f)
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(self.relational)
+        u.setUpsert(upsert)
+        return u.pushDataToDb(path)
+
+    def test_upsert_merges_by_identifier(self):
+        self.assertTrue(self.upload(SCIMAGO_ITEMS))
+        self.assertTrue(self.upload([
+            {"identifiers": ["2222-1111"], "categories": [{"id": "Economics", "quartile": "Q2"}], "areas": ["Economics"]},
+            {"identifiers": ["4444-1111"], "categories": [{"id": "History", "quartile": "Q1"}], "areas": ["Arts and Humanities"]}
+        ], upsert=True))
+
+        self.assertEqual(self.count("journal"), 4)
+        self.assertEqual(self.count("identifier"), 5)
+        q = CategoryQueryHandler()
+        q.setDbPathOrUrl(self.relational)
+        self.addCleanup(q.close)
+        # Sociology and its area were used only by the journal that changed
+        self.assertEqual(set(q.getAllCategories()["category_id"]), {"History", "Philosophy", "Medicine", "Economics"})
+        self.assertEqual(set(q.getAllAreas()["area"]), {"Arts and Humanities", "Social Sciences", "Medicine", "Economics"})
+        self.assertEqual(set(q.getAreasAssignedToCategories({"History"})["area"]), {"Arts and Humanities", "Social Sciences"})
+
+        # an item with the identifiers of two journals joins them
+        self.assertTrue(self.upload([{"identifiers": ["1111-2222", "3333-1111"], "categories": [], "areas": []}], upsert=True))
+        self.assertEqual(self.count("journal"), 3)
+        self.assertEqual(set(q.getAllAreas()["area"]), {"Arts and Humanities", "Economics"})
+
+    def test_repeated_upsert_leaves_the_database_unchanged(self):
+        self.assertTrue(self.upload(SCIMAGO_ITEMS))
+        moved = [{"identifiers": [], "categories": [{"id": "Law", "quartile": "Q1"}], "areas": ["Law"]},
+                 {"identifiers": ["1111-2222"], "categories": [], "areas": []},
+                 {"identifiers": ["4444-1111"], "categories": [{"id": "Philosophy", "quartile": "Q2"}], "areas": ["Arts and Humanities"]}]
+        for _ in range(2):
+            self.assertTrue(self.upload(moved, upsert=True))
+            # the item without identifiers is not added, the categories and areas taken from 1111-2222
+            # are kept when another item of the same upsert uses them
+            self.assertEqual(self.count("journal"), 4)
+            self.assertEqual(self.count("identifier"), 4)
+            self.assertEqual(self.count("category"), 4)
+            self.assertEqual(self.count("area"), 3)
+
+    def test_failed_upload_leaves_the_database_unchanged(self):
+        self.assertTrue(self.upload(SCIMAGO_ITEMS))
+        broken = [{"identifiers": ["5555-1111"], "categories": [{"id": "Law", "quartile": "Q1"}], "areas": ["Law"]},
+                  {"identifiers": ["6666-1111"], "categories": [{"quartile": "Q1"}], "areas": []}] # no category id
+        self.assertFalse(self.upload(broken))
+        self.assertFalse(self.upload(broken, upsert=True))
+        self.assertEqual(self.count("journal"), 3)
+        self.assertEqual(self.count("identifier"), 4)
+        self.assertEqual(self.count("category"), 4)
+
+
+    def test_json_file_is_read_one_item_at_a_time(self):
+        u = CategoryUploadHandler()
+        u.readSize = 7 # smaller than every item, they are always split between two reads
+        for text in (json.dumps(SCIMAGO_ITEMS), json.dumps(SCIMAGO_ITEMS, indent=4), "[]", " [ ] "):
+            with open(self.category, "w", encoding="utf-8") as f:
+                f.write(text)
+            self.assertEqual(list(u._iter_items(self.category)), json.loads(text))
+
+        with open(self.category, "w", encoding="utf-8") as f:
+            f.write(json.dumps(SCIMAGO_ITEMS)[:-20])
+        with self.assertRaises(ValueError):
+            list(u._iter_items(self.category))
+
+    def test_values_cut_by_a_read_are_not_split(self):
+        u = CategoryUploadHandler()
+        u.readSize = 3 # the numbers and the literals end exactly where a read ends
+        for text in ("[12345, 67]", "[12345,67 ]", "[1.5e10,-2,true,null,\"abc\"]", "[12, 345]"):
+            with open(self.category, "w", encoding="utf-8") as f:
+                f.write(text)
+            self.assertEqual(list(u._iter_items(self.category)), json.loads(text))
+
+        with open(self.category, "w", encoding="utf-8") as f:
+            f.write("[12345")
+        with self.assertRaises(ValueError):
+            list(u._iter_items(self.category))
+
+    def test_upload_memory_does_not_grow_with_the_file(self):
+        def peak(size):
+            items = [{"identifiers": ["%04d-%04d" % (i // 10000, i % 10000)],
+                      "categories": [{"id": "Category %d" % (i % 50), "quartile": "Q%d" % (i % 4 + 1)}],
+                      "areas": ["Area %d" % (i % 20)]} for i in range(size)]
+            with open(self.category, "w", encoding="utf-8") as f:
+                json.dump(items, f)
+            del items
+            u = CategoryUploadHandler()
+            u.setDbPathOrUrl(self.relational)
+            u.setBatchSize(500)
+            tracemalloc.start()
+            self.assertTrue(u.pushDataToDb(self.category))
+            result = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return result
+
+        small, large = peak(5000), peak(20000)
+        self.assertEqual(self.count("journal"), 20000)
+        self.assertLess(large, small * 1.5)
+
+
+class TestModel(unittest.TestCase):
+
+    def test_journal_getters(self):
+        c = Category(["History"], "Q1")
+        a = Area(["Arts and Humanities"])
+        j = Journal(["1111-1111", "1111-2222", "1111-1111"], "A title", ["Spanish", "English"],
+                    "A publisher", True, "CC BY", False, [c], [a])
+        self.assertEqual(j.getIds(), ["1111-1111", "1111-2222"])
+        self.assertEqual(j.getLanguages(), ["English", "Spanish"])
+        self.assertEqual(j.getPublisher(), "A publisher")
+        self.assertEqual(j.getLicence(), "CC BY")
+        self.assertTrue(j.hasDOAJSeal())
+        self.assertFalse(j.hasAPC())
+        self.assertEqual(j.getCategories(), [c])
+        self.assertEqual(j.getAreas(), [a])
+        self.assertEqual(c.getQuartile(), "Q1")
+
+        # the getters return copies, changing them does not change the journal
+        j.getLanguages().append("Italian")
+        self.assertEqual(j.getLanguages(), ["English", "Spanish"])
+
+    def test_objects_have_no_dict(self):
+        for entity in (Journal(["1111-1111"], "t", ["English"], None, False, "CC BY", False, [], []),
+                       Category(["History"], None), Area(["Medicine"])):
+            self.assertFalse(hasattr(entity, "__dict__"))
+
+    def test_category_and_area_objects_scale_linearly(self):
+        engine = FullQueryEngine()
+        for size in (10000, 20000, 40000):
+            categories = DataFrame({"category_id": ["Category %d" % i for i in range(size)],
+                                    "category_quartile": ["Q%d" % (i % 4 + 1) for i in range(size)]})
+            areas = DataFrame({"area": ["Area %d" % i for i in range(size)]})
+
+            category_objects = engine.createCategoryObject(categories)
+            area_objects = engine.createAreaObject(areas)
+            self.assertEqual(len(category_objects), size)
+            self.assertEqual(len(area_objects), size)
+            # every object holds only its own identifier, so the total is linear in the input size
+            self.assertEqual(sum(len(c.getIds()) for c in category_objects), size)
+            self.assertEqual(sum(len(a.getIds()) for a in area_objects), size)
+            self.assertEqual(category_objects[-1].getIds(), ["Category %d" % (size - 1)])
+            self.assertEqual(category_objects[-1].getQuartile(), "Q%d" % ((size - 1) % 4 + 1))
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.category = os.path.join(self.folder.name, "scimago.json")
+        self.relational = os.path.join(self.folder.name, "relational.db")
+        with open(self.category, "w", encoding="utf-8") as f:
+            json.dump(SCIMAGO_ITEMS, f)
+        self.upload = CategoryUploadHandler()
+        self.upload.setDbPathOrUrl(self.relational)
+        self.upload.pushDataToDb(self.category)
+        self.query = CategoryQueryHandler()
+        self.query.setDbPathOrUrl(self.relational)
+        self.query.cache = QueryCache(maxEntries=2, ttl=60)
+
+    def tearDown(self):
+        self.query.close()
+        self.folder.cleanup()
+
+    def test_hits_and_misses(self):
+        self.query.getAllCategories()
+        self.query.getAllCategories()
+        self.query.getCategoriesWithQuartile({"Q1"})
+        self.query.getCategoriesWithQuartile({"Q1"})
+        self.query.getCategoriesWithQuartile({"Q2"})
+        stats = self.query.cache.getStats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 3))
+        self.assertEqual(stats["entries"], 2) # the least recently used result was evicted
+
+    def test_results_expire(self):
+        self.query.cache.ttl = 0
+        self.query.getAllAreas()
+        self.query.getAllAreas()
+        self.assertEqual(self.query.cache.getStats()["hits"], 0)
+
+    def test_upload_invalidates_the_database(self):
+        self.assertEqual(len(self.query.getAllAreas()), 3)
+        with open(self.category, "w", encoding="utf-8") as f:
+            json.dump(SCIMAGO_ITEMS[:1], f)
+        self.assertTrue(self.upload.pushDataToDb(self.category))
+        self.assertEqual(self.query.cache.getStats()["entries"], 0)
+        self.assertEqual(len(self.query.getAllAreas()), 2)
+
+    def test_result_older_than_an_upload_is_not_kept(self):
+        # the upload ends while the query is running, after its rows were read
+        with open(self.category, "w", encoding="utf-8") as f:
+            json.dump(SCIMAGO_ITEMS[:1], f)
+        execute_query = self.query._execute_query
+        def upload_during_query(query, params=None):
+            df = execute_query(query, params)
+            self.assertTrue(self.upload.pushDataToDb(self.category))
+            return df
+        self.query._execute_query = upload_during_query
+        self.assertEqual(len(self.query.getAllAreas()), 3)
+        self.query._execute_query = execute_query
+        self.assertEqual(self.query.cache.getStats()["entries"], 0)
+        self.assertEqual(len(self.query.getAllAreas()), 2)
+
+
+# Scimago items using journals of test_data/doaj.csv, for the tests joining the two databases
+LINKED_SCIMAGO_ITEMS = [
+    {"identifiers": ["1983-9979"],
+     "categories": [{"id": "Linguistics and Language", "quartile": "Q2"}],
+     "areas": ["Arts and Humanities"]},
+    {"identifiers": ["2224-9281", "2414-990X"],
+     "categories": [{"id": "Law", "quartile": "Q1"}],
+     "areas": ["Social Sciences"]},
+    {"identifiers": ["2174-548X"],
+     "categories": [{"id": "Tourism", "quartile": "Q1"}, {"id": "Geography", "quartile": "Q3"}],
+     "areas": ["Social Sciences", "Business"]},
+    {"identifiers": ["1733-8670", "2392-0378"],
+     "categories": [{"id": "Ocean Engineering", "quartile": "Q1"}],
+     "areas": ["Engineering"]}
+]
+
+
+# A local graph and a relational database in a temporary folder, with the engines and the snapshots
+# built on them, shared by the tests of the engines.
+
+class LocalGraphTestCase(unittest.TestCase):
+    journal = "test_data" + sep + "doaj.csv"
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.graph = "memory://" + self.id()
+        self.category = os.path.join(self.folder.name, "scimago.json")
+        self.relational = os.path.join(self.folder.name, "relational.db")
+        with open(self.category, "w", encoding="utf-8") as f:
+            json.dump(LINKED_SCIMAGO_ITEMS, f)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def engine(self):
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl(self.graph)
+        self.assertTrue(u.pushDataToDb(self.journal))
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(self.relational)
+        self.assertTrue(u.pushDataToDb(self.category))
+
+        jq = JournalQueryHandler()
+        jq.setDbPathOrUrl(self.graph)
+        cq = CategoryQueryHandler()
+        cq.setDbPathOrUrl(self.relational)
+        self.addCleanup(cq.close)
+        fq = FullQueryEngine()
+        fq.addJournalHandler(jq)
+        fq.addCategoryHandler(cq)
+        return fq
+
+    def async_engine(self):
+        jq = AsyncJournalQueryHandler()
+        jq.setDbPathOrUrl(self.graph)
+        cq = AsyncCategoryQueryHandler()
+        cq.setDbPathOrUrl(self.relational)
+        self.addCleanup(cq.close)
+        fq = AsyncFullQueryEngine()
+        fq.addJournalHandler(jq)
+        fq.addCategoryHandler(cq)
+        return fq
+
+    def snapshot_engine(self):
+        journal_snapshot = os.path.join(self.folder.name, "journals.arrow")
+        category_snapshot = os.path.join(self.folder.name, "categories.arrow")
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl(self.graph)
+        self.assertTrue(u.setSnapshotPath(journal_snapshot))
+        self.assertTrue(u.pushDataToDb(self.journal))
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(self.relational)
+        self.assertTrue(u.setSnapshotPath(category_snapshot))
+        self.assertTrue(u.pushDataToDb(self.category))
+
+        # no handlers, everything comes from the snapshots
+        fq = FullQueryEngine()
+        self.assertTrue(fq.loadSnapshot(journal_snapshot, category_snapshot))
+        return fq
+
+    def journals(self, journals):
+        return sorted((sorted(j.getIds()), j.getTitle(), sorted(j.getLanguages()), j.getPublisher(), j.hasDOAJSeal(),
+                       j.getLicence(), j.hasAPC(), sorted(j.getCategories()), sorted(j.getAreas())) for j in journals)
+
+    def spread_categories(self):
+        # all the journals of the graph are in the relational database too, spread over three areas
+        rows = read_csv(self.journal, dtype=str, keep_default_na=False)
+        items = [{"identifiers": [i for i in (issn, eissn) if i],
+                  "categories": [{"id": f"Category {n % 5}", "quartile": f"Q{n % 4 + 1}"}],
+                  "areas": [f"Area {n % 3}"]}
+                 for n, (issn, eissn) in enumerate(zip(rows["Journal ISSN (print version)"], rows["Journal EISSN (online version)"]))]
+        with open(self.category, "w", encoding="utf-8") as f:
+            json.dump(items, f)
+
+
+class TestLocalGraph(LocalGraphTestCase):
+
+    def test_journal_query_handler(self):
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl(self.graph)
+        self.assertTrue(u.pushDataToDb(self.journal))
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl(self.graph)
+
+        self.assertEqual(len(q.getAllJournals()), 855)
+        journal = q.getById("2414-990X")
+        self.assertEqual(len(journal), 1)
+        self.assertEqual(sorted(journal["identifiers"][0]), ["2224-9281", "2414-990X"])
+        self.assertEqual(sorted(journal["languages"][0]), ["English", "Russian", "Ukrainian"])
+        self.assertTrue(q.getById("2414-990").empty)
+        self.assertEqual(len(q.getById("2414-990x", substring=True)), 1)
+        self.assertEqual(len(q.getByIds(["2414-990X", "1983-9979", "just_a_test"])), 2)
+        self.assertTrue(all(q.getJournalsWithAPC()["apc"] == "Yes"))
+
+    def test_graph_file_is_persisted(self):
+        path = os.path.join(self.folder.name, "graph.nt")
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl("file://" + path)
+        self.assertTrue(u.pushDataToDb(self.journal))
+        self.assertTrue(os.path.exists(path))
+
+        # once the file exists its path is enough
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl(path)
+        q.cache = None
+        self.assertEqual(len(q.getAllJournals()), 855)
+
+    def test_only_explicit_paths_are_local_graphs(self):
+        # the default path and a Blazegraph URL without its scheme are not new graphs in this process
+        for path in ("", "localhost:9999/blazegraph/sparql", os.path.join(self.folder.name, "missing.nt")):
+            u = JournalUploadHandler()
+            u.setDbPathOrUrl(path)
+            self.assertFalse(u.pushDataToDb(self.journal))
+            q = JournalQueryHandler()
+            q.setDbPathOrUrl(path)
+            self.assertTrue(q.getAllJournals().empty)
+            self.assertTrue(q.getJournalsPage(10).empty)
+            self.assertTrue(q.getStatistics().empty)
+            aq = AsyncJournalQueryHandler()
+            aq.setDbPathOrUrl(path)
+            self.assertTrue(asyncio.run(aq.getJournalsPage(10)).empty)
+
+    def test_local_graph_is_queried_by_one_thread_at_a_time(self):
+        u = JournalUploadHandler()
+        u.setDbPathOrUrl(self.graph)
+        self.assertTrue(u.pushDataToDb(self.journal))
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl(self.graph)
+        q.cache = None
+        expected = len(q.getAllJournals())
+
+        results = []
+        def query():
+            results.append(len(q.getAllJournals()))
+        threads = [threading.Thread(target=query) for _ in range(4)]
+        threads.append(threading.Thread(target=u.pushDataToDb, args=(self.journal,)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [expected] * 4)
+
+    def test_full_query_engine(self):
+        fq = self.engine()
+        journals = fq.getJournalsInCategoriesWithQuartile({"Law", "Tourism"}, {"Q1"})
+        self.assertEqual(sorted(j.getTitle() for j in journals),
+                         ["Enlightening Tourism: A Pathmaking Journal", "Проблеми Законності"])
+
+        journals = fq.getJournalsInAreasWithLicense({"Social Sciences"}, {"CC BY"})
+        self.assertEqual([j.getTitle() for j in journals], ["Проблеми Законності"])
+        self.assertEqual(sorted(journals[0].getIds()), ["2224-9281", "2414-990X"])
+        self.assertEqual(len(fq.getJournalsInAreasWithLicense({"Social Sciences"}, set())), 2)
+
+        journals = fq.getDiamondJournalsInAreasAndCategoriesWithQuartile({"Social Sciences"}, set(), set())
+        self.assertEqual([j.getTitle() for j in journals], ["Enlightening Tourism: A Pathmaking Journal"])
+        self.assertEqual(sorted(journals[0].getAreas()), ["Business", "Social Sciences"])
+
+        self.assertEqual(fq.getJournalsInCategoriesWithQuartile({"just_a_test"}, {"just_a_test"}), [])
+
+
+class TestSnapshot(LocalGraphTestCase):
+
+    def test_snapshot_answers_like_the_databases(self):
+        snapshot = self.snapshot_engine()
+        databases = self.engine()
+        self.assertEqual(len(snapshot.getAllJournals()), 855)
+        for method, args in (("getAllJournals", ()), ("getJournalsWithTitle", ("tourism",)),
+                             ("getJournalsPublishedBy", ("Universi",)), ("getJournalsWithLicense", ({"cc by", "CC BY-SA"},)),
+                             ("getJournalsWithAPC", ()), ("getJournalsWithDOAJSeal", ())):
+            self.assertEqual(self.journals(getattr(snapshot, method)(*args)),
+                             self.journals(getattr(databases, method)(*args)), method)
+
+        journal = [j for j in snapshot.getAllJournals() if "2414-990X" in j.getIds()][0]
+        self.assertEqual(sorted(journal.getCategories()), ["Law"])
+        self.assertEqual(journal.getAreas(), ["Social Sciences"])
+
+    def test_snapshot_answers_the_category_and_cross_queries(self):
+        snapshot = self.snapshot_engine()
+        databases = self.engine()
+        for method, args in (("getAllCategories", ()), ("getCategoriesWithQuartile", ({"Q1"},)),
+                             ("getCategoriesAssignedToAreas", ({"Social Sciences"},)), ("getCategoriesAssignedToAreas", (set(),))):
+            self.assertEqual(sorted((c.getIds(), c.getQuartile()) for c in getattr(snapshot, method)(*args)),
+                             sorted((c.getIds(), c.getQuartile()) for c in getattr(databases, method)(*args)), method)
+        for method, args in (("getAllAreas", ()), ("getAreasAssignedToCategories", ({"Tourism", "Law"},))):
+            self.assertEqual(sorted(a.getIds() for a in getattr(snapshot, method)(*args)),
+                             sorted(a.getIds() for a in getattr(databases, method)(*args)), method)
+        self.assertEqual([[c.getIds()[0] for c in snapshot.getCategoriesPage(2, after)[0]] for after in (None, "Law")],
+                         [[c.getIds()[0] for c in databases.getCategoriesPage(2, after)[0]] for after in (None, "Law")])
+        for method, args in (("getJournalsInCategoriesWithQuartile", ({"Law", "Tourism"}, {"Q1"})),
+                             ("getJournalsInAreasWithLicense", ({"Social Sciences"}, {"CC BY"})),
+                             ("getJournalsInAreasWithLicense", ({"Social Sciences"}, set())),
+                             ("getDiamondJournalsInAreasAndCategoriesWithQuartile", ({"Social Sciences"}, set(), set()))):
+            journals = getattr(snapshot, method)(*args)
+            self.assertTrue(journals, method)
+            self.assertEqual(self.journals(journals), self.journals(getattr(databases, method)(*args)), method)
+        self.assertEqual(snapshot.getEntityById("Tourism"), Category)
+        self.assertEqual(snapshot.getEntityById("Business"), Area)
+
+    def test_snapshot_category_queries_are_the_database_ones(self):
+        # the quartiles can be missing or null in the scimago file
+        items = SCIMAGO_ITEMS + [{"identifiers": ["5555-1111"], "categories": [{"id": "History"}, {"id": "Law", "quartile": None}],
+                                  "areas": ["Law"]}]
+        path = os.path.join(self.folder.name, "quartiles.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(items, f)
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(os.path.join(self.folder.name, "quartiles.db"))
+        self.assertTrue(u.setSnapshotPath(os.path.join(self.folder.name, "quartiles.arrow")))
+        self.assertTrue(u.pushDataToDb(path))
+        database = CategoryQueryHandler()
+        database.setDbPathOrUrl(u.getDbPathOrUrl())
+        database.cache = None
+        self.addCleanup(database.close)
+        fq = FullQueryEngine()
+        self.assertTrue(fq.loadSnapshot(categoryPath=os.path.join(self.folder.name, "quartiles.arrow")))
+        self.addCleanup(fq.unloadSnapshot)
+
+        queries = [("getAllCategories", ()), ("getAllAreas", ()), ("getCategoriesWithQuartile", ({"Q1", None},)),
+                   ("getCategoriesWithQuartile", ({""},)), ("getCategoriesWithQuartile", (set(),)),
+                   ("getCategoriesAssignedToAreas", ({"Law", "Medicine"},)), ("getCategoriesAssignedToAreas", (set(),)),
+                   ("getAreasAssignedToCategories", ({"History"},)), ("getAreasAssignedToCategories", (set(),)),
+                   ("getCategoriesPage", (2, None)), ("getCategoriesPage", (2, "Law")),
+                   ("getById", ("History",)), ("getById", ("Law",)), ("getById", ("1111-1111",)), ("getStatistics", ())]
+        # every query of the handler is compared, a new one has to be added here
+        self.assertEqual({method for method, args in queries},
+                         {m for m in dir(CategoryQueryHandler) if m.startswith("get") and m not in ("getDbPathOrUrl", "getQueryPlan")})
+        for method, args in queries:
+            expected = getattr(database, method)(*args)
+            found = fq._category_df(method, *args)
+            self.assertEqual(list(found.columns), list(expected.columns), method)
+            self.assertEqual(sorted(map(repr, found.itertuples(index=False))), sorted(map(repr, expected.itertuples(index=False))),
+                             (method, args))
+
+    def test_snapshot_of_another_kind_is_not_loaded(self):
+        self.snapshot_engine()
+        fq = FullQueryEngine()
+        self.assertFalse(fq.loadSnapshot(journalPath=os.path.join(self.folder.name, "categories.arrow")))
+        self.assertIsNone(fq.journalSnapshot)
+        self.assertFalse(fq.loadSnapshot(journalPath=os.path.join(self.folder.name, "missing.arrow")))
+
+
+class TestPagination(LocalGraphTestCase):
+
+    def test_journal_pages(self):
+        fq = self.engine()
+        q = fq.journalQuery[0]
+        page = q.getJournalsPage(100)
+        self.assertEqual(len(page), 100)
+        self.assertEqual(page["journal"].tolist(), sorted(page["journal"]))
+        following = q.getJournalsPage(100, page["journal"].iloc[-1])
+        self.assertGreater(following["journal"].iloc[0], page["journal"].iloc[-1])
+
+        journals, after = fq.getJournalsPage(100)
+        self.assertEqual((len(journals), after), (100, page["journal"].iloc[-1]))
+        self.assertEqual(self.journals(fq.iterJournals(pageSize=100)), self.journals(fq.getAllJournals()))
+        self.assertEqual(fq.getJournalsPage(100, "https://comp-data.github.io/z"), ([], None))
+
+    def test_endpoint_page_queries(self):
+        fq = self.engine()
+        local = fq.journalQuery[0]
+        q = JournalQueryHandler()
+        q.setDbPathOrUrl("http://127.0.0.1/sparql") # only the text of its queries is used
+        after = local.getJournalsPage(50)["journal"].iloc[-1]
+        expected = local.getJournalsPage(50, after)
+        journals = q._decode_results(local._query_local_graph(q._page_query(50, after)))
+        self.assertEqual(journals["journal"].tolist(), expected["journal"].tolist())
+        page = q._sort_page(q._decode_results(local._query_local_graph(q._journals_query(journals["journal"].tolist()))))
+        self.assertEqual(page["title"].tolist(), expected["title"].tolist())
+        self.assertEqual([sorted(ids) for ids in page["identifiers"]], [sorted(ids) for ids in expected["identifiers"]])
+
+    def test_category_pages(self):
+        fq = self.engine()
+        categories, after = fq.getCategoriesPage(2)
+        self.assertEqual([c.getIds()[0] for c in categories], ["Geography", "Law"])
+        self.assertEqual(after, "Law")
+        self.assertEqual(sorted(c.getIds()[0] for c in fq.iterCategories(pageSize=2)),
+                         sorted(c.getIds()[0] for c in fq.getAllCategories()))
+
+    def test_snapshot_pages(self):
+        snapshot = self.snapshot_engine()
+        self.assertEqual(self.journals(snapshot.iterJournals(pageSize=200)), self.journals(snapshot.getAllJournals()))
+        journals, after = snapshot.getJournalsPage(10)
+        self.assertEqual(after, self.engine().getJournalsPage(10)[1])
+
+
+class SlowCategoryQueryHandler(CategoryQueryHandler):
+    # answers after delay seconds, like a database on a slow network
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.cache = None
+
+    def getAllAreas(self):
+        time.sleep(self.delay)
+        return super().getAllAreas()
+
+
+class TestFanOut(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.relational = []
+        for name, items in (("first", SCIMAGO_ITEMS), ("second", SCIMAGO_ITEMS[1:] + [
+                {"identifiers": ["4444-1111"], "categories": [{"id": "Law", "quartile": "Q1"}], "areas": ["Law"]}])):
+            path = os.path.join(self.folder.name, name + ".json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(items, f)
+            u = CategoryUploadHandler()
+            u.setDbPathOrUrl(os.path.join(self.folder.name, name + ".db"))
+            self.assertTrue(u.pushDataToDb(path))
+            self.relational.append(u.getDbPathOrUrl())
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def handler(self, path, delay=0):
+        q = SlowCategoryQueryHandler(delay)
+        q.setDbPathOrUrl(path)
+        self.addCleanup(q.close)
+        return q
+
+    def test_results_of_all_handlers_are_merged(self):
+        engine = FullQueryEngine()
+        for path in self.relational:
+            engine.addCategoryHandler(self.handler(path))
+        self.assertEqual(sorted(c.getIds()[0] for c in engine.getAllCategories()),
+                         ["History", "Law", "Medicine", "Philosophy", "Sociology"])
+        self.assertEqual(sorted(a.getIds()[0] for a in engine.getAllAreas()),
+                         ["Arts and Humanities", "Law", "Medicine", "Social Sciences"])
+        self.assertEqual(engine.gethasArea_mapped(["1111-1111", "4444-1111"]),
+                         {"1111-1111": ["Arts and Humanities", "Social Sciences"], "4444-1111": ["Law"]})
+
+    def test_identifiers_are_looked_up_in_a_single_query(self):
+        engine = FullQueryEngine()
+        handler = self.handler(self.relational[0])
+        queries = []
+        execute_query = handler._execute_query
+        handler._execute_query = lambda query, params=None: queries.append(params) or execute_query(query, params)
+        engine.addCategoryHandler(handler)
+        # more identifiers than the 32766 variables that SQLite allows by default in a query
+        identifiers = ["1111-1111"] + [f"{n:04d}-0000" for n in range(40000)]
+        self.assertEqual(engine._identifier_links(identifiers),
+                         ({"1111-1111": ["Arts and Humanities", "Social Sciences"]}, {"1111-1111": ["History", "Philosophy"]}))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(queries[0]), 1)
+
+    def test_handlers_are_asked_at_the_same_time(self):
+        engine = FullQueryEngine()
+        for path in self.relational * 2:
+            engine.addCategoryHandler(self.handler(path, delay=0.3))
+        start = time.perf_counter()
+        self.assertEqual(len(engine.getAllAreas()), 4)
+        self.assertLess(time.perf_counter() - start, 0.9) # 1.2 seconds one after the other
+
+    def test_slow_handler_is_left_out(self):
+        engine = FullQueryEngine()
+        engine.handlerTimeout = 0.3
+        engine.addCategoryHandler(self.handler(self.relational[0]))
+        engine.addCategoryHandler(self.handler(self.relational[1], delay=0.6))
+        self.assertEqual(sorted(a.getIds()[0] for a in engine.getAllAreas()),
+                         ["Arts and Humanities", "Medicine", "Social Sciences"])
+        time.sleep(0.5) # the slow handler finishes before its database is removed
+
+    def test_hung_handlers_do_not_take_all_the_threads(self):
+        hung = threading.Event()
+        class HungCategoryQueryHandler(SlowCategoryQueryHandler):
+            def getAllAreas(self):
+                hung.wait()
+                return super().getAllAreas()
+
+        handlers = []
+        for _ in range(20): # more than the threads of the engines
+            handler = HungCategoryQueryHandler(0)
+            handler.setDbPathOrUrl(self.relational[0])
+            self.addCleanup(handler.close)
+            handlers.append(handler)
+        engine = FullQueryEngine()
+        engine.handlerTimeout = 0.2
+        async_engine = AsyncFullQueryEngine()
+        async_engine.handlerTimeout = 0.2
+        for handler in handlers:
+            engine.addCategoryHandler(handler)
+            async_engine.addCategoryHandler(handler)
+
+        answering = FullQueryEngine()
+        answering.handlerTimeout = 1
+        answering.addCategoryHandler(self.handler(self.relational[0]))
+        try:
+            self.assertEqual(engine.getAllAreas(), [])
+            self.assertEqual(len(answering.getAllAreas()), 3)
+            self.assertEqual(asyncio.run(async_engine.getAllAreas()), [])
+            self.assertEqual(len(answering.getAllAreas()), 3)
+        finally:
+            hung.set()
+        time.sleep(0.5) # the hung handlers finish before their database is removed
+
+
+class TestAsyncQueryEngine(LocalGraphTestCase):
+
+    def test_async_engine_answers_like_the_sync_one(self):
+        databases = self.engine()
+        engine = self.async_engine()
+        for method, args in (("getAllJournals", ()), ("getJournalsWithTitle", ("tourism",)),
+                             ("getJournalsWithLicense", ({"cc by", "CC BY-SA"},)), ("getJournalsWithDOAJSeal", ()),
+                             ("getJournalsInCategoriesWithQuartile", ({"Law", "Tourism"}, {"Q1"})),
+                             ("getJournalsInAreasWithLicense", ({"Social Sciences"}, {"CC BY"})),
+                             ("getDiamondJournalsInAreasAndCategoriesWithQuartile", ({"Social Sciences"}, set(), set()))):
+            self.assertEqual(self.journals(asyncio.run(getattr(engine, method)(*args))),
+                             self.journals(getattr(databases, method)(*args)), method)
+        self.assertEqual(sorted(a.getIds()[0] for a in asyncio.run(engine.getAllAreas())),
+                         sorted(a.getIds()[0] for a in databases.getAllAreas()))
+        self.assertEqual(asyncio.run(engine.getEntityById("2414-990X")), databases.getEntityById("2414-990X"))
+
+    def test_async_pages(self):
+        databases = self.engine()
+        engine = self.async_engine()
+
+        async def journals():
+            return [journal async for journal in engine.iterJournals(pageSize=300)]
+        self.assertEqual(self.journals(asyncio.run(journals())), self.journals(databases.getAllJournals()))
+        categories, after = asyncio.run(engine.getCategoriesPage(2))
+        self.assertEqual(([c.getIds()[0] for c in categories], after), (["Geography", "Law"], "Law"))
+
+    def test_async_queries_are_cached_once(self):
+        self.engine()
+        cache = QueryCache()
+        cq = AsyncCategoryQueryHandler()
+        cq.setDbPathOrUrl(self.relational)
+        cq.cache = cache
+        self.addCleanup(cq.close)
+        jq = AsyncJournalQueryHandler()
+        jq.setDbPathOrUrl(self.graph)
+        jq.cache = cache
+
+        asyncio.run(cq.getAllAreas())
+        self.assertEqual(cache.getStats()["misses"], 1)
+        self.assertEqual(cache.getStats()["entries"], 1)
+        asyncio.run(cq.getAllAreas())
+        self.assertEqual((cache.getStats()["hits"], cache.getStats()["misses"]), (1, 1))
+        asyncio.run(jq.getJournalsPage(10))
+        asyncio.run(jq.getStatistics())
+        self.assertEqual((cache.getStats()["misses"], cache.getStats()["entries"]), (3, 3))
+
+    def test_sync_handlers_are_called_in_threads(self):
+        fq = self.engine()
+        engine = AsyncFullQueryEngine()
+        engine.addJournalHandler(fq.journalQuery[0])
+        engine.addCategoryHandler(fq.categoryQuery[0])
+        self.assertEqual(self.journals(asyncio.run(engine.getJournalsWithTitle("tourism"))),
+                         self.journals(fq.getJournalsWithTitle("tourism")))
+
+    def test_queries_to_the_endpoint_share_a_client(self):
+        with StubSparqlEndpoint() as endpoint:
+            endpoint.vars = ["journal", "title", "identifiers"]
+            endpoint.bindings = [{"journal": {"value": "https://comp-data.github.io/res/journal-1"},
+                                  "title": {"value": "A journal"}, "identifiers": {"value": "1111-1111"}}]
+            q = AsyncJournalQueryHandler()
+            q.setDbPathOrUrl(endpoint.url)
+            q.cache = None
+
+            async def queries():
+                first = await q.getById("1111-1111")
+                client = q._client
+                second = await q.getJournalsWithTitle("journal")
+                self.assertIs(q._client, client)
+                await q.aclose()
+                return first, second
+
+            first, second = asyncio.run(queries())
+        self.assertEqual(first["identifiers"][0], ["1111-1111"])
+        self.assertEqual(second["title"][0], "A journal")
+
+    def test_client_is_closed_by_async_with(self):
+        with StubSparqlEndpoint() as endpoint:
+            endpoint.vars = ["journal", "title"]
+            q = AsyncJournalQueryHandler()
+            q.setDbPathOrUrl(endpoint.url)
+            q.cache = None
+
+            async def query():
+                async with q:
+                    await q.getAllJournals()
+                    client = q._client
+                    self.assertFalse(client.is_closed)
+                return client
+
+            # every asyncio.run has its own loop and client, async with closes it before the loop finishes
+            first = asyncio.run(query())
+            self.assertTrue(first.is_closed)
+            self.assertIsNone(q._client)
+            second = asyncio.run(query())
+            self.assertIsNot(second, first)
+            self.assertTrue(second.is_closed)
+
+            # the engine closes the clients of all its handlers
+            fq = AsyncFullQueryEngine()
+            fq.addJournalHandler(q)
+
+            async def engine_query():
+                async with fq as engine:
+                    await engine.getAllJournals()
+                    return q._client
+
+            self.assertTrue(asyncio.run(engine_query()).is_closed)
+
+            # without httpx the queries run in threads, and a message says so
+            output = io.StringIO()
+            with mock.patch.object(impl, "httpx", None), mock.patch.object(impl, "_httpx_warnings", set()), \
+                    contextlib.redirect_stdout(output):
+                asyncio.run(q.getAllJournals())
+                asyncio.run(q.getJournalsWithAPC())
+        self.assertEqual(output.getvalue().count("asynchronous SPARQL queries run in threads"), 1)
+
+
+class TestPlanner(LocalGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.spread_categories()
+
+    def test_statistics(self):
+        fq = self.engine()
+        journal_statistics, category_statistics = fq.journalQuery[0].getStatistics(), fq.categoryQuery[0].getStatistics()
+        counts = dict(zip(zip(journal_statistics["kind"], journal_statistics["value"]), journal_statistics["count"]))
+        self.assertEqual(counts[("journals", "")], 855)
+        self.assertEqual(counts[("license", "public domain")], 1)
+        counts = dict(zip(zip(category_statistics["kind"], category_statistics["value"]), category_statistics["count"]))
+        self.assertEqual(counts[("identifiers", "")], sum(counts[("area", f"Area {n}")] for n in range(3)))
+
+        # an endpoint counts them with a GROUP BY query
+        local = fq.journalQuery[0]
+        result = local._query_local_graph(local._statistics_query())
+        with StubSparqlEndpoint() as endpoint:
+            endpoint.vars = result["head"]["vars"]
+            endpoint.bindings = result["results"]["bindings"]
+            q = JournalQueryHandler()
+            q.setDbPathOrUrl(endpoint.url)
+            q.cache = None
+            df = q.getStatistics()
+        self.assertEqual(sorted(df.itertuples(index=False)), sorted(journal_statistics.itertuples(index=False)))
+
+    def test_rare_license_is_asked_first(self):
+        fq = self.engine()
+        args = ({"Area 0", "Area 1"}, {"Public domain", "CC BY-ND"})
+        plan = fq.explain("getJournalsInAreasWithLicense", *args)
+        self.assertEqual(plan["database"].tolist(), ["graph", "sqlite", "engine"])
+        self.assertLess(plan["estimated_identifiers"][0], 30)
+
+        journals = fq.getJournalsInAreasWithLicense(*args)
+        self.assertTrue(journals)
+        fq.planner = False
+        self.assertEqual(fq.explain("getJournalsInAreasWithLicense", *args)["database"].tolist(), ["sqlite", "graph", "engine"])
+        self.assertEqual(self.journals(journals), self.journals(fq.getJournalsInAreasWithLicense(*args)))
+
+        engine = self.async_engine()
+        self.assertTrue(asyncio.run(engine.explain("getJournalsInAreasWithLicense", *args)).equals(plan))
+        self.assertEqual(self.journals(asyncio.run(engine.getJournalsInAreasWithLicense(*args))), self.journals(journals))
+
+    def test_license_estimate_is_capped_by_the_identifiers(self):
+        fq = FullQueryEngine()
+        # every journal has both licenses and two identifiers
+        journal_statistics = {("journals", ""): 10, ("identifiers", ""): 20, ("license", "cc by"): 10, ("license", "cc by-sa"): 10}
+        category_statistics = {("identifiers", ""): 100, ("area", "Area 0"): 100}
+        plan = fq._plan("getJournalsInAreasWithLicense", ({"Area 0"}, {"CC BY", "CC BY-SA"}), category_statistics, journal_statistics)
+        self.assertEqual(plan["graph"], 20)
+
+    def test_statistics_are_kept_until_an_upload(self):
+        fq = self.engine()
+        calls = []
+        for handler in fq.categoryQuery + fq.journalQuery:
+            handler.cache = None
+            def getStatistics(handler=handler, method=handler.getStatistics):
+                calls.append(handler)
+                return method()
+            handler.getStatistics = getStatistics
+        args = ({"Area 0", "Area 1"}, {"Public domain", "CC BY-ND"})
+        journals = fq.getJournalsInAreasWithLicense(*args)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.journals(fq.getJournalsInAreasWithLicense(*args)), self.journals(journals))
+        self.assertEqual(len(calls), 2)
+
+        # an upload to one of the databases asks for them again
+        u = CategoryUploadHandler()
+        u.setDbPathOrUrl(self.relational)
+        self.assertTrue(u.pushDataToDb(self.category))
+        fq.getJournalsInAreasWithLicense(*args)
+        self.assertEqual(len(calls), 4)
+
+    def test_selective_areas_are_asked_first(self):
+        fq = self.engine()
+        plan = fq.explain("getJournalsInAreasWithLicense", {"Area 2"}, {"CC BY"})
+        self.assertEqual(plan["database"].tolist(), ["sqlite", "graph", "engine"])
+        # the graph has no filter on the categories, so they always start from the relational database
+        plan = fq.explain("getJournalsInCategoriesWithQuartile", {"Category 1"}, {"Q1", "Q2"})
+        self.assertEqual(plan["database"].tolist(), ["sqlite", "graph", "engine"])
+        self.assertTrue(fq.explain("getAllJournals").empty)
+
+
+class TestCrossFilters(LocalGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.spread_categories()
+
+    def test_query_size_does_not_depend_on_the_values(self):
+        fq = FullQueryEngine()
+        query, params = fq._identifiers_query({"Area 0"}, {"Category 0"}, {"Q1"})
+        many_query, many_params = fq._identifiers_query({f"Area {n}" for n in range(100)}, {f"Category {n}" for n in range(1000)},
+                                                        {"Q1", "Q2", "Q3", "Q4"})
+        self.assertEqual(query, many_query)
+        self.assertEqual(len(many_params), 3)
+
+    def test_empty_sets_are_no_filter(self):
+        fq = self.engine()
+        areas = {f"Area {n}" for n in range(3)}
+        categories = {f"Category {n}" for n in range(5)}
+        quartiles = {"Q1", "Q2", "Q3", "Q4"}
+        journals = fq.getDiamondJournalsInAreasAndCategoriesWithQuartile(set(), set(), set())
+        self.assertTrue(journals)
+        self.assertEqual(self.journals(journals), self.journals(fq.getDiamondJournalsInAreasAndCategoriesWithQuartile(areas, categories, quartiles)))
+        self.assertEqual(self.journals(fq.getJournalsInCategoriesWithQuartile(set(), {"Q1"})),
+                         self.journals(fq.getJournalsInCategoriesWithQuartile(categories, {"Q1"})))
+
+    def test_sqlite_without_json_each(self):
+        fq = self.engine()
+        async_fq = self.async_engine()
+        queries = ((fq.getJournalsInAreasWithLicense, ({"Area 0", "Area 1"}, {"Public domain", "CC BY-ND"})),
+                   (fq.getJournalsInAreasWithLicense, ({"Area 2"}, {"CC BY"})),
+                   (fq.getDiamondJournalsInAreasAndCategoriesWithQuartile, ({"Area 0"}, {"Category 1", "Category 2"}, {"Q1", "Q3"})))
+        expected = [self.journals(method(*args)) for method, args in queries]
+        self.assertTrue(all(expected))
+
+        # the values become variables, and the identifiers are sent in batches
+        with mock.patch.object(impl, "_sqlite_json", False), mock.patch.object(impl, "_sqlite_materialized", False), \
+                mock.patch.object(impl, "SQLITE_VARIABLES_BATCH", 50):
+            identifiers = [f"{n:04d}-0000" for n in range(120)]
+            self.assertGreater(len(fq._links_queries(identifiers)), 1)
+            self.assertGreater(len(fq._identifiers_queries(area={"Area 0"}, identifiers=identifiers)), 1)
+            for (method, args), journals in zip(queries, expected):
+                self.assertEqual(self.journals(method(*args)), journals)
+                self.assertEqual(self.journals(asyncio.run(getattr(async_fq, method.__name__)(*args))), journals)